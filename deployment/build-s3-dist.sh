@@ -277,6 +277,26 @@ if [ $? -ne 0 ]; then
 fi
 rm -rf ./dist
 
+echo "------------------------------------------------------------------------------"
+echo "Build file manager Lambda function"
+echo "------------------------------------------------------------------------------"
+
+# The file manager Lambda is deployed by the API into a per-filesystem stack.
+# Its code is packaged here rather than inlined in the manager template, which
+# CloudFormation would otherwise reject once it exceeds the 51,200 byte
+# TemplateBody limit.
+echo "Building file manager Lambda function"
+cd "$source_dir/api/chalicelib" || exit 1
+[ -e dist ] && rm -r dist
+mkdir -p dist
+zip -q -g ./dist/filemanagerlambda.zip ./efs_lambda.py
+cp "./dist/filemanagerlambda.zip" "$regional_dist_dir/filemanagerlambda.zip"
+if [ $? -ne 0 ]; then
+  echo "ERROR: Failed to build file manager Lambda package"
+  exit 1
+fi
+rm -rf ./dist
+
 #
 #echo "------------------------------------------------------------------------------"
 #echo "Website"
@@ -5,28 +5,103 @@ import os
 import logging
 import ipaddress
 import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent import futures
+from contextlib import contextmanager
 import botocore
 from botocore.config import Config
 import boto3
-from chalice import Chalice, ChaliceViewError, BadRequestError, IAMAuthorizer
+from chalice import Chalice, ChaliceViewError, BadRequestError, ConflictError, IAMAuthorizer
+from chalice.app import handle_extra_types
 
 
 # Misc global variables
 
 app = Chalice(app_name='api')
-app.log.setLevel(logging.DEBUG)
 TEMPLATE_PATH = os.path.join(
     os.path.dirname(__file__), 'chalicelib', 'file-manager-ap-lambda.template')
 
 SFM_CONFIG = json.loads(os.environ['botoConfig'])
 CONFIG = Config(**SFM_CONFIG)
 STACK_PREFIX = os.environ['stackPrefix']
+MANAGER_CODE_BUCKET = os.environ.get('managerCodeBucket', '')
+MANAGER_CODE_KEY = os.environ.get('managerCodeKey', '')
 MANAGER_STACK_PREFIX = '{prefix}-ManagedResources-'.format(prefix=STACK_PREFIX)
 
 DEFAULT_ERROR_MESSAGE = 'Check API logs for more information'
 
 DEFAULT_MISSING_PARAMS_ERROR_MESSAGE = 'Missing required query param: {e}'
 
+# Logging
+# Upload requests and download responses carry file content, which is never written to the logs
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+REDACTED_LOG_FIELDS = ('content', 'chunk_data')
+MAX_LOG_STRING = 256
+
+# Metrics
+# Proxied file operations are written as CloudWatch Embedded Metric Format log lines
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'SimpleFileManager')
+
+# Manager versions
+# The manager template's Description ends with its version, which list_stacks reports for every
+# stack. Stacks created by an earlier release run the inline manager code of their template and
+# answer newer operations with a null payload, they are updated in place to the current
+# template with PUT /filesystems/{filesystem_id}/lambda.
+
+MANAGER_TEMPLATE_VERSION = 2
+OUTDATED_MANAGER_MESSAGE = ('The file manager of this filesystem was deployed by an earlier release, '
+                            'update it from the file systems page before using it')
+MANAGER_STACK_PARAMETERS = ['FileSystemId', 'PosixUserUid', 'PosixUserGid', 'RootDirectoryPath',
+                            'VpcConfigSgIds', 'VpcConfigSubnetIds']
+
+# Long running operations
+# API Gateway ends a proxied request after 29 seconds, du, find, recursive delete, copy and
+# extract must return their continuation before then, with room left for the invoke and response
+
+MAX_PROXIED_TIME_BUDGET = 25  # seconds
+
+# Manager stack lookups
+# list_filesystems describes the manager stacks of a page of filesystems concurrently
+
+STACK_LOOKUP_WORKERS = 10  # describe_file_systems pages hold at most 10 filesystems
+STACK_LOOKUP_TIMEOUT = 5  # seconds
+
+# Mount target network checks
+# netinfo looks up the security groups of all mount targets concurrently and their rules in one call
+
+NETINFO_LOOKUP_WORKERS = 10
+SECURITY_GROUP_FILTER_VALUES = 200  # most values EC2 accepts in one filter
+NFS_PORT = 2049
+
+# every stack status but DELETE_COMPLETE, deleted stacks stay listed for 90 days
+LISTED_STACK_STATUSES = [
+    'CREATE_IN_PROGRESS', 'CREATE_FAILED', 'CREATE_COMPLETE', 'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED',
+    'ROLLBACK_COMPLETE', 'DELETE_IN_PROGRESS', 'DELETE_FAILED', 'UPDATE_IN_PROGRESS',
+    'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_COMPLETE', 'UPDATE_FAILED', 'UPDATE_ROLLBACK_IN_PROGRESS',
+    'UPDATE_ROLLBACK_FAILED', 'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS', 'UPDATE_ROLLBACK_COMPLETE',
+    'REVIEW_IN_PROGRESS', 'IMPORT_IN_PROGRESS', 'IMPORT_COMPLETE', 'IMPORT_ROLLBACK_IN_PROGRESS',
+    'IMPORT_ROLLBACK_FAILED', 'IMPORT_ROLLBACK_COMPLETE',
+]
+
+# Control plane cache
+# Reads of rarely changing EFS, EC2 and CloudFormation resources are kept in a warm container
+# for a few seconds to minutes, by API call
+
+CONTROL_PLANE_CACHE_TTLS = {
+    'describe_file_systems': 60,
+    'describe_stacks': 10,
+    'list_stacks': 30,  # the manager stack status index
+    'describe_mount_targets': 300,
+    'describe_mount_target_security_groups': 300,
+    'describe_security_group_rules': 30,
+}  # seconds
+CONTROL_PLANE_CACHE_MAX_ENTRIES = 1000
+
 # Cognito resources
 # From cloudformation stack
 
@@ -42,6 +117,170 @@ EC2 = boto3.client('ec2', config=CONFIG)
 
 # Helper functions
 
+def redact(value, key=None):
+    """
+    Copies a value for logging, replacing file content with its length and
+    truncating long strings
+
+    :param value: The value to copy
+    :param key: The key the value is stored under
+    :returns: The redacted value
+    """
+    if isinstance(value, Mapping):
+        return {item_key: redact(item_value, item_key) for item_key, item_value in value.items()}
+    if isinstance(value, BaseException):
+        value = '{name}: {error}'.format(name=type(value).__name__, error=value)
+    if key in REDACTED_LOG_FIELDS and isinstance(value, (str, bytes, bytearray)):
+        return '<redacted {length} characters>'.format(length=len(value))
+    if isinstance(value, (bytes, bytearray)):
+        return '<{length} bytes>'.format(length=len(value))
+    if isinstance(value, str) and len(value) > MAX_LOG_STRING:
+        return '{start}...<truncated {length} characters>'.format(
+            start=value[:MAX_LOG_STRING], length=len(value))
+    return value
+
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    Formats app.log records as single line JSON objects. Mapping messages, like
+    request parameters and operation payloads, become keys of the line.
+    """
+
+    def format(self, record):
+        entry = {"level": record.levelname, "logger": record.name}
+        if isinstance(record.msg, Mapping):
+            entry.update(redact(record.msg))
+        else:
+            entry['message'] = redact(record.getMessage())
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+for log_handler in app.log.handlers:
+    log_handler.setFormatter(JsonLogFormatter())
+app.log.setLevel(LOG_LEVEL if isinstance(logging.getLevelName(LOG_LEVEL), int) else logging.INFO)
+
+
+class OperationMetrics:
+    """
+    Phase timings and sizes of the current request, written as one CloudWatch
+    Embedded Metric Format line with the operation and filesystem id as
+    dimensions
+    """
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        """
+        Resets the metrics at the start of a request
+        """
+        self.operation = None
+        self.filesystem_id = None
+        self.started = time.perf_counter()
+        self.values = {}
+        self.units = {}
+
+    def add(self, name, value, unit='Count'):
+        """
+        Adds to a metric of the current request
+
+        :param name: The metric name
+        :param value: The value to add
+        :param unit: The CloudWatch unit of the metric
+        """
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = unit
+
+    def add_time(self, name, started):
+        """
+        Adds the milliseconds since started to a timing metric
+
+        :param name: The metric name
+        :param started: The time.perf_counter() value the phase started at
+        """
+        self.add(name, (time.perf_counter() - started) * 1000, 'Milliseconds')
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Times the enclosed block as a phase of the current request
+
+        :param name: The metric name
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, started)
+
+    def emit(self):
+        """
+        Prints the metrics of the current request as an EMF log line
+        """
+        self.add_time('Duration', self.started)
+        metrics = [{"Name": name, "Unit": unit} for name, unit in self.units.items()]
+        entry = {"_aws": {"Timestamp": int(time.time() * 1000),
+                          "CloudWatchMetrics": [{"Namespace": METRICS_NAMESPACE,
+                                                 "Dimensions": [["Operation", "FileSystemId"]],
+                                                 "Metrics": metrics}]},
+                 "Operation": self.operation, "FileSystemId": self.filesystem_id, "Tier": "api"}
+        entry.update((name, round(value, 3)) for name, value in self.values.items())
+        print(json.dumps(entry), flush=True)
+
+
+REQUEST_METRICS = OperationMetrics()
+
+
+@app.middleware('http')
+def record_operation_metrics(event, get_response):
+    """
+    Emits the metrics of requests proxied to a file manager lambda, and of
+    requests that read the control plane. The response body is encoded here,
+    the same way Chalice would, so encoding is timed as its own phase.
+
+    :param event: The request
+    :param get_response: Calls the next middleware or the route
+    :returns: The response
+    """
+    REQUEST_METRICS.start()
+    response = get_response(event)
+    if REQUEST_METRICS.operation is None:
+        if not REQUEST_METRICS.values:
+            return response
+        # control plane reads are reported by route, with the cache's totals since the container started
+        REQUEST_METRICS.operation = event.path
+        REQUEST_METRICS.filesystem_id = (event.uri_params or {}).get('filesystem_id')
+        app.log.debug({"message": "Control plane cache", "cache": CONTROL_PLANE_CACHE.stats()})
+
+    with REQUEST_METRICS.timer('ResponseEncodeTime'):
+        if not isinstance(response.body, (str, bytes)):
+            response.body = json.dumps(response.body, separators=(',', ':'), default=handle_extra_types)
+            response.headers.setdefault('Content-Type', 'application/json')
+    REQUEST_METRICS.add('ResponseBytes', len(response.body), 'Bytes')
+    REQUEST_METRICS.emit()
+    return response
+
+
+def clamp_time_budget(operation):
+    """
+    Caps the time budget of a long running operation at MAX_PROXIED_TIME_BUDGET
+
+    :param operation: The filesystem operation
+    :returns: The operation, copied if its time_budget was lowered
+    """
+    try:
+        time_budget = float(operation['time_budget'])
+    except (KeyError, TypeError, ValueError):
+        # without a budget the manager default applies, an invalid budget is rejected by the manager
+        return operation
+    # NaN compares false against any limit and would otherwise never expire
+    if not time_budget <= MAX_PROXIED_TIME_BUDGET:
+        return dict(operation, time_budget=MAX_PROXIED_TIME_BUDGET)
+    return operation
+
+
 def proxy_operation_to_efs_lambda(filesystem_id, operation):
     """
     Proxies file system operations to the file manager lambda associated to a
@@ -53,12 +292,20 @@ def proxy_operation_to_efs_lambda(filesystem_id, operation):
     :raises ChaliceViewError
     """
     lambda_name = '{filesystem}-manager-lambda'.format(filesystem=filesystem_id)
+    operation = clamp_time_budget(operation)
+    app.log.debug({"message": "Proxying operation", "function": lambda_name, "operation": operation})
+    payload = bytes(json.dumps(operation), encoding='utf-8')
+    REQUEST_METRICS.operation = operation['operation']
+    REQUEST_METRICS.filesystem_id = filesystem_id
+    REQUEST_METRICS.add_time('RequestParseTime', REQUEST_METRICS.started)
+    REQUEST_METRICS.add('RequestBytes', len(payload), 'Bytes')
     try:
-        response = SERVERLESS.invoke(
-            InvocationType='RequestResponse',
-            FunctionName=lambda_name,
-            Payload=bytes(json.dumps(operation), encoding='utf-8')
-        )
+        with REQUEST_METRICS.timer('InvokeTime'):
+            response = SERVERLESS.invoke(
+                InvocationType='RequestResponse',
+                FunctionName=lambda_name,
+                Payload=payload
+            )
     except botocore.exceptions.ClientError as error:
         app.log.error(error)
         raise ChaliceViewError(error)
@@ -66,11 +313,118 @@ def proxy_operation_to_efs_lambda(filesystem_id, operation):
     return response
 
 
-def format_filesystem_response(filesystem):
+class ControlPlaneCache:
+    """
+    In-process cache of control plane reads. Each entry expires after the TTL of
+    its resource, the least recently used entries are evicted beyond
+    max_entries. Failed calls are not cached.
+    """
+
+    def __init__(self, ttls, max_entries):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = {}
+        self.misses = {}
+        # stack statuses are looked up from several threads
+        self.lock = threading.Lock()
+
+    def get(self, resource, key, load):
+        """
+        Returns a cached value, loading and caching it on a miss
+
+        :param resource: The resource the value belongs to, selects the TTL
+        :param key: Identifies the value within the resource
+        :param load: Called without arguments to load the value on a miss
+        :returns: The value, shared between callers and not to be modified
+        """
+        cache_key = (resource, key)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(cache_key)
+                self.hits[resource] = self.hits.get(resource, 0) + 1
+                REQUEST_METRICS.add('ControlPlaneCacheHits', 1)
+                return entry[1]
+            self.misses[resource] = self.misses.get(resource, 0) + 1
+            REQUEST_METRICS.add('ControlPlaneCacheMisses', 1)
+
+        # concurrent misses of the same key each load it, the lock is not held across the call
+        started = time.perf_counter()
+        value = load()
+        with self.lock:
+            REQUEST_METRICS.add_time('ControlPlaneTime', started)
+            self.entries[cache_key] = (time.monotonic() + self.ttls[resource], value)
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, resource=None, key=None):
+        """
+        Drops cached values, so they are loaded again on the next read
+
+        :param resource: Optional resource to drop, all resources by default
+        :param key: Optional key within the resource, all keys by default
+        """
+        with self.lock:
+            for cache_key in list(self.entries):
+                if resource in (None, cache_key[0]) and key in (None, cache_key[1]):
+                    del self.entries[cache_key]
+
+    def stats(self):
+        """
+        Reports the hits, misses and cached entries of each resource since the
+        container started
+
+        :returns: Dict of counters by resource
+        """
+        with self.lock:
+            entries = {}
+            for resource, _ in self.entries:
+                entries[resource] = entries.get(resource, 0) + 1
+            return {resource: {"hits": self.hits.get(resource, 0), "misses": self.misses.get(resource, 0),
+                               "entries": entries.get(resource, 0)}
+                    for resource in self.ttls}
+
+
+CONTROL_PLANE_CACHE = ControlPlaneCache(CONTROL_PLANE_CACHE_TTLS, CONTROL_PLANE_CACHE_MAX_ENTRIES)
+
+
+def cached_call(method, **params):
+    """
+    Calls a read only AWS API through the control plane cache
+
+    :param method: The boto3 client method, its name selects the TTL
+    :param params: The call parameters, part of the cache key
+    :returns: The API response, shared between callers and not to be modified
+    :raises botocore.exceptions.ClientError
+    """
+    key = json.dumps(params, sort_keys=True, default=str)
+    return CONTROL_PLANE_CACHE.get(method.__name__, key, lambda: method(**params))
+
+
+def invalidate_manager_stack(filesystem_id):
+    """
+    Drops the cached status of a filesystem's manager stack, after the API
+    created or deleted it
+
+    :param filesystem_id: The id of the filesystem
+    """
+    key = json.dumps({"StackName": MANAGER_STACK_PREFIX + filesystem_id}, sort_keys=True, default=str)
+    CONTROL_PLANE_CACHE.invalidate('describe_stacks', key)
+    STACK_INDEX.invalidate()
+
+
+def format_filesystem_response(filesystem, stack_status, outdated=False):
     """
     Formats the response from EFS for a filesystem description
 
     :param filesystem: The filesystem response to format
+    :param stack_status: The status of the filesystem's manager stack, False if
+        it has none, None if it could not be retrieved
+    :param outdated: Whether the manager stack was deployed from an earlier
+        version of the manager template
     :returns: The formatted filesystem response
     """
     filesystem_id = filesystem['FileSystemId']
@@ -81,27 +435,168 @@ def format_filesystem_response(filesystem):
     except KeyError:
         pass
 
-    stack_status = describe_manager_stack(filesystem_id)
-
     lifecycle_state = filesystem['LifeCycleState']
 
-    if stack_status['Stacks'][0]['StackStatus'] is False:
+    if stack_status is None:
+        new_filesystem_object["managed"] = "Unknown"
+    elif stack_status is False:
         new_filesystem_object["managed"] = False
-    elif stack_status['Stacks'][0]['StackStatus'] == 'DELETE_IN_PROGRESS':
+    elif stack_status == 'DELETE_IN_PROGRESS':
         new_filesystem_object["managed"] = "Deleting"
-    elif stack_status['Stacks'][0]['StackStatus'] == 'CREATE_IN_PROGRESS':
+    elif stack_status == 'CREATE_IN_PROGRESS':
         new_filesystem_object["managed"] = "Creating"
-    elif stack_status['Stacks'][0]['StackStatus'] == 'UPDATE_IN_PROGRESS':
+    elif stack_status == 'UPDATE_IN_PROGRESS':
         new_filesystem_object["managed"] = "Updating"
-    elif stack_status['Stacks'][0]['StackStatus'] in ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE']:
+    elif stack_status in ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE']:
         new_filesystem_object["managed"] = True
 
+    new_filesystem_object["outdated"] = outdated
     new_filesystem_object["file_system_id"] = filesystem_id
     new_filesystem_object["lifecycle_state"] = lifecycle_state
 
     return new_filesystem_object
 
 
+class StackStatusIndex:
+    """
+    Statuses of all manager stacks by filesystem id, built from a single
+    paginated list_stacks sweep instead of a describe_stacks call per
+    filesystem. The index is kept in the control plane cache and invalidated
+    when the API creates, updates or deletes a manager stack.
+    """
+
+    def get(self):
+        """
+        Returns the index, sweeping the stacks again once it has expired
+
+        :returns: Dict of {"status", "outdated"} by filesystem id, filesystems
+            without a manager stack are absent
+        :raises botocore.exceptions.ClientError
+        """
+        return CONTROL_PLANE_CACHE.get('list_stacks', MANAGER_STACK_PREFIX, self.sweep)
+
+    def invalidate(self):
+        """
+        Drops the index, so the next read sweeps the stacks again
+        """
+        CONTROL_PLANE_CACHE.invalidate('list_stacks')
+
+    @staticmethod
+    def sweep():
+        """
+        Lists the stacks of the account and indexes the manager stacks
+
+        :returns: Dict of {"status", "outdated"} by filesystem id
+        """
+        stacks = {}
+        creation_times = {}
+        paginator = CFN.get_paginator('list_stacks')
+        for page in paginator.paginate(StackStatusFilter=LISTED_STACK_STATUSES):
+            for summary in page['StackSummaries']:
+                if not summary['StackName'].startswith(MANAGER_STACK_PREFIX):
+                    continue
+                filesystem_id = summary['StackName'][len(MANAGER_STACK_PREFIX):]
+                # a stack being deleted and its replacement share a name, the newer one wins
+                if filesystem_id in creation_times and creation_times[filesystem_id] >= summary['CreationTime']:
+                    continue
+                stacks[filesystem_id] = {"status": summary['StackStatus'],
+                                         "outdated": manager_template_outdated(summary.get('TemplateDescription'))}
+                creation_times[filesystem_id] = summary['CreationTime']
+        return stacks
+
+
+STACK_INDEX = StackStatusIndex()
+
+
+def manager_template_outdated(template_description):
+    """
+    Checks whether a manager stack was deployed from an earlier version of the
+    manager template
+
+    :param template_description: The Description of the stack's template
+    :returns: True if the description does not end with the current version
+    """
+    return not (template_description or '').endswith('(manager version {version})'.format(
+        version=MANAGER_TEMPLATE_VERSION))
+
+
+def manager_outdated(filesystem_id):
+    """
+    Looks up in the stack index whether a filesystem's manager was deployed by
+    an earlier release
+
+    :param filesystem_id: The id of the filesystem
+    :returns: True if the manager is outdated, False if it is current or the
+        index could not be built
+    """
+    try:
+        stack = STACK_INDEX.get().get(filesystem_id)
+    except botocore.exceptions.ClientError as error:
+        app.log.error(error)
+        return False
+    return stack is not None and stack['outdated']
+
+
+def describe_manager_stacks(filesystem_ids):
+    """
+    Describes the manager stacks of several filesystems concurrently, so a page
+    of filesystems costs one CloudFormation round trip instead of one per
+    filesystem. Each lookup gets STACK_LOOKUP_TIMEOUT seconds, a slow or failed
+    lookup does not fail the others.
+
+    :param filesystem_ids: The ids of the filesystems to describe
+    :returns: The stack statuses in the order of filesystem_ids, False for
+        filesystems without a manager stack, None for lookups that failed or
+        timed out
+    """
+    if not filesystem_ids:
+        return []
+
+    executor = futures.ThreadPoolExecutor(max_workers=min(STACK_LOOKUP_WORKERS, len(filesystem_ids)))
+    try:
+        lookups = [executor.submit(describe_manager_stack, filesystem_id) for filesystem_id in filesystem_ids]
+        deadline = time.monotonic() + STACK_LOOKUP_TIMEOUT
+        stack_statuses = []
+        for filesystem_id, lookup in zip(filesystem_ids, lookups):
+            try:
+                stack_status = lookup.result(timeout=max(0, deadline - time.monotonic()))
+            except futures.TimeoutError:
+                app.log.warning('Timed out describing the manager stack of {fs}'.format(fs=filesystem_id))
+                stack_status = None
+            except Exception as error:
+                app.log.error(error)
+                stack_status = None
+            # describe_manager_stack returns, rather than raises, errors other than a missing stack
+            if isinstance(stack_status, Exception):
+                app.log.error(stack_status)
+                stack_status = None
+            stack_statuses.append(None if stack_status is None else stack_status['Stacks'][0]['StackStatus'])
+    finally:
+        # lookups that missed the deadline are left to finish in the background
+        executor.shutdown(wait=False)
+
+    return stack_statuses
+
+
+def manager_stack_statuses(filesystem_ids):
+    """
+    Looks up the manager stack statuses of a page of filesystems in the stack
+    index, falling back to describing each stack if the index cannot be built
+
+    :param filesystem_ids: The ids of the filesystems
+    :returns: (status, outdated) in the order of filesystem_ids, the status is
+        False for filesystems without a manager stack and None when unknown
+    """
+    try:
+        stacks = STACK_INDEX.get()
+    except botocore.exceptions.ClientError as error:
+        app.log.error(error)
+        # without the index the template versions are unknown, only the statuses are shown
+        return [(stack_status, False) for stack_status in describe_manager_stacks(filesystem_ids)]
+    page_stacks = [stacks.get(filesystem_id) for filesystem_id in filesystem_ids]
+    return [(False, False) if stack is None else (stack['status'], stack['outdated']) for stack in page_stacks]
+
+
 def read_template_file():
     """
     Loads file manager managed resources template file
@@ -122,7 +617,8 @@ def describe_manager_stack(filesystem_id):
     stack_name = MANAGER_STACK_PREFIX + filesystem_id
 
     try:
-        response = CFN.describe_stacks(
+        response = cached_call(
+            CFN.describe_stacks,
             StackName=stack_name,
         )
     except botocore.exceptions.ClientError as error:
@@ -153,6 +649,7 @@ def delete_manager_stack(filesystem_id):
     except botocore.exceptions.ClientError as error:
         app.log.error(error)
         raise ChaliceViewError(error)
+    invalidate_manager_stack(filesystem_id)
     
     return response
 
@@ -203,6 +700,14 @@ def create_manager_stack(filesystem_id, uid, gid, path, subnet_ids, security_gro
                     'ParameterKey': 'VpcConfigSubnetIds',
                     'ParameterValue': ','.join(subnet_ids),
                 },
+                {
+                    'ParameterKey': 'CodeBucket',
+                    'ParameterValue': MANAGER_CODE_BUCKET,
+                },
+                {
+                    'ParameterKey': 'CodeKey',
+                    'ParameterValue': MANAGER_CODE_KEY,
+                },
             ],
             TimeoutInMinutes=15,
             Capabilities=[
@@ -213,10 +718,48 @@ def create_manager_stack(filesystem_id, uid, gid, path, subnet_ids, security_gro
     except botocore.exceptions.ClientError as error:
         app.log.error(error)
         raise ChaliceViewError(error)
+    invalidate_manager_stack(filesystem_id)
     
     return response
 
 
+def update_manager_stack(filesystem_id):
+    """
+    Updates a file manager managed resources stack to the current template and
+    manager code, keeping the access point and network settings it was created
+    with
+
+    :param filesystem_id: The id of the filesystem to update resources for
+    :returns: Update status
+    :raises ChaliceViewError, BadRequestError
+    """
+    stack_name = MANAGER_STACK_PREFIX + filesystem_id
+
+    template_body = read_template_file()
+    parameters = [{'ParameterKey': key, 'UsePreviousValue': True} for key in MANAGER_STACK_PARAMETERS]
+    # stacks of earlier releases have no code parameters, their manager was inline in the template
+    parameters.append({'ParameterKey': 'CodeBucket', 'ParameterValue': MANAGER_CODE_BUCKET})
+    parameters.append({'ParameterKey': 'CodeKey', 'ParameterValue': MANAGER_CODE_KEY})
+
+    try:
+        response = CFN.update_stack(
+            StackName=stack_name,
+            TemplateBody=template_body,
+            Parameters=parameters,
+            Capabilities=[
+                'CAPABILITY_NAMED_IAM',
+            ],
+        )
+    except botocore.exceptions.ClientError as error:
+        app.log.error(error)
+        if 'No updates are to be performed' in error.response['Error'].get('Message', ''):
+            raise BadRequestError('The file manager of this filesystem is already up to date')
+        raise ChaliceViewError(error)
+    invalidate_manager_stack(filesystem_id)
+
+    return response
+
+
 def format_operation_response(result, error_message):
     """
     Formats filesystem operation results from file manager lambda
@@ -229,9 +772,14 @@ def format_operation_response(result, error_message):
     response = {}
 
     status = result['StatusCode']
-    payload_encoded = result['Payload']
-    payload = json.loads(payload_encoded.read().decode("utf-8"))
-
+    with REQUEST_METRICS.timer('PayloadDecodeTime'):
+        payload_encoded = result['Payload'].read()
+        payload = json.loads(payload_encoded.decode("utf-8"))
+    REQUEST_METRICS.add('PayloadBytes', len(payload_encoded), 'Bytes')
+
+    if status == 200 and payload is None:
+        # managers deployed by an earlier release return nothing for operations they do not know
+        raise ConflictError(OUTDATED_MANAGER_MESSAGE)
     if status == 200:
         response = payload
     else:
@@ -241,60 +789,100 @@ def format_operation_response(result, error_message):
 
     return response
 
+def describe_mount_target_groups(mount_targets):
+    """
+    Looks up the security groups of several mount targets concurrently
+
+    :param mount_targets: The mount targets, as returned by describe_mount_targets
+    :returns: The security group ids of each mount target, in the order of mount_targets
+    :raises botocore.exceptions.ClientError
+    """
+    if not mount_targets:
+        return []
+
+    with futures.ThreadPoolExecutor(max_workers=min(NETINFO_LOOKUP_WORKERS, len(mount_targets))) as executor:
+        responses = executor.map(
+            lambda target: cached_call(EFS.describe_mount_target_security_groups, MountTargetId=target['MountTargetId']),
+            mount_targets
+        )
+        return [response['SecurityGroups'] for response in responses]
+
+
+def describe_group_rules(groups):
+    """
+    Fetches the rules of several security groups, with one
+    describe_security_group_rules call per SECURITY_GROUP_FILTER_VALUES groups
+
+    :param groups: The security group ids
+    :returns: Dict of the rules of each security group
+    :raises botocore.exceptions.ClientError
+    """
+    group_rules = {group: [] for group in groups}
+    group_ids = sorted(group_rules)
+    for start in range(0, len(group_ids), SECURITY_GROUP_FILTER_VALUES):
+        params = {'Filters': [{'Name': 'group-id', 'Values': group_ids[start:start + SECURITY_GROUP_FILTER_VALUES]}]}
+        while True:
+            response = cached_call(EC2.describe_security_group_rules, **params)
+            for rule in response['SecurityGroupRules']:
+                group_rules.setdefault(rule['GroupId'], []).append(rule)
+            if not response.get('NextToken'):
+                break
+            params['NextToken'] = response['NextToken']
+
+    return group_rules
+
 def check_rule_ports(rule):
-    if rule['IpProtocol'] == '-1' or rule['IpProtocol'] == 'tcp':
-            if rule['FromPort'] and rule['ToPort'] == 2049 or rule['FromPort'] and rule['ToPort'] == -1:
-                return True
-            elif rule['FromPort'] <= 2049 <= rule['ToPort']:
-                return True
-            else:
-                return False
-    
-    return False
+    """
+    Checks whether a security group rule opens the NFS port
 
-def check_ipv4_rule(rule, mount_target_ip):
-    subnet = rule['CidrIpv4']
-    if ipaddress.ip_address(mount_target_ip) in ipaddress.ip_network(subnet):
-        valid_port_access = check_rule_ports(rule)
-        return valid_port_access
-    
-    return False
+    :param rule: The rule, as returned by describe_security_group_rules
+    :returns: True if the rule allows NFS traffic
+    """
+    if rule['IpProtocol'] == '-1':
+        # all traffic, the ports are reported as -1
+        return True
+    if rule['IpProtocol'] == 'tcp':
+        return rule['FromPort'] <= NFS_PORT <= rule['ToPort']
 
-def check_sg_rule(rule):
-    ref_group_id = rule['ReferencedGroupInfo']['GroupId']
-    if ref_group_id == rule['GroupId']:
-        valid_port_access = check_rule_ports(rule)
-        
-        return valid_port_access
-    
     return False
 
-def test_nfs_access(group, mount_target_ip):
-    rules = EC2.describe_security_group_rules(
-        Filters=[
-                {
-                    'Name': 'group-id',
-                    'Values': [group]
-                }
-            ]
-        )
-
-    contains_valid_rule = False
 
-    for rule in rules['SecurityGroupRules']:
-        if contains_valid_rule:
-            break
-        else:
-            # check if rule is inbound
-            if rule['IsEgress'] is False:
-                if 'ReferencedGroupInfo' in rule:
-                    # references a sg in the rule
-                    contains_valid_rule = check_sg_rule(rule)
-                if 'CidrIpv4' in rule:
-                    # references an ipv4 subnet
-                    contains_valid_rule = check_ipv4_rule(rule, mount_target_ip)
+class NfsRuleSet:
+    """
+    The inbound rules of a security group that open the NFS port, compiled once
+    so each mount target address is checked with one set lookup per prefix
+    length rather than by parsing every rule again.
+    """
 
-    return contains_valid_rule
+    def __init__(self, group_id, rules):
+        self.group_id = group_id
+        self.referenced_groups = set()
+        networks = {}
+        for rule in rules:
+            if rule['IsEgress'] or not check_rule_ports(rule):
+                continue
+            if 'ReferencedGroupInfo' in rule:
+                self.referenced_groups.add(rule['ReferencedGroupInfo']['GroupId'])
+            if 'CidrIpv4' in rule:
+                network = ipaddress.IPv4Network(rule['CidrIpv4'], strict=False)
+                networks.setdefault(network.prefixlen, set()).add(int(network.network_address))
+        # (netmask, network addresses) of each prefix length, widest networks first
+        self.networks = [(int(ipaddress.IPv4Network('0.0.0.0/{prefix}'.format(prefix=prefix)).netmask), addresses)
+                         for prefix, addresses in sorted(networks.items())]
+
+    def allows(self, mount_target_ip):
+        """
+        Checks whether a mount target in this group accepts NFS traffic
+
+        :param mount_target_ip: The IPv4 address of the mount target
+        :returns: True if the group references itself or one of its networks
+            contains the mount target
+        """
+        # members of a self referencing group reach each other, whatever their address
+        if self.group_id in self.referenced_groups:
+            return True
+        address = int(ipaddress.IPv4Address(mount_target_ip))
+        return any((address & netmask) in addresses for netmask, addresses in self.networks)
 
 # Routes
 
@@ -320,12 +908,14 @@ def list_filesystems():
     
     try:
         if cursor:
-            response = EFS.describe_file_systems(
+            response = cached_call(
+                EFS.describe_file_systems,
                 MaxItems=10,
                 Marker=cursor
             )
         else:
-            response = EFS.describe_file_systems(
+            response = cached_call(
+                EFS.describe_file_systems,
                 MaxItems=10
             )
     except botocore.exceptions.ClientError as error:
@@ -333,15 +923,9 @@ def list_filesystems():
         raise ChaliceViewError(DEFAULT_ERROR_MESSAGE)
 
     filesystems = response['FileSystems']
-    formatted_filesystems = []
-    for filesystem in filesystems:
-        try:
-            formatted = format_filesystem_response(filesystem)
-        except botocore.exceptions.ClientError as error:
-            app.log.error(error)
-            raise ChaliceViewError(DEFAULT_ERROR_MESSAGE)
-
-        formatted_filesystems.append(formatted)
+    stack_statuses = manager_stack_statuses([filesystem['FileSystemId'] for filesystem in filesystems])
+    formatted_filesystems = [format_filesystem_response(filesystem, stack_status, outdated)
+                             for filesystem, (stack_status, outdated) in zip(filesystems, stack_statuses)]
     
     if 'NextMarker' in response:
         pagination_token = response['NextMarker']
@@ -360,7 +944,8 @@ def describe_filesystem(filesystem_id):
     :raises ChaliceViewError
     """
     try:
-        response = EFS.describe_file_systems(
+        response = cached_call(
+            EFS.describe_file_systems,
             FileSystemId=filesystem_id
         )
     except botocore.exceptions.ClientError as error:
@@ -382,7 +967,8 @@ def get_netinfo_for_filesystem(filesystem_id):
     """
     mount_target_info = []
     try:
-        response = EFS.describe_mount_targets(
+        response = cached_call(
+            EFS.describe_mount_targets,
             FileSystemId=filesystem_id
         )
     except botocore.exceptions.ClientError as error:
@@ -390,26 +976,22 @@ def get_netinfo_for_filesystem(filesystem_id):
         raise ChaliceViewError
     mount_targets = response['MountTargets']
     app.log.debug(mount_targets)
-    for target in mount_targets:
+    try:
+        target_groups = describe_mount_target_groups(mount_targets)
+        # mount targets often share security groups, each group's rules are fetched once
+        group_rules = describe_group_rules({group for groups in target_groups for group in groups})
+    except botocore.exceptions.ClientError as error:
+        app.log.debug(error)
+        raise ChaliceViewError
+
+    rule_sets = {group: NfsRuleSet(group, rules) for group, rules in group_rules.items()}
+
+    for target, security_groups in zip(mount_targets, target_groups):
         mount_target_id = target['MountTargetId']
         mount_target_ip = target['IpAddress']
 
-        try:
-            response = EFS.describe_mount_target_security_groups(
-                MountTargetId=mount_target_id
-            )
-        except botocore.exceptions.ClientError as error:
-            app.log.debug(error)
-            raise ChaliceViewError
-        
-        security_groups = response['SecurityGroups']
-        
         # test security groups to see if the mount target can be used
-        valid_security_groups = []
-        for group in security_groups:
-            is_valid_group = test_nfs_access(group, mount_target_ip)
-            if is_valid_group:
-                valid_security_groups.append(group)
+        valid_security_groups = [group for group in security_groups if rule_sets[group].allows(mount_target_ip)]
         
         mount_target_item = {'{id}'.format(id=mount_target_id): {'security_groups': \
             valid_security_groups, 'subnet_id': target['SubnetId']}}
@@ -478,6 +1060,26 @@ def delete_filesystem_lambda(filesystem_id):
         raise BadRequestError('No valid managed stack for this filesystem')
 
 
+@app.route('/filesystems/{filesystem_id}/lambda', methods=['PUT'], cors=True, \
+    authorizer=AUTHORIZER)
+def update_filesystem_lambda(filesystem_id):
+    """
+    Updates the filesystem manager to the current release with the
+    update_manager_stack helper function
+
+    :param filesystem_id: The filesystem to update resources for
+    :returns: Update response
+    :raises ChaliceViewError, BadRequestError
+    """
+    stack_status = describe_manager_stack(filesystem_id)
+    if isinstance(stack_status, Exception):
+        raise stack_status
+    if stack_status['Stacks'][0]['StackStatus'] not in ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE']:
+        raise BadRequestError('No valid managed stack for this filesystem')
+
+    return update_manager_stack(filesystem_id)
+
+
 @app.route('/objects/{filesystem_id}/upload', methods=["POST"], cors=True, authorizer=AUTHORIZER)
 def upload(filesystem_id):
     """
@@ -489,7 +1091,7 @@ def upload(filesystem_id):
     :returns: Filesystem operation response
     :raises ChaliceViewError, BadRequestError
     """
-    print(app.current_request.query_params)
+    app.log.debug(app.current_request.query_params)
     try:
         path = app.current_request.query_params['path']
         filename = app.current_request.query_params['filename']
@@ -501,6 +1103,10 @@ def upload(filesystem_id):
     chunk_data = request.json_body
     chunk_data["filename"] = filename
 
+    # managers of earlier releases append chunks in arrival order, parallel chunks would corrupt the file
+    if manager_outdated(filesystem_id):
+        raise ConflictError(OUTDATED_MANAGER_MESSAGE)
+
     filemanager_event = {"operation": "upload", "path": path, "chunk_data": chunk_data}
 
     operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
@@ -509,6 +1115,29 @@ def upload(filesystem_id):
     return format_operation_response(operation_result, error_message)
 
 
+@app.route('/objects/{filesystem_id}/upload/status', methods=["GET"], cors=True, authorizer=AUTHORIZER)
+def upload_status(filesystem_id):
+    """
+    Reports which chunks of an in progress upload are already on disk
+
+    :param filesystem_id: The filesystem to perform operation on
+    :param dzuuid: The id of the upload
+    :returns: Filesystem operation response
+    :raises ChaliceViewError, BadRequestError
+    """
+    try:
+        upload_id = app.current_request.query_params['dzuuid']
+    except (KeyError, TypeError) as error:
+        app.log.error(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
+        raise BadRequestError(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
+
+    filemanager_event = {"operation": "upload_status", "dzuuid": upload_id}
+    operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
+    error_message = "Error retrieving upload status"
+
+    return format_operation_response(operation_result, error_message)
+
+
 @app.route('/objects/{filesystem_id}/download', methods=["GET"], cors=True, authorizer=AUTHORIZER)
 def download(filesystem_id):
     """
@@ -517,6 +1146,12 @@ def download(filesystem_id):
     :param filesystem_id: The filesystem to perform operation on
     :param path: The path to download the file
     :param filename: The name of the file
+    :param chunk_size: Optional preferred chunk size in bytes, the manager lambda
+        clamps it to the largest chunk that fits in a response and echoes it back
+    :param plan: When set, returns the size, chunk size, chunk count and validator
+        of the file instead of file content
+    :param chunk_index: Index of a chunk of a planned download, requires validator
+    :param validator: The validator returned by the plan
     :returns: Filesystem operation response
     :raises ChaliceViewError, BadRequestError
     """
@@ -531,26 +1166,77 @@ def download(filesystem_id):
         app.log.error(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
         raise BadRequestError(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
 
+    filemanager_event = {"operation": "download", "path": path, "filename": filename}
+
+    if 'chunk_size' in query_params:
+        filemanager_event['chunk_size'] = query_params['chunk_size']
+
+    if 'plan' in query_params:
+        filemanager_event['operation'] = 'download_plan'
+    elif 'chunk_index' in query_params:
+        try:
+            filemanager_event['validator'] = query_params['validator']
+        except KeyError as error:
+            app.log.error(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
+            raise BadRequestError(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
+        filemanager_event['operation'] = 'download_chunk'
+        filemanager_event['chunk_index'] = query_params['chunk_index']
+
     try:
         chunk_index = query_params['dzchunkindex']
         chunk_offset = query_params['dzchunkbyteoffset']
     except KeyError:
-        filemanager_event = {"operation": "download", "path": path, "filename": filename}
-        operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
-        payload_encoded = operation_result['Payload']
-        payload = json.loads(payload_encoded.read().decode("utf-8"))
-        return payload
-
-    filemanager_event = {"operation": "download", "path": path, "filename": filename, \
-                            "chunk_data": {"dzchunkindex": int(chunk_index), \
-                                "dzchunkbyteoffset": int(chunk_offset)}}
+        pass
+    else:
+        filemanager_event['chunk_data'] = {"dzchunkindex": int(chunk_index), \
+            "dzchunkbyteoffset": int(chunk_offset)}
+
     operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
-    payload_encoded = operation_result['Payload']
-    payload = json.loads(payload_encoded.read().decode("utf-8"))
+    with REQUEST_METRICS.timer('PayloadDecodeTime'):
+        payload_encoded = operation_result['Payload'].read()
+        payload = json.loads(payload_encoded.decode("utf-8"))
+    REQUEST_METRICS.add('PayloadBytes', len(payload_encoded), 'Bytes')
     
     return payload
 
 
+@app.route('/objects/{filesystem_id}/archive', methods=['POST'], cors=True, authorizer=AUTHORIZER)
+def download_archive(filesystem_id):
+    """
+    Downloads a directory as a ZIP archive, one chunk per call. The archive is
+    generated as it is downloaded, each response holds the cursor of the next
+    chunk until it is complete.
+
+    :param filesystem_id: The filesystem to perform operation on
+    :param path: The parent directory of the directory to archive
+    :param name: The name of the directory to archive
+    :param compression: Optional, store or deflate (default)
+    :param cursor: The cursor returned with the previous chunk
+    :param chunk_size: Optional maximum chunk size in bytes
+    :returns: Filesystem operation response
+    :raises ChaliceViewError, BadRequestError
+    """
+    archive_data = app.current_request.json_body
+
+    try:
+        path = archive_data['path']
+        name = archive_data['name']
+    except (KeyError, TypeError) as error:
+        app.log.error('Missing required param: {e}'.format(e=error))
+        raise BadRequestError('Missing required param: {e}'.format(e=error))
+
+    filemanager_event = {"operation": "archive", "path": path, "name": name}
+
+    for param in ['compression', 'cursor', 'chunk_size']:
+        if param in archive_data:
+            filemanager_event[param] = archive_data[param]
+
+    operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
+    error_message = "Error archiving directory"
+
+    return format_operation_response(operation_result, error_message)
+
+
 @app.route('/objects/{filesystem_id}/dir', methods=['POST'], cors=True, authorizer=AUTHORIZER)
 def make_dir(filesystem_id):
     """
@@ -582,46 +1268,292 @@ def make_dir(filesystem_id):
 @app.route('/objects/{filesystem_id}', methods=['DELETE'], cors=True, authorizer=AUTHORIZER)
 def delete_object(filesystem_id):
     """
-    Deletes a file
+    Deletes a file, or a directory tree when recursive is set
 
     :param filesystem_id: The filesystem to perform operation on
     :param path: The path to delete the file
     :param filename: The name of the file
+    :param recursive: Optional, set to true to delete a directory and its contents
+    :param continuation: Optional token returned by a previous partial recursive delete
+    :param time_budget: Optional number of seconds to spend before returning progress
     :returns: Filesystem operation response
     :raises ChaliceViewError, BadRequestError
     """
+    query_params = app.current_request.query_params
+
     try:
-        name = app.current_request.query_params['name']
-        path = app.current_request.query_params['path']
-    except KeyError as error:
+        name = query_params['name']
+        path = query_params['path']
+    except (KeyError, TypeError) as error:
         app.log.error(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
         raise BadRequestError(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
     
     filemanager_event = {"operation": "delete", "path": path, "name": name}
+
+    if query_params.get('recursive', 'false').lower() == 'true':
+        filemanager_event['recursive'] = True
+        for param in ['continuation', 'time_budget']:
+            if param in query_params:
+                filemanager_event[param] = query_params[param]
+
     operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
     error_message = "Error deleting file"
 
     return format_operation_response(operation_result, error_message)
 
 
+@app.route('/objects/{filesystem_id}/move', methods=['POST'], cors=True, authorizer=AUTHORIZER)
+def move_object(filesystem_id):
+    """
+    Renames or moves a file or directory within the filesystem
+
+    :param filesystem_id: The filesystem to perform operation on
+    :param path: The directory of the object
+    :param name: The name of the object
+    :param new_path: Optional target directory, defaults to path
+    :param new_name: Optional target name, defaults to name
+    :returns: Filesystem operation response
+    :raises ChaliceViewError, BadRequestError
+    """
+    move_data = app.current_request.json_body
+
+    try:
+        path = move_data['path']
+        name = move_data['name']
+    except (KeyError, TypeError) as error:
+        app.log.error('Missing required param: {e}'.format(e=error))
+        raise BadRequestError('Missing required param: {e}'.format(e=error))
+
+    if 'new_path' not in move_data and 'new_name' not in move_data:
+        raise BadRequestError('Missing required param: new_path or new_name')
+
+    filemanager_event = {"operation": "move", "path": path, "name": name,
+                         "new_path": move_data.get('new_path', path)}
+
+    if 'new_name' in move_data:
+        filemanager_event['new_name'] = move_data['new_name']
+
+    operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
+    error_message = "Error moving object"
+
+    return format_operation_response(operation_result, error_message)
+
+
+@app.route('/objects/{filesystem_id}/copy', methods=['POST'], cors=True, authorizer=AUTHORIZER)
+def copy_object(filesystem_id):
+    """
+    Copies a file within the filesystem without transferring its content
+    through the API. Large files are copied over several calls.
+
+    :param filesystem_id: The filesystem to perform operation on
+    :param path: The directory of the file
+    :param name: The name of the file
+    :param new_path: Optional target directory, defaults to path
+    :param new_name: Optional target name, defaults to name
+    :param continuation: Optional token returned by a previous partial copy
+    :param time_budget: Optional number of seconds to spend before returning progress
+    :returns: Filesystem operation response
+    :raises ChaliceViewError, BadRequestError
+    """
+    copy_data = app.current_request.json_body
+
+    try:
+        path = copy_data['path']
+        name = copy_data['name']
+    except (KeyError, TypeError) as error:
+        app.log.error('Missing required param: {e}'.format(e=error))
+        raise BadRequestError('Missing required param: {e}'.format(e=error))
+
+    filemanager_event = {"operation": "copy", "path": path, "name": name}
+
+    for param in ['new_path', 'new_name', 'continuation', 'time_budget']:
+        if param in copy_data:
+            filemanager_event[param] = copy_data[param]
+
+    operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
+    error_message = "Error copying file"
+
+    return format_operation_response(operation_result, error_message)
+
+
+@app.route('/objects/{filesystem_id}/extract', methods=['POST'], cors=True, authorizer=AUTHORIZER)
+def extract_archive(filesystem_id):
+    """
+    Extracts an uploaded zip or tar archive into a directory of the filesystem.
+    Large archives are extracted over several calls.
+
+    :param filesystem_id: The filesystem to perform operation on
+    :param path: The directory of the archive
+    :param name: The name of the archive
+    :param new_path: Optional target directory, defaults to path
+    :param overwrite: Optional flag to replace existing files, defaults to false
+    :param continuation: Optional token returned by a previous partial extraction
+    :param time_budget: Optional number of seconds to spend before returning progress
+    :returns: Filesystem operation response
+    :raises ChaliceViewError, BadRequestError
+    """
+    extract_data = app.current_request.json_body
+
+    try:
+        path = extract_data['path']
+        name = extract_data['name']
+    except (KeyError, TypeError) as error:
+        app.log.error('Missing required param: {e}'.format(e=error))
+        raise BadRequestError('Missing required param: {e}'.format(e=error))
+
+    filemanager_event = {"operation": "extract", "path": path, "name": name}
+
+    for param in ['new_path', 'overwrite', 'continuation', 'time_budget']:
+        if param in extract_data:
+            filemanager_event[param] = extract_data[param]
+
+    operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
+    error_message = "Error extracting archive"
+
+    return format_operation_response(operation_result, error_message)
+
+
 @app.route('/objects/{filesystem_id}', methods=['GET'], cors=True, authorizer=AUTHORIZER)
 def list_objects(filesystem_id):
     """
-    Lists files in a specifed path
+    Lists files in a specifed path, one page at a time
 
     :param filesystem_id: The filesystem to perform operation on
     :param path: The path to list
+    :param cursor: Optional cursor returned by the previous page
+    :param page_size: Optional maximum number of entries to return
+    :param sort: Optional sort key, one of name, size or mtime
+    :param order: Optional sort order, asc or desc
+    :param prefix: Optional name prefix filter
+    :param pattern: Optional glob filter for names
+    :param limit: Optional number of top entries to return instead of a page
     :returns: Filesystem operation response
     :raises ChaliceViewError, BadRequestError
     """
+    query_params = app.current_request.query_params
+
     try:
-        path = app.current_request.query_params['path']
+        path = query_params['path']
     except KeyError as error:
         app.log.error(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
         raise BadRequestError(DEFAULT_MISSING_PARAMS_ERROR_MESSAGE.format(e=error))
 
     filemanager_event = {"operation": "list", "path": path}
+
+    for param in ['cursor', 'page_size', 'sort', 'order', 'prefix', 'pattern', 'limit']:
+        if param in query_params:
+            filemanager_event[param] = query_params[param]
+
     operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
     error_message = "Error listing files"
 
     return format_operation_response(operation_result, error_message)
+
+
+@app.route('/objects/{filesystem_id}/du', methods=['POST'], cors=True, authorizer=AUTHORIZER)
+def disk_usage(filesystem_id):
+    """
+    Computes recursive disk usage for the children of a directory
+
+    :param filesystem_id: The filesystem to perform operation on
+    :param path: The directory to summarize
+    :param continuation: Optional token returned by a previous partial response
+    :param time_budget: Optional number of seconds to spend before returning partial results
+    :returns: Filesystem operation response
+    :raises ChaliceViewError, BadRequestError
+    """
+    du_data = app.current_request.json_body
+
+    try:
+        path = du_data['path']
+    except (KeyError, TypeError) as error:
+        app.log.error('Missing required param: {e}'.format(e=error))
+        raise BadRequestError('Missing required param: {e}'.format(e=error))
+
+    filemanager_event = {"operation": "du", "path": path}
+
+    for param in ['continuation', 'time_budget']:
+        if param in du_data:
+            filemanager_event[param] = du_data[param]
+
+    operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
+    error_message = "Error computing disk usage"
+
+    return format_operation_response(operation_result, error_message)
+
+
+@app.route('/objects/{filesystem_id}/search', methods=['POST'], cors=True, authorizer=AUTHORIZER)
+def search_objects(filesystem_id):
+    """
+    Searches a directory tree for entries by name, type, size and modification time,
+    one page of matches at a time
+
+    :param filesystem_id: The filesystem to perform operation on
+    :param path: The directory to search under
+    :param pattern: Optional glob the entry names must match, e.g. *.parquet
+    :param regex: Optional regular expression searched for in the entry names
+    :param type: Optional entry type, one of file, directory, symlink or other
+    :param min_size: Optional minimum size in bytes
+    :param max_size: Optional maximum size in bytes
+    :param modified_after: Optional earliest modification time, in seconds since the epoch
+    :param modified_before: Optional latest modification time, in seconds since the epoch
+    :param page_size: Optional maximum number of matches to return
+    :param cursor: Optional cursor returned by the previous page
+    :param time_budget: Optional number of seconds to spend before returning a partial page
+    :returns: Filesystem operation response
+    :raises ChaliceViewError, BadRequestError
+    """
+    search_data = app.current_request.json_body
+
+    try:
+        path = search_data['path']
+    except (KeyError, TypeError) as error:
+        app.log.error('Missing required param: {e}'.format(e=error))
+        raise BadRequestError('Missing required param: {e}'.format(e=error))
+
+    filemanager_event = {"operation": "find", "path": path}
+
+    for param in ['pattern', 'regex', 'type', 'min_size', 'max_size', 'modified_after', 'modified_before',
+                  'page_size', 'cursor', 'time_budget']:
+        if param in search_data:
+            filemanager_event[param] = search_data[param]
+
+    operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
+    error_message = "Error searching files"
+
+    return format_operation_response(operation_result, error_message)
+
+
+@app.route('/objects/{filesystem_id}/batch', methods=['POST'], cors=True, authorizer=AUTHORIZER)
+def batch(filesystem_id):
+    """
+    Runs several delete, make_dir, stat or rename operations in one invocation
+    of the file manager lambda
+
+    :param filesystem_id: The filesystem to perform operation on
+    :param operations: List of operations, each with an operation name and its
+        path and name params
+    :param workers: Optional number of operations to run concurrently
+    :returns: Filesystem operation response with a result per operation
+    :raises ChaliceViewError, BadRequestError
+    """
+    batch_data = app.current_request.json_body
+
+    try:
+        operations = batch_data['operations']
+    except (KeyError, TypeError) as error:
+        app.log.error('Missing required param: {e}'.format(e=error))
+        raise BadRequestError('Missing required param: {e}'.format(e=error))
+
+    if not isinstance(operations, list):
+        raise BadRequestError('operations must be a list')
+
+    filemanager_event = {"operation": "batch", "operations": operations}
+
+    if 'workers' in batch_data:
+        filemanager_event['workers'] = batch_data['workers']
+
+    operation_result = proxy_operation_to_efs_lambda(filesystem_id, filemanager_event)
+    error_message = "Error running batch operations"
+
+    return format_operation_response(operation_result, error_message)
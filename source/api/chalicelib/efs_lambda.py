@@ -3,21 +3,371 @@
 
 import os
 import base64
+import binascii
+import bisect
+import builtins
+import errno
+import fnmatch
+import functools
+import heapq
+import json
+import logging
 import math
+import re
+import resource
+import shutil
+import stat
+import struct
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 # File manager operation events:
-# list: {"operation": "list", "path": "$dir"}
-# upload: {"operation": "upload", "path": "$dir", "form_data": "$form_data"}
+# list: {"operation": "list", "path": "$dir", "cursor": "$cursor", "page_size": $page_size}
+# upload: {"operation": "upload", "path": "$dir", "chunk_data": "$chunk_data"}
+# download_plan: {"operation": "download_plan", "path": "$dir", "filename": "$filename"}
+# download_chunk: {"operation": "download_chunk", "path": "$dir", "filename": "$filename", "chunk_index": $index, "validator": "$validator"}
+# upload_status: {"operation": "upload_status", "dzuuid": "$dzuuid"}
+# find: {"operation": "find", "path": "$dir", "pattern": "*.parquet", "cursor": "$cursor", "page_size": $page_size, "time_budget": $seconds}
+# du: {"operation": "du", "path": "$dir", "continuation": "$token", "time_budget": $seconds, "workers": $workers}
+# delete: {"operation": "delete", "path": "$dir", "name": "$name", "recursive": true, "continuation": "$token", "time_budget": $seconds, "workers": $workers}
+# stat: {"operation": "stat", "path": "$dir", "name": "$name"}
+# rename: {"operation": "rename", "path": "$dir", "name": "$name", "new_name": "$new_name"}
+# move: {"operation": "move", "path": "$dir", "name": "$name", "new_path": "$new_dir", "new_name": "$new_name"}
+# archive: {"operation": "archive", "path": "$dir", "name": "$name", "compression": "store|deflate", "cursor": "$cursor"}
+# extract: {"operation": "extract", "path": "$dir", "name": "$archive", "new_path": "$target_dir", "overwrite": false, "continuation": "$token", "time_budget": $seconds, "workers": $workers}
+# copy: {"operation": "copy", "path": "$dir", "name": "$name", "new_path": "$new_dir", "new_name": "$new_name", "continuation": "$token", "time_budget": $seconds}
+# batch: {"operation": "batch", "operations": [{"operation": "delete", "path": "$dir", "name": "$name"}, ...], "workers": $workers}
+
+DEFAULT_PAGE_SIZE = 1000  # entries per list page
+MAX_PAGE_SIZE = 5000
+SORT_KEYS = ['name', 'size', 'mtime']
+# requests proxied through API Gateway must answer within its 29 second integration timeout,
+# the API caps their budget below it, direct invocations may use more of the 60 second lambda timeout
+DEFAULT_TIME_BUDGET = 20  # seconds
+MAX_TIME_BUDGET = 50  # seconds
+DEFAULT_WORKERS = 16
+MAX_WORKERS = 64
+MAX_BATCH_SIZE = 1000  # sub-operations per batch
+BATCH_OPERATIONS = ['delete', 'make_dir', 'stat', 'rename']
+# fields of long running operations, a batch item must stay a single metadata call
+BATCH_ITEM_EXCLUDED_FIELDS = ['recursive', 'continuation', 'time_budget', 'workers']
+LISTING_CACHE_MAX_ENTRIES = 100000  # total entries held across all cached list pages
+FILE_HANDLE_CACHE_SIZE = 32  # open download files kept between invocations
+FILE_HANDLE_IDLE_TIMEOUT = 30  # seconds
+# largest download chunk whose base64 encoding, plus the JSON envelope added here and by the
+# API proxy, fits in a synchronous lambda response. Base64 turns every 3 bytes into 4, the
+# chunk is kept a multiple of 3 and of the 4 KiB page size.
+MAX_RESPONSE_BYTES = 6291456
+RESPONSE_ENVELOPE_RESERVE = 16384
+MAX_DOWNLOAD_CHUNK_SIZE = (MAX_RESPONSE_BYTES - RESPONSE_ENVELOPE_RESERVE) // 4 * 3 // 12288 * 12288
+UPLOAD_DECODE_BLOCK_SIZE = 262144  # base64 characters decoded per write, a multiple of 4
+ARCHIVE_BLOCK_SIZE = 65536  # file bytes compressed at a time in deflate archives
+ZIP64_LIMIT = 0xFFFFFFFF
+# deflate can grow incompressible data slightly, files this large get zip64 sizes up front
+ZIP64_FILE_THRESHOLD = 0xF0000000
+ZIP_EPOCH = 315532800  # 1980-01-01, the earliest time a ZIP entry can hold
+COPY_BLOCK_SIZE = 67108864  # bytes copied in the kernel between time budget checks
+COPY_BUFFER_SIZE = 1048576  # bytes per read and write when the kernel cannot copy
+EXTRACT_INLINE_SIZE = 1048576  # archive members up to this size are read whole and written on the worker pool
+TAR_COMPRESSION_MAGIC = [(b'\x1f\x8b', 'gz'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'xz')]
+# where the access point is mounted, moves, copies and extracts never write outside it
+MOUNT_PATH = os.environ.get('MOUNT_PATH', '/mnt/efs')
+# staging files and chunk ledgers of in progress uploads, on the same filesystem as the
+# targets so finished uploads are moved into place with an atomic rename. The directory sits
+# in the browsed tree, so listings and walks skip it and operations cannot reach into it.
+UPLOAD_SESSION_DIR = os.environ.get('UPLOAD_SESSION_DIR', os.path.join(MOUNT_PATH, '.sfm-uploads'))
+UPLOAD_ID_PATTERN = re.compile(r'^[A-Za-z0-9-]{1,64}$')
+# sessions without a new chunk for this long are removed, so are finished sessions
+UPLOAD_SESSION_MAX_AGE = int(os.environ.get('UPLOAD_SESSION_MAX_AGE', 86400))  # seconds
+UPLOAD_SESSION_GC_INTERVAL = 900  # seconds between sweeps in a warm container
+LAST_UPLOAD_SESSION_GC = 0
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# file content is never written to the logs, other long strings are cut to MAX_LOG_STRING characters
+REDACTED_LOG_FIELDS = ('content', 'chunk_data')
+MAX_LOG_STRING = 256
+# per-chunk messages are logged for the first, last and every CHUNK_LOG_SAMPLE_RATE-th chunk,
+# and for every chunk at DEBUG
+CHUNK_LOG_SAMPLE_RATE = max(1, int(os.environ.get('CHUNK_LOG_SAMPLE_RATE', 100)))
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'SimpleFileManager')
+FILE_SYSTEM_ID = os.environ.get('FILE_SYSTEM_ID', 'unknown')
+
+
+def redact(value, key=None):
+    """Copies a log field, replacing file content with its length and truncating long strings"""
+    if isinstance(value, dict):
+        return {item_key: redact(item_value, item_key) for item_key, item_value in value.items()}
+    if isinstance(value, BaseException):
+        value = '{name}: {error}'.format(name=type(value).__name__, error=value)
+    if key in REDACTED_LOG_FIELDS and isinstance(value, (str, bytes, bytearray)):
+        return '<redacted {length} characters>'.format(length=len(value))
+    if isinstance(value, (bytes, bytearray)):
+        return '<{length} bytes>'.format(length=len(value))
+    if isinstance(value, str) and len(value) > MAX_LOG_STRING:
+        return '{start}...<truncated {length} characters>'.format(start=value[:MAX_LOG_STRING], length=len(value))
+    return value
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object holding its redacted fields"""
+
+    def format(self, record):
+        entry = {"level": record.levelname, "message": redact(record.getMessage())}
+        entry.update(redact(getattr(record, 'fields', {})))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StdoutLogHandler(logging.Handler):
+    """Prints records to stdout, which the lambda runtime sends to CloudWatch Logs"""
+
+    def emit(self, record):
+        try:
+            print(self.format(record), flush=True)
+        except Exception:
+            self.handleError(record)
+
+
+LOGGER = logging.getLogger('efs_lambda')
+if not LOGGER.handlers:
+    LOG_HANDLER = StdoutLogHandler()
+    LOG_HANDLER.setFormatter(JsonLogFormatter())
+    LOGGER.addHandler(LOG_HANDLER)
+# the runtime's root handler would log every record a second time in its own text format
+LOGGER.propagate = False
+LOGGER.setLevel(LOG_LEVEL if isinstance(logging.getLevelName(LOG_LEVEL), int) else logging.INFO)
+
+
+def log(level, message, **fields):
+    """Logs message with fields as keys of its JSON line"""
+    LOGGER.log(level, message, extra={"fields": fields})
+
+
+def log_chunk(message, chunk_index, total_chunks, **fields):
+    """Logs a per-chunk message, sampled at INFO to keep large transfers from flooding the logs"""
+    sampled = chunk_index % CHUNK_LOG_SAMPLE_RATE == 0 or chunk_index == total_chunks - 1
+    level = logging.INFO if sampled else logging.DEBUG
+    if LOGGER.isEnabledFor(level):
+        log(level, message, chunk_index=chunk_index, total_chunks=total_chunks, **fields)
+
+
+class OperationMetrics:
+    """
+    Phase timings and counters of the current invocation, written as one CloudWatch Embedded
+    Metric Format line with the operation and filesystem id as dimensions. Only the handler
+    thread records, work fanned out to threads is timed as a whole by its caller. Metrics of
+    the container rather than the invocation are only dimensioned by the filesystem id.
+    """
+
+    def __init__(self):
+        self.start(None)
+
+    def start(self, operation):
+        self.operation = operation
+        self.thread = threading.get_ident()
+        self.started = time.perf_counter()
+        self.values = {}
+        self.units = {}
+        self.container_units = {}
+
+    def add(self, name, value, unit='Count'):
+        if threading.get_ident() != self.thread:
+            return
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = unit
+
+    def add_time(self, name, started):
+        self.add(name, (time.perf_counter() - started) * 1000, 'Milliseconds')
+
+    def set_container(self, name, value, unit):
+        self.values[name] = value
+        self.container_units[name] = unit
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, started)
+
+    def emit(self):
+        self.add_time('Duration', self.started)
+        directives = [{"Namespace": METRICS_NAMESPACE, "Dimensions": [["Operation", "FileSystemId"]],
+                       "Metrics": [{"Name": name, "Unit": unit} for name, unit in self.units.items()]}]
+        if self.container_units:
+            directives.append({"Namespace": METRICS_NAMESPACE, "Dimensions": [["FileSystemId"]],
+                               "Metrics": [{"Name": name, "Unit": unit} for name, unit in self.container_units.items()]})
+        entry = {"_aws": {"Timestamp": int(time.time() * 1000), "CloudWatchMetrics": directives},
+                 "Operation": self.operation, "FileSystemId": FILE_SYSTEM_ID, "Tier": "manager"}
+        entry.update((name, round(value, 3)) for name, value in self.values.items())
+        print(json.dumps(entry), flush=True)
+
+
+METRICS = OperationMetrics()
+
+
+class ListingCache:
+    """
+    Least recently used cache of list results that survives between invocations of a warm
+    container. Items are validated against the directory stat on every lookup and evicted
+    once the total number of cached entries exceeds max_entries.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, validator):
+        item = self.items.get(key)
+        if item is None or item[0] != validator:
+            if item is not None:
+                self.remove(key)
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key, validator, value, weight):
+        if weight > self.max_entries:
+            return
+        if key in self.items:
+            self.remove(key)
+        self.items[key] = (validator, value, weight)
+        self.size += weight
+        while self.size > self.max_entries:
+            _, (_, _, evicted_weight) = self.items.popitem(last=False)
+            self.size -= evicted_weight
+
+    def remove(self, key):
+        _, _, weight = self.items.pop(key)
+        self.size -= weight
+
+    def stats(self, hit):
+        return {"hit": hit, "hits": self.hits, "misses": self.misses, "entries": self.size}
+
+
+LISTING_CACHE = ListingCache(LISTING_CACHE_MAX_ENTRIES)
+
+
+class FileHandleCache:
+    """
+    Read only file descriptors kept open between invocations of a warm container, so chunked
+    downloads of the same file skip the open and stat round trips to EFS. Handles are closed
+    after idle_timeout seconds without use, or once more than max_handles are open.
+    """
+
+    def __init__(self, max_handles, idle_timeout):
+        self.max_handles = max_handles
+        self.idle_timeout = idle_timeout
+        self.handles = OrderedDict()
+
+    def get(self, file_path, validator=None):
+        """
+        Returns an open descriptor and stat result for file_path. A cached descriptor is reused
+        when the file was not modified in place and, without a validator, was not replaced.
+
+        :param validator: Validator the caller expects, a handle that does not match is reopened
+        :raises OSError
+        """
+        now = time.monotonic()
+        self.close_idle(now)
+        item = self.handles.pop(file_path, None)
+        if item is not None:
+            fd, cached_stat, _ = item
+            try:
+                # a descriptor keeps reading the inode it was opened on, only a path lookup
+                # notices a replaced file, which a caller holding a validator does not need
+                current_stat = os.fstat(fd) if validator is not None else os.stat(file_path)
+            except OSError:
+                current_stat = None
+            cached_validator = file_validator(cached_stat)
+            if current_stat is not None and file_validator(current_stat) == cached_validator \
+                    and validator in (None, cached_validator):
+                self.handles[file_path] = (fd, current_stat, now)
+                return fd, current_stat
+            os.close(fd)
+
+        fd = os.open(file_path, os.O_RDONLY)
+        stat_result = os.fstat(fd)
+        self.handles[file_path] = (fd, stat_result, now)
+        while len(self.handles) > self.max_handles:
+            _, (evicted_fd, _, _) = self.handles.popitem(last=False)
+            os.close(evicted_fd)
+        return fd, stat_result
+
+    def discard(self, file_path):
+        item = self.handles.pop(file_path, None)
+        if item is not None:
+            os.close(item[0])
+
+    def close_idle(self, now):
+        while self.handles:
+            file_path, (fd, _, last_used) = next(iter(self.handles.items()))
+            if now - last_used < self.idle_timeout:
+                break
+            del self.handles[file_path]
+            os.close(fd)
+
+
+FILE_HANDLES = FileHandleCache(FILE_HANDLE_CACHE_SIZE, FILE_HANDLE_IDLE_TIMEOUT)
+
+
+def hidden_entry_name(dir_path):
+    """Returns the name of the upload session directory if dir_path holds it, else None"""
+    parent, name = os.path.split(os.path.normpath(UPLOAD_SESSION_DIR))
+    return name if os.path.normpath(dir_path) == parent else None
+
+
+def valid_name(name):
+    """Checks that a name selects an entry inside its directory, never the directory itself or its parent"""
+    return name not in ['', '.', '..'] and '/' not in name and '\x00' not in name
+
+
+def within_mount(path):
+    """Checks whether a path, with symlinks resolved, lies inside the mounted filesystem"""
+    mount_path = os.path.realpath(MOUNT_PATH)
+    path = os.path.realpath(path)
+    return path == mount_path or path.startswith(mount_path + os.sep)
+
+
+def in_upload_sessions(path):
+    """Checks whether a path is the upload session directory or lies inside it"""
+    session_dir = os.path.normpath(UPLOAD_SESSION_DIR)
+    path = os.path.normpath(path)
+    return path == session_dir or path.startswith(session_dir + os.sep)
+
+
+def touches_upload_sessions(event):
+    """Checks whether any path an operation would read or write lies in the upload session directory"""
+    directories = [event.get(key) for key in ['path', 'new_path'] if isinstance(event.get(key), str)]
+    names = [event.get(key) for key in ['name', 'filename', 'new_name'] if isinstance(event.get(key), str)]
+    return any(in_upload_sessions(directory) or any(in_upload_sessions(os.path.join(directory, name)) for name in names)
+               for directory in directories)
 
 
 def delete(event):
-    print(event)
-    path = event['path']
-    name = event['name']
+    if event.get('recursive'):
+        return delete_recursive(event)
 
-    file_path = path + '/' + name
+    try:
+        file_path = entry_path(event)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
 
     try:
-        os.remove(file_path)
+        with METRICS.timer('FilesystemTime'):
+            os.remove(file_path)
     except OSError:
         return {"message": "couldn't delete the file", "statusCode": 500}
     else:
@@ -25,120 +375,2154 @@ def delete(event):
 
 
 def make_dir(event):
-    print(event)
-    path = event['path']
-    name = event['name']
-
-    new_dir = path + '/' + name
+    try:
+        new_dir = entry_path(event)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
 
     try:
-        os.mkdir(new_dir)
+        with METRICS.timer('FilesystemTime'):
+            os.mkdir(new_dir)
     except OSError:
         return {"message": "couldn't create the directory", "statusCode": 500}
     else:
         return {"message": "directory creation successful", "statusCode": 200}
 
 
+def stat_object(event):
+    file_path = os.path.join(event['path'], event['name'])
+
+    try:
+        with METRICS.timer('FilesystemTime'):
+            stat_result = os.stat(file_path)
+    except FileNotFoundError:
+        return {"message": "no such file or directory", "statusCode": 404}
+    except OSError:
+        return {"message": "couldn't stat the file", "statusCode": 500}
+
+    if stat.S_ISDIR(stat_result.st_mode):
+        object_type = 'directory'
+    elif stat.S_ISREG(stat_result.st_mode):
+        object_type = 'file'
+    else:
+        object_type = 'other'
+    return {"name": event['name'], "type": object_type, "size": stat_result.st_size,
+            "mtime": stat_result.st_mtime, "statusCode": 200}
+
+
+def entry_path(event):
+    """
+    Joins the path and name of an operation on a single entry
+
+    :raises ValueError: If the name would leave its directory or the path lies outside the mount
+    """
+    if not isinstance(event['name'], str) or not valid_name(event['name']):
+        raise ValueError('invalid name')
+    if not isinstance(event['path'], str) or not within_mount(event['path']):
+        raise ValueError('path must be inside the file system')
+    return os.path.join(event['path'], event['name'])
+
+
+def target_path(event):
+    """
+    Joins the new_path and new_name of a rename, move or copy, each defaulting to the source's
+
+    :raises ValueError: If a name would leave its directory or new_path lies outside the mount
+    """
+    if not valid_name(event['name']):
+        raise ValueError('invalid name')
+    if event.get('new_name') and not valid_name(event['new_name']):
+        raise ValueError('invalid new_name')
+    if event.get('new_path') and not within_mount(event['new_path']):
+        raise ValueError('new_path must be inside the file system')
+    return os.path.join(event.get('new_path') or event['path'], event.get('new_name') or event['name'])
+
+
+def rename(event):
+    try:
+        target = target_path(event)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+    source = os.path.join(event['path'], event['name'])
+
+    if os.path.normpath(source) == os.path.normpath(target):
+        return {"message": "source and target are the same", "statusCode": 400}
+    # os.rename silently replaces an existing file, renames never overwrite
+    if os.path.lexists(target):
+        return {"message": "target already exists", "statusCode": 409}
+    try:
+        with METRICS.timer('FilesystemTime'):
+            os.rename(source, target)
+    except FileNotFoundError:
+        return {"message": "no such file or directory", "statusCode": 404}
+    except OSError:
+        return {"message": "couldn't rename the file", "statusCode": 500}
+    else:
+        return {"message": "rename successful", "statusCode": 200}
+
+
+def copy_file_data(source_fd, target_fd, offset, size, deadline):
+    """
+    Copies source_fd to target_fd from offset until size or the deadline. copy_file_range keeps
+    the data in the kernel, or on the server where NFS supports it, sendfile still avoids the
+    copy through user space, buffered reads and writes work everywhere.
+
+    :returns: The offset copied up to
+    """
+    method = 'copy_file_range' if hasattr(os, 'copy_file_range') else 'sendfile'
+    while offset < size and time.monotonic() < deadline:
+        length = min(COPY_BLOCK_SIZE, size - offset)
+        try:
+            if method == 'copy_file_range':
+                copied = os.copy_file_range(source_fd, target_fd, length, offset, offset)
+            elif method == 'sendfile':
+                os.lseek(target_fd, offset, os.SEEK_SET)
+                copied = os.sendfile(target_fd, source_fd, offset, length)
+            else:
+                copied = os.pwrite(target_fd, os.pread(source_fd, min(length, COPY_BUFFER_SIZE), offset), offset)
+        except OSError as error:
+            if method != 'buffered' and error.errno in [errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP]:
+                method = 'sendfile' if method == 'copy_file_range' else 'buffered'
+                continue
+            raise
+        if copied == 0:
+            # the source was truncated while it was copied
+            break
+        offset += copied
+    return offset
+
+
+def copy(event):
+    try:
+        target = target_path(event)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+    source = os.path.join(event['path'], event['name'])
+    if os.path.normpath(source) == os.path.normpath(target):
+        return {"message": "source and target are the same", "statusCode": 400}
+
+    try:
+        deadline = time.monotonic() + parse_time_budget(event)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    state = None
+    if event.get('continuation'):
+        try:
+            state = decode_cursor(event['continuation'])
+            offset = int(state['offset'])
+            copy_id = state['copy_id']
+        except (ValueError, KeyError, TypeError) as error:
+            log(logging.WARNING, "Invalid copy continuation token", path=source, error=error)
+            return {"message": "invalid continuation token", "statusCode": 400}
+        if state.get('source') != source or state.get('target') != target or not UPLOAD_ID_PATTERN.match(str(copy_id)):
+            return {"message": "continuation token does not belong to this copy", "statusCode": 400}
+    else:
+        offset = 0
+        copy_id = 'copy-{suffix}'.format(suffix=uuid.uuid4().hex)
+
+    if os.path.lexists(target):
+        return {"message": "target already exists", "statusCode": 409}
+
+    # the copy is written next to upload staging files, so an abandoned copy is removed with
+    # stale upload sessions and only a finished one is linked into place
+    session_dir = os.path.join(UPLOAD_SESSION_DIR, copy_id)
+    staging_path = os.path.join(session_dir, 'data')
+    started = time.perf_counter()
+    try:
+        source_fd = os.open(source, os.O_RDONLY)
+        try:
+            stat_result = os.fstat(source_fd)
+            if not stat.S_ISREG(stat_result.st_mode):
+                return {"message": "only files can be copied", "statusCode": 400}
+            validator = file_validator(stat_result)
+            if state is not None and state.get('validator') != validator:
+                return {"message": "source changed since the copy started", "statusCode": 412}
+            if state is None:
+                os.makedirs(session_dir)
+            target_fd = os.open(staging_path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                # anything written past the last reported offset is copied again
+                os.ftruncate(target_fd, offset)
+                copied_from = offset
+                offset = copy_file_data(source_fd, target_fd, offset, stat_result.st_size, deadline)
+                METRICS.add('Bytes', offset - copied_from, 'Bytes')
+            finally:
+                os.close(target_fd)
+            if offset < stat_result.st_size and os.fstat(source_fd).st_size < stat_result.st_size:
+                return {"message": "source changed since the copy started", "statusCode": 412}
+        finally:
+            os.close(source_fd)
+
+        if offset < stat_result.st_size:
+            continuation = encode_cursor({"source": source, "target": target, "copy_id": copy_id,
+                                          "offset": offset, "validator": validator})
+            return {"message": "copy in progress", "bytes_copied": offset, "size": stat_result.st_size,
+                    "complete": False, "continuation": continuation, "statusCode": 200}
+
+        os.chmod(staging_path, stat.S_IMODE(stat_result.st_mode))
+        # os.link fails if the target appeared since the check above, where os.rename would replace it
+        try:
+            os.link(staging_path, target)
+        except FileExistsError:
+            shutil.rmtree(session_dir, ignore_errors=True)
+            return {"message": "target already exists", "statusCode": 409}
+        os.unlink(staging_path)
+        shutil.rmtree(session_dir, ignore_errors=True)
+    except FileNotFoundError:
+        return {"message": "no such file or directory", "statusCode": 404}
+    except OSError as error:
+        log(logging.ERROR, "Could not copy file", path=source, target=target, error=error)
+        return {"message": "couldn't copy the file", "statusCode": 500}
+    finally:
+        METRICS.add_time('FilesystemTime', started)
+
+    return {"message": "copy successful", "bytes_copied": offset, "size": stat_result.st_size, "complete": True,
+            "continuation": None, "statusCode": 200}
+
+
+def open_upload_session(upload_id, metadata):
+    """
+    Loads the session directory of an upload, creating it for the first chunk to arrive
+
+    :param upload_id: The dzuuid of the upload
+    :param metadata: Target path, filename, size and chunking of the upload
+    :returns: The session directory
+    :raises ValueError: If the session exists with different metadata
+    """
+    session_dir = os.path.join(UPLOAD_SESSION_DIR, upload_id)
+    metadata_path = os.path.join(session_dir, 'session.json')
+    # every chunk but the first finds the metadata, a single read on the hot path
+    try:
+        with open(metadata_path) as metadata_file:
+            existing = json.load(metadata_file)
+    except FileNotFoundError:
+        existing = create_upload_session(session_dir, metadata_path, metadata)
+    if existing is not None and any(existing.get(key) != value for key, value in metadata.items()):
+        raise ValueError('upload {upload_id} was started with different metadata'.format(upload_id=upload_id))
+    return session_dir
+
+
+def create_upload_session(session_dir, metadata_path, metadata):
+    """
+    Writes the metadata of a new upload session
+
+    :returns: None if this call created the session, otherwise the metadata of the concurrent
+        chunk that got there first
+    """
+    os.makedirs(session_dir, exist_ok=True)
+    # the metadata is written to a unique name and linked into place, so concurrent chunks
+    # either create it or read a complete copy
+    temp_path = '{metadata_path}.{suffix}'.format(metadata_path=metadata_path, suffix=uuid.uuid4().hex)
+    with open(temp_path, 'w') as metadata_file:
+        json.dump(dict(metadata, created=time.time()), metadata_file)
+    try:
+        os.link(temp_path, metadata_path)
+    except FileExistsError:
+        with open(metadata_path) as metadata_file:
+            return json.load(metadata_file)
+    finally:
+        os.remove(temp_path)
+    # new sessions are rare compared to chunks, a good moment to sweep abandoned ones
+    collect_stale_upload_sessions()
+    return None
+
+
+def finalize_upload(session_dir, save_path, total_size):
+    """
+    Verifies the staging file of a fully received upload and publishes it at save_path. The last
+    chunks may finish concurrently, so every step tolerates another finisher having done it first:
+    the file is hard linked into place, which never replaces an existing file, then the complete
+    marker is written and only then is the staging file unlinked.
+    """
+    staging_path = os.path.join(session_dir, 'data')
+    marker_path = os.path.join(session_dir, 'complete')
+    uploaded = {"message": "File uploaded successfuly", "complete": True, "statusCode": 200}
+    if os.path.exists(marker_path):
+        return uploaded
+    try:
+        staged = os.stat(staging_path)
+    except FileNotFoundError:
+        # another chunk published the file, its marker is written before the staging file is unlinked
+        if os.path.exists(marker_path):
+            return uploaded
+        log(logging.ERROR, "Upload staging file is missing", path=save_path)
+        return {"message": "couldn't write the file to disk", "statusCode": 500}
+
+    if staged.st_size != total_size:
+        log(logging.WARNING, "Upload completed with a size mismatch", path=save_path, size=staged.st_size,
+            expected_size=total_size)
+        return {"message": "Size mismatch", "statusCode": 500}
+
+    try:
+        os.link(staging_path, save_path)
+    except FileExistsError:
+        try:
+            published = os.stat(save_path, follow_symlinks=False)
+        except FileNotFoundError:
+            published = None
+        # only another finisher of this upload links the staging file's inode
+        if published is None or (published.st_dev, published.st_ino) != (staged.st_dev, staged.st_ino):
+            return {"message": "File already exists", "statusCode": 400}
+    except FileNotFoundError:
+        if os.path.exists(marker_path):
+            return uploaded
+        log(logging.ERROR, "Could not move upload into place", path=save_path)
+        return {"message": "couldn't write the file to disk", "statusCode": 500}
+    except OSError as error:
+        log(logging.ERROR, "Could not move upload into place", path=save_path, error=error)
+        return {"message": "couldn't write the file to disk", "statusCode": 500}
+
+    # retried chunks of a finished session are answered from this marker
+    with open(marker_path, 'w'):
+        pass
+    try:
+        os.unlink(staging_path)
+    except FileNotFoundError:
+        pass
+    log(logging.INFO, "Upload complete", path=save_path, size=total_size)
+    return uploaded
+
+
+def chunk_ranges(ledger, received):
+    """Collapses a chunk ledger into inclusive [first, last] index ranges of received or missing chunks"""
+    ranges = []
+    for index, value in enumerate(ledger):
+        if (value == 1) != received:
+            continue
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+def session_last_activity(session_dir):
+    """Returns the time a session last received data, or was created when it has none"""
+    for name in ['ledger', 'data', 'central', 'state', 'session.json']:
+        try:
+            return os.stat(os.path.join(session_dir, name)).st_mtime
+        except FileNotFoundError:
+            continue
+    return os.stat(session_dir).st_mtime
+
+
+def collect_stale_upload_sessions(max_age=None):
+    """
+    Removes upload sessions that have not received a chunk for max_age seconds, finished
+    sessions included. Runs at most once per UPLOAD_SESSION_GC_INTERVAL in a warm container.
+
+    :returns: The number of removed sessions
+    """
+    global LAST_UPLOAD_SESSION_GC
+    now = time.time()
+    if max_age is None:
+        if now - LAST_UPLOAD_SESSION_GC < UPLOAD_SESSION_GC_INTERVAL:
+            return 0
+        max_age = UPLOAD_SESSION_MAX_AGE
+    LAST_UPLOAD_SESSION_GC = now
+
+    removed = 0
+    try:
+        with os.scandir(UPLOAD_SESSION_DIR) as iterator:
+            session_dirs = [entry.path for entry in iterator if entry.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return 0
+    for session_dir in session_dirs:
+        try:
+            if now - session_last_activity(session_dir) > max_age:
+                shutil.rmtree(session_dir)
+                removed += 1
+        except OSError as error:
+            # removed concurrently or still being written, retried on the next sweep
+            log(logging.WARNING, "Could not remove upload session", session_dir=session_dir, error=error)
+    return removed
+
+
+def upload_status(event):
+    # upload_status: {"operation": "upload_status", "dzuuid": "$dzuuid"}
+    try:
+        upload_id = event['dzuuid']
+    except KeyError:
+        return {"message": "missing required parameter: dzuuid", "statusCode": 400}
+    if not UPLOAD_ID_PATTERN.match(str(upload_id)):
+        return {"message": "invalid dzuuid", "statusCode": 400}
+
+    collect_stale_upload_sessions()
+
+    session_dir = os.path.join(UPLOAD_SESSION_DIR, upload_id)
+    try:
+        with open(os.path.join(session_dir, 'session.json')) as metadata_file:
+            metadata = json.load(metadata_file)
+    except FileNotFoundError:
+        return {"message": "no upload in progress for {upload_id}".format(upload_id=upload_id), "statusCode": 404}
+    except (OSError, ValueError) as error:
+        log(logging.ERROR, "Could not read upload session", upload_id=upload_id, error=error)
+        return {"message": "unable to read upload session", "statusCode": 500}
+
+    try:
+        with open(os.path.join(session_dir, 'ledger'), 'rb') as ledger_file:
+            ledger = ledger_file.read(metadata['chunks'])
+    except FileNotFoundError:
+        ledger = b''
+    ledger = ledger.ljust(metadata['chunks'], b'\x00')
+
+    return {"dzuuid": upload_id, "path": metadata['path'], "filename": metadata['filename'],
+            "dztotalfilesize": metadata['size'], "dztotalchunkcount": metadata['chunks'],
+            "dzchunksize": metadata['chunk_size'], "received_chunks": ledger.count(b'\x01'),
+            "received_ranges": chunk_ranges(ledger, True), "missing_ranges": chunk_ranges(ledger, False),
+            "complete": os.path.exists(os.path.join(session_dir, 'complete')), "statusCode": 200}
+
+
+def decoded_length(content):
+    """Returns the number of bytes a padded base64 string decodes to, without decoding it"""
+    if len(content) % 4 != 0:
+        raise ValueError('chunk content is not valid base64')
+    padding = content[-2:].count('=' if isinstance(content, str) else b'=')
+    return len(content) // 4 * 3 - padding
+
+
+def write_base64(fd, content, offset):
+    """
+    Decodes base64 content straight to disk in blocks of UPLOAD_DECODE_BLOCK_SIZE characters,
+    so only one decoded block is held in memory next to the event
+
+    :returns: The number of bytes written
+    :raises binascii.Error: If the content is not valid base64
+    """
+    written = 0
+    for start in range(0, len(content), UPLOAD_DECODE_BLOCK_SIZE):
+        started = time.perf_counter()
+        block = binascii.a2b_base64(content[start:start + UPLOAD_DECODE_BLOCK_SIZE], strict_mode=True)
+        METRICS.add_time('DecodeTime', started)
+        started = time.perf_counter()
+        os.pwrite(fd, block, offset + written)
+        METRICS.add_time('FilesystemTime', started)
+        written += len(block)
+    METRICS.add('Bytes', written, 'Bytes')
+    return written
+
+
 def upload(event):
-    print(event)
-    "{'operation': 'upload', 'path': '/mnt/efs', 'chunk_data': {'dzuuid': '10f726ea-ae1d-4363-9a97-4bf6772cd4df', 'dzchunkindex': '0', 'dzchunksize': '1000000', 'dztotalchunkcount': '1', 'dzchunkbyteoffset': '0', 'filename': 'Log at 2020-08-11 12-17-21 PM.txt', 'content': '(Emitted value instead of an instance of Error)'}}"
+    "{'operation': 'upload', 'path': '/mnt/efs', 'chunk_data': {'dzuuid': '10f726ea-ae1d-4363-9a97-4bf6772cd4df', 'dzchunkindex': '0', 'dzchunksize': '1000000', 'dztotalchunkcount': '1', 'dzchunkbyteoffset': '0', 'dztotalfilesize': '47', 'filename': 'Log at 2020-08-11 12-17-21 PM.txt', 'content': '(Emitted value instead of an instance of Error)'}}"
     path = event['path']
-    filename = event['chunk_data']['filename']
-    file_content_decoded = base64.b64decode(event['chunk_data']['content'])
-    current_chunk = int(event['chunk_data']['dzchunkindex'])
+    chunk_data = event['chunk_data']
+    filename = chunk_data['filename']
+    try:
+        upload_id = chunk_data['dzuuid']
+        current_chunk = int(chunk_data['dzchunkindex'])
+        total_chunks = int(chunk_data['dztotalchunkcount'])
+        chunk_size = int(chunk_data['dzchunksize'])
+        chunk_offset = int(chunk_data['dzchunkbyteoffset'])
+        total_size = int(chunk_data['dztotalfilesize'])
+    except (KeyError, TypeError, ValueError) as error:
+        return {"message": "invalid chunk metadata: {error}".format(error=error), "statusCode": 400}
+    if not UPLOAD_ID_PATTERN.match(str(upload_id)):
+        return {"message": "invalid dzuuid", "statusCode": 400}
+    if chunk_size <= 0 or total_size < 0:
+        return {"message": "invalid chunk or file size", "statusCode": 400}
+    # the chunks have to tile the file exactly, or a full ledger could leave part of it unwritten
+    if total_chunks != max(1, -(-total_size // chunk_size)):
+        return {"message": "chunk count does not match the file and chunk sizes", "statusCode": 400}
+    if not 0 <= current_chunk < total_chunks or chunk_offset != current_chunk * chunk_size:
+        return {"message": "chunk index or offset out of range", "statusCode": 400}
+
+    content = chunk_data['content']
+    try:
+        content_length = decoded_length(content)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+    # every chunk has to cover exactly its slice, so a full ledger means the whole file is on disk
+    if content_length != min(chunk_size, total_size - chunk_offset):
+        return {"message": "chunk does not match its declared size", "statusCode": 400}
+
+    if not isinstance(filename, str) or not valid_name(filename):
+        return {"message": "invalid filename", "statusCode": 400}
+    if not within_mount(path):
+        return {"message": "path must be inside the file system", "statusCode": 400}
     save_path = os.path.join(path, filename)
+    metadata = {"path": path, "filename": filename, "size": total_size, "chunks": total_chunks,
+                "chunk_size": chunk_size}
 
-    if os.path.exists(save_path) and current_chunk == 0:
-        return {"message": "File already exists", "statusCode": 400}
+    try:
+        with METRICS.timer('FilesystemTime'):
+            session_dir = open_upload_session(upload_id, metadata)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+    except OSError as error:
+        log(logging.ERROR, "Could not open upload session", upload_id=upload_id, error=error)
+        return {"message": "couldn't write the file to disk", "statusCode": 500}
 
+    # chunks may arrive in any order, more than once, and concurrently from several lambda
+    # instances. The ledger holds one byte per chunk index, set once the chunk is on disk.
+    # A byte rather than a bit per chunk lets each writer update it without read-modify-write.
     try:
-        with open(save_path, 'ab') as f:
-            f.seek(int(event['chunk_data']['dzchunkbyteoffset']))
-            f.write(file_content_decoded)
+        ledger_fd = os.open(os.path.join(session_dir, 'ledger'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.pread(ledger_fd, 1, current_chunk) == b'\x01':
+                received_chunks = os.pread(ledger_fd, total_chunks, 0).count(b'\x01')
+                complete = os.path.exists(os.path.join(session_dir, 'complete'))
+                return {"message": "Chunk already received", "complete": complete,
+                        "received_chunks": received_chunks, "statusCode": 200}
+            if os.path.exists(save_path):
+                return {"message": "File already exists", "statusCode": 400}
+
+            staging_fd = os.open(os.path.join(session_dir, 'data'), os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                # preallocate so every chunk can be written at its own offset, whichever lands first
+                if os.fstat(staging_fd).st_size < total_size:
+                    os.ftruncate(staging_fd, total_size)
+                write_base64(staging_fd, content, chunk_offset)
+            finally:
+                # closing flushes the chunk to EFS before it is marked as received
+                os.close(staging_fd)
+            os.pwrite(ledger_fd, b'\x01', current_chunk)
+            received_chunks = os.pread(ledger_fd, total_chunks, 0).count(b'\x01')
+        finally:
+            os.close(ledger_fd)
+    except binascii.Error as error:
+        # the ledger was not updated, a corrected retry overwrites the partial chunk
+        return {"message": "chunk content is not valid base64: {error}".format(error=error), "statusCode": 400}
     except OSError as error:
-        print('Could not write to file: {error}'.format(error=error))
+        log(logging.ERROR, "Could not write upload chunk", upload_id=upload_id, chunk_index=current_chunk,
+            error=error)
         return {"message": "couldn't write the file to disk", "statusCode": 500}
 
-    total_chunks = int(event['chunk_data']['dztotalchunkcount'])
+    if received_chunks < total_chunks:
+        log_chunk("Upload chunk complete", current_chunk, total_chunks, upload_id=upload_id, path=save_path,
+                  received_chunks=received_chunks)
+        return {"message": "Chunk upload successful", "complete": False, "received_chunks": received_chunks, "statusCode": 200}
+
+    with METRICS.timer('FilesystemTime'):
+        result = finalize_upload(session_dir, save_path, total_size)
+    return dict(result, received_chunks=received_chunks)
 
-    if current_chunk + 1 == total_chunks:
-        if int(os.path.getsize(save_path)) != int(event['chunk_data']['dztotalfilesize']):
-            print("File {filename} was completed, but there is a size mismatch. Was {size} but expected {total}".format(filename=filename, size=os.path.getsize(save_path), total=event['chunk_data']['dztotalfilesize']))
-            return {"message": "Size mismatch", "statusCode": 500}
-        else:
-            print("file {filename} has been uploaded successfully".format(filename=filename))
-            return {"message": "File uploaded successfuly", "statusCode": 200}
-    else:
-        print("Chunk {current_chunk} of {total_chunks} for file {filename} complete".format(current_chunk=current_chunk + 1 , total_chunks=total_chunks, filename=filename))
-        return {"message": "Chunk upload successful", "statusCode": 200}
+
+def download_chunk_size(event):
+    """Reads the requested download chunk size, defaulting to and clamped at MAX_DOWNLOAD_CHUNK_SIZE"""
+    chunk_size = event.get('chunk_size')
+    if chunk_size is None:
+        return MAX_DOWNLOAD_CHUNK_SIZE
+    return min(parse_positive_int(event, 'chunk_size', None), MAX_DOWNLOAD_CHUNK_SIZE)
 
 
 def download(event):
-    # first call {"path": "./", "filename": "test.txt"}
+    # first call {"path": "./", "filename": "test.txt", "chunk_size": 4706304}
     # successive calls
-    # {"path": "./", "filename": "test_video.mp4", "chunk_data": {'dzchunkindex': chunk['dzchunkindex'],
+    # {"path": "./", "filename": "test_video.mp4", "chunk_size": 4706304, "chunk_data": {'dzchunkindex': chunk['dzchunkindex'],
     # 'dzchunkbyteoffset': chunk['dzchunkbyteoffset']}}
     path = event['path']
     filename = event['filename']
     file_path = os.path.join(path, filename)
-    chunk_size = 2000000  # bytes
-    file_size = os.path.getsize(file_path)
-    chunks = math.ceil(file_size / chunk_size)
+    try:
+        chunk_size = download_chunk_size(event)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
 
     if "chunk_data" in event:
-        start_index = event['chunk_data']['dzchunkbyteoffset']
-        current_chunk = event['chunk_data']['dzchunkindex']
-        try:
-            with open(file_path, 'rb') as f:
-                f.seek(start_index)
-                file_content = f.read(chunk_size)
-                encoded_chunk_content = str(base64.b64encode(file_content), 'utf-8')
-                chunk_offset = start_index + chunk_size
-                chunk_number = current_chunk + 1
-
-                return {"dzchunkindex": chunk_number, "dztotalchunkcount": chunks, "dzchunkbyteoffset": chunk_offset,
-                        "chunk_data": encoded_chunk_content, "dztotalfilesize": file_size}
-        except OSError as error:
-            print('Could not read file: {error}'.format(error=error))
-            return {"message": "couldn't read the file from disk", "statusCode": 500}
-
+        start_index = int(event['chunk_data']['dzchunkbyteoffset'])
+        chunk_number = int(event['chunk_data']['dzchunkindex']) + 1
     else:
         start_index = 0
+        chunk_number = 0
+
+    try:
+        with METRICS.timer('FilesystemTime'):
+            fd, stat_result = FILE_HANDLES.get(file_path)
+            file_content = os.pread(fd, chunk_size, start_index)
+    except OSError as error:
+        FILE_HANDLES.discard(file_path)
+        log(logging.ERROR, "Could not read file", path=file_path, error=error)
+        return {"message": "couldn't read the file from disk", "statusCode": 500}
+    file_size = stat_result.st_size
+
+    # an empty file still takes one chunk, so the client sees the transfer end
+    chunks = max(1, math.ceil(file_size / chunk_size))
+    with METRICS.timer('EncodeTime'):
+        encoded_chunk_content = str(base64.b64encode(file_content), 'utf-8')
+    METRICS.add('Bytes', len(file_content), 'Bytes')
+
+    return {"dzchunkindex": chunk_number, "dztotalchunkcount": chunks, "dzchunkbyteoffset": start_index + chunk_size,
+            "dzchunksize": chunk_size, "chunk_data": encoded_chunk_content, "dztotalfilesize": file_size}
+
+
+def file_validator(stat_result):
+    """Builds a validator that changes whenever the file is replaced, resized or modified"""
+    return '{inode:x}-{size:x}-{mtime:x}'.format(inode=stat_result.st_ino, size=stat_result.st_size,
+                                                 mtime=stat_result.st_mtime_ns)
+
+
+def download_plan(event):
+    # download_plan: {"operation": "download_plan", "path": "$dir", "filename": "$filename", "chunk_size": $chunk_size}
+    try:
+        file_path = os.path.join(event['path'], event['filename'])
+        chunk_size = download_chunk_size(event)
+    except KeyError as error:
+        return {"message": "missing required parameter: {error}".format(error=error), "statusCode": 400}
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    try:
+        with METRICS.timer('FilesystemTime'):
+            stat_result = os.stat(file_path)
+    except OSError as error:
+        log(logging.ERROR, "Could not stat file", path=file_path, error=error)
+        return {"message": "couldn't read the file from disk", "statusCode": 500}
+
+    return {"dztotalfilesize": stat_result.st_size, "dzchunksize": chunk_size,
+            "dztotalchunkcount": max(1, math.ceil(stat_result.st_size / chunk_size)),
+            "validator": file_validator(stat_result), "statusCode": 200}
+
+
+def download_chunk(event):
+    # download_chunk: {"operation": "download_chunk", "path": "$dir", "filename": "$filename",
+    #                  "chunk_index": $index, "chunk_size": $chunk_size, "validator": "$validator"}
+    try:
+        file_path = os.path.join(event['path'], event['filename'])
+        validator = event['validator']
+        chunk_index = int(event['chunk_index'])
+        chunk_size = download_chunk_size(event)
+    except KeyError as error:
+        return {"message": "missing required parameter: {error}".format(error=error), "statusCode": 400}
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    # chunks are addressed by index, so clients can fetch them in any order and concurrently
+    offset = chunk_index * chunk_size
+    try:
+        started = time.perf_counter()
+        fd, stat_result = FILE_HANDLES.get(file_path, validator)
+        if file_validator(stat_result) != validator:
+            return {"message": "file changed since the download was planned", "statusCode": 412}
+        if chunk_index < 0 or offset >= max(stat_result.st_size, 1):
+            return {"message": "chunk index out of range", "statusCode": 400}
+        file_content = os.pread(fd, chunk_size, offset)
+    except OSError as error:
+        FILE_HANDLES.discard(file_path)
+        log(logging.ERROR, "Could not read file", path=file_path, error=error)
+        return {"message": "couldn't read the file from disk", "statusCode": 500}
+    finally:
+        METRICS.add_time('FilesystemTime', started)
+
+    with METRICS.timer('EncodeTime'):
+        chunk_content = str(base64.b64encode(file_content), 'utf-8')
+    METRICS.add('Bytes', len(file_content), 'Bytes')
+
+    return {"dzchunkindex": chunk_index, "dzchunkbyteoffset": offset, "dzchunksize": chunk_size,
+            "dztotalfilesize": stat_result.st_size, "chunk_data": chunk_content,
+            "validator": validator, "statusCode": 200}
+
+
+class ArchiveSourceChanged(Exception):
+    """Raised when a file changes while its part of an archive is streamed over several chunks"""
+
+
+class ZipStream:
+    """
+    Produces a ZIP archive of a directory tree one chunk at a time, without holding the archive
+    in memory or on local storage. Entries are written with data descriptors, so each file is
+    streamed as it is read, and deflate output is flushed at the end of every chunk so a new
+    compressor can continue the stream in the next invocation.
+
+    Everything needed to produce the next chunk is in the cursor state, except the central
+    directory records, which are appended to a file in the archive's session directory and
+    streamed once all entries are written. state['cd_size'] only counts records of finished
+    chunks, so a retried chunk rewrites its records instead of duplicating them.
+    """
+
+    def __init__(self, root, archive_name, state, session_dir, chunk_size, deadline):
+        self.root = root
+        self.prefix = archive_name + '/'
+        self.state = state
+        self.chunk_size = chunk_size
+        self.deadline = deadline
+        self.out = bytearray()
+        self.listings = {}
+        self.compressor = None
+        self.cd_buffer = bytearray()
+        self.cd_fd = os.open(os.path.join(session_dir, 'central'), os.O_RDWR | os.O_CREAT, 0o644)
+
+    def close(self):
+        os.close(self.cd_fd)
+
+    def emit(self, data):
+        room = self.chunk_size - len(self.out)
+        if room > 0:
+            self.out += data[:room]
+        if len(data) > room:
+            self.state['pending'] += data[max(room, 0):]
+        self.state['position'] += len(data)
+
+    def room(self):
+        return self.chunk_size - len(self.out)
+
+    def children(self, rel_dir):
+        """Sorted (name, is_dir) of the directories and regular files in rel_dir"""
+        listing = self.listings.get(rel_dir)
+        if listing is None:
+            listing = []
+            dir_path = os.path.join(self.root, rel_dir)
+            hidden = hidden_entry_name(dir_path)
+            try:
+                with os.scandir(dir_path) as iterator:
+                    for entry in iterator:
+                        if entry.name == hidden:
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                listing.append((entry.name, True))
+                            elif entry.is_file(follow_symlinks=False):
+                                listing.append((entry.name, False))
+                        except FileNotFoundError:
+                            continue
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            listing.sort()
+            self.listings[rel_dir] = listing
+        return listing
+
+    def first_after(self, rel_dir, name):
+        listing = self.children(rel_dir)
+        index = 0 if name is None else bisect.bisect_right(listing, (name, True))
+        if index == len(listing):
+            return None
+        child, is_dir = listing[index]
+        return [os.path.join(rel_dir, child), is_dir]
+
+    def next_entry(self):
+        """The entry after state['last'] in a depth first walk, directories before their contents"""
+        last = self.state['last']
+        if last is None:
+            return self.first_after('', None)
+        rel_path, is_dir = last
+        if is_dir:
+            child = self.first_after(rel_path, None)
+            if child is not None:
+                return child
+        while rel_path:
+            parent, name = os.path.split(rel_path)
+            sibling = self.first_after(parent, name)
+            if sibling is not None:
+                return sibling
+            rel_path = parent
+        return None
+
+    def add_central_record(self, entry):
+        name = os.fsencode(self.prefix + entry['name'])
+        offset = entry['header_offset']
+        extra_values = []
+        sizes = (entry['size'], entry['compressed'])
+        if entry['zip64']:
+            extra_values += sizes
+            sizes = (ZIP64_LIMIT, ZIP64_LIMIT)
+        if offset >= ZIP64_LIMIT:
+            extra_values.append(offset)
+            offset = ZIP64_LIMIT
+        extra = b''
+        if extra_values:
+            extra = struct.pack('<HH', 1, 8 * len(extra_values)) + struct.pack('<' + 'Q' * len(extra_values), *extra_values)
+        version = 45 if extra_values else 20
+        external_attributes = (entry['mode'] & 0xFFFF) << 16 | (0x10 if entry['is_dir'] else 0)
+        self.cd_buffer += struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 0x0300 | version, version, entry['flags'],
+                                      entry['method'], entry['dos_time'], entry['dos_date'], entry['crc'],
+                                      sizes[1], sizes[0], len(name), len(extra), 0, 0, 0, external_attributes,
+                                      offset) + name + extra
+        self.state['entries'] += 1
+
+    def flush_central_records(self):
+        if self.cd_buffer:
+            os.pwrite(self.cd_fd, self.cd_buffer, self.state['cd_size'])
+            self.state['cd_size'] += len(self.cd_buffer)
+            self.cd_buffer = bytearray()
+
+    def start_entry(self, rel_path, is_dir):
         try:
-            with open(file_path, 'rb') as f:
-                f.seek(start_index)
-                file_content = f.read(chunk_size)
-                encoded_chunk_content = str(base64.b64encode(file_content), 'utf-8')
-                chunk_number = 0
-                chunk_offset = chunk_size
+            stat_result = os.stat(os.path.join(self.root, rel_path), follow_symlinks=False)
+        except FileNotFoundError:
+            return
+        mtime = time.localtime(max(stat_result.st_mtime, ZIP_EPOCH))
+        entry = {"name": rel_path + '/' if is_dir else rel_path, "is_dir": is_dir, "mode": stat_result.st_mode,
+                 "dos_date": min(mtime.tm_year - 1980, 127) << 9 | mtime.tm_mon << 5 | mtime.tm_mday,
+                 "dos_time": mtime.tm_hour << 11 | mtime.tm_min << 5 | mtime.tm_sec // 2,
+                 "header_offset": self.state['position'], "crc": 0, "size": 0, "compressed": 0, "read": 0}
+        name = os.fsencode(self.prefix + entry['name'])
+        if is_dir:
+            entry.update(flags=0x800, method=0, zip64=False)
+            self.emit(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, entry['flags'], 0, entry['dos_time'],
+                                  entry['dos_date'], 0, 0, 0, len(name), 0) + name)
+            self.add_central_record(entry)
+            return
 
-                return {"dzchunkindex": chunk_number, "dztotalchunkcount": chunks, "dzchunkbyteoffset": chunk_offset,
-                        "chunk_data": encoded_chunk_content, "dztotalfilesize": file_size}
+        # sizes are only known once the data is written and follow in a data descriptor. Reads
+        # stop at the size seen here, so a file appended to meanwhile cannot outgrow zip32 fields.
+        entry.update(flags=0x808, method=8 if self.state['compression'] == 'deflate' else 0,
+                     zip64=stat_result.st_size >= ZIP64_FILE_THRESHOLD, limit=stat_result.st_size,
+                     validator=file_validator(stat_result))
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if entry['zip64'] else b''
+        placeholder = ZIP64_LIMIT if entry['zip64'] else 0
+        self.emit(struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if entry['zip64'] else 20, entry['flags'],
+                              entry['method'], entry['dos_time'], entry['dos_date'], 0, placeholder, placeholder,
+                              len(name), len(extra)) + name + extra)
+        self.state['file'] = entry
 
-        except OSError as error:
-            print('Could not read file: {error}'.format(error=error))
-            return {"message": "couldn't read the file from disk", "statusCode": 500}
+    def write_file_data(self):
+        """Streams the current file until it ends or the chunk is full, returns True when it ended"""
+        entry = self.state['file']
+        try:
+            fd = os.open(os.path.join(self.root, entry['name']), os.O_RDONLY)
+        except FileNotFoundError:
+            # removed before any of it was read, or while streaming, either way it ends here
+            fd = None
+        try:
+            if fd is not None and entry['read'] > 0 and file_validator(os.fstat(fd)) != entry['validator']:
+                raise ArchiveSourceChanged(entry['name'])
+            deflate = entry['method'] == 8
+            if deflate:
+                self.compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            ended = fd is None
+            while not ended and self.room() > 0:
+                if deflate:
+                    # compressed output can briefly exceed its input, keep it within the chunk
+                    if self.out and self.room() < 2 * ARCHIVE_BLOCK_SIZE:
+                        break
+                    length = min(ARCHIVE_BLOCK_SIZE, entry['limit'] - entry['read'])
+                else:
+                    length = min(self.room(), entry['limit'] - entry['read'])
+                data = os.pread(fd, length, entry['read']) if length else b''
+                if not data:
+                    ended = True
+                    break
+                entry['read'] += len(data)
+                entry['crc'] = zlib.crc32(data, entry['crc'])
+                if deflate:
+                    data = self.compressor.compress(data)
+                entry['compressed'] += len(data)
+                self.emit(data)
+                if entry['read'] >= entry['limit']:
+                    ended = True
+                elif time.monotonic() >= self.deadline:
+                    break
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+        if deflate:
+            tail = self.compressor.flush(zlib.Z_FINISH if ended else zlib.Z_FULL_FLUSH)
+            entry['compressed'] += len(tail)
+            self.emit(tail)
+            self.compressor = None
+        if not ended:
+            return False
+
+        entry['size'] = entry['read']
+        if entry['zip64']:
+            self.emit(struct.pack('<IIQQ', 0x08074b50, entry['crc'], entry['compressed'], entry['size']))
+        else:
+            self.emit(struct.pack('<IIII', 0x08074b50, entry['crc'], entry['compressed'], entry['size']))
+        self.add_central_record(entry)
+        self.state['file'] = None
+        return True
+
+    def write_end(self):
+        state = self.state
+        entries, cd_size, cd_start = state['entries'], state['cd_size'], state['cd_start']
+        if entries >= 0xFFFF or cd_size >= ZIP64_LIMIT or cd_start >= ZIP64_LIMIT:
+            zip64_end_offset = state['position']
+            self.emit(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 0x032d, 45, 0, 0, entries, entries, cd_size,
+                                  cd_start))
+            self.emit(struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1))
+        self.emit(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(entries, 0xFFFF), min(entries, 0xFFFF),
+                              min(cd_size, ZIP64_LIMIT), min(cd_start, ZIP64_LIMIT), 0))
+
+    def write_chunk(self):
+        """Fills the next chunk, returns its bytes"""
+        state = self.state
+        # records past cd_size belong to an earlier attempt at this chunk
+        os.ftruncate(self.cd_fd, state['cd_size'])
+        pending = state['pending']
+        state['pending'] = b''
+        state['position'] -= len(pending)
+        self.emit(pending)
+
+        while self.room() > 0 and state['phase'] != 'done':
+            if state['phase'] == 'entry':
+                if state['file'] is not None:
+                    if not self.write_file_data():
+                        break
+                    continue
+                entry = self.next_entry()
+                if entry is None:
+                    self.flush_central_records()
+                    state['cd_start'] = state['position']
+                    state['phase'] = 'central'
+                    continue
+                state['last'] = entry
+                self.start_entry(*entry)
+            elif state['phase'] == 'central':
+                length = min(self.room(), state['cd_size'] - state['cd_read'])
+                self.emit(os.pread(self.cd_fd, length, state['cd_read']))
+                state['cd_read'] += length
+                if state['cd_read'] == state['cd_size']:
+                    state['phase'] = 'end'
+            else:
+                self.write_end()
+                state['phase'] = 'done'
+            if time.monotonic() >= self.deadline:
+                break
+
+        self.flush_central_records()
+        return bytes(self.out)
+
+
+def archive(event):
+    # archive: {"operation": "archive", "path": "$dir", "name": "$name", "compression": "store|deflate",
+    #           "cursor": "$cursor", "chunk_size": $chunk_size, "time_budget": $seconds}
+    path = event['path']
+    name = event['name']
+    if not valid_name(name):
+        return {"message": "invalid name", "statusCode": 400}
+    root = os.path.join(path, name)
+    compression = event.get('compression', 'deflate')
+    if compression not in ['store', 'deflate']:
+        return {"message": "compression must be one of: store, deflate", "statusCode": 400}
+    try:
+        chunk_size = download_chunk_size(event)
+        deadline = time.monotonic() + parse_time_budget(event)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    if event.get('cursor'):
+        try:
+            state = decode_cursor(event['cursor'])
+            state['pending'] = base64.b64decode(state['pending'])
+            archive_id = state['archive_id']
+        except (ValueError, KeyError, TypeError, binascii.Error) as error:
+            log(logging.WARNING, "Invalid archive cursor", path=root, error=error)
+            return {"message": "invalid cursor", "statusCode": 400}
+        if state.get('root') != root or state.get('compression') != compression or \
+                not UPLOAD_ID_PATTERN.match(str(archive_id)):
+            return {"message": "cursor does not belong to this archive", "statusCode": 400}
+    else:
+        if not os.path.isdir(root):
+            return {"message": "no such directory", "statusCode": 404}
+        archive_id = 'archive-{suffix}'.format(suffix=uuid.uuid4().hex)
+        state = {"archive_id": archive_id, "root": root, "compression": compression, "phase": "entry",
+                 "last": None, "file": None, "position": 0, "delivered": 0, "chunk": 0, "entries": 0,
+                 "cd_size": 0, "cd_start": 0, "cd_read": 0, "pending": b''}
+
+    session_dir = os.path.join(UPLOAD_SESSION_DIR, archive_id)
+    started = time.perf_counter()
+    try:
+        if not event.get('cursor'):
+            os.makedirs(session_dir)
+        elif not os.path.isdir(session_dir):
+            return {"message": "archive expired, start the download again", "statusCode": 410}
+        stream = ZipStream(root, name, state, session_dir, chunk_size, deadline)
+        try:
+            chunk = stream.write_chunk()
+        finally:
+            stream.close()
+        if state['phase'] == 'done' and not state['pending']:
+            shutil.rmtree(session_dir, ignore_errors=True)
+    except ArchiveSourceChanged as error:
+        shutil.rmtree(session_dir, ignore_errors=True)
+        return {"message": "{name} changed while it was archived".format(name=error), "statusCode": 412}
+    except OSError as error:
+        log(logging.ERROR, "Could not archive directory", path=root, error=error)
+        return {"message": "couldn't read the directory from disk", "statusCode": 500}
+    finally:
+        METRICS.add_time('FilesystemTime', started)
+
+    with METRICS.timer('EncodeTime'):
+        chunk_content = str(base64.b64encode(chunk), 'utf-8')
+    METRICS.add('Bytes', len(chunk), 'Bytes')
+
+    chunk_index = state['chunk']
+    offset = state['delivered']
+    state['chunk'] += 1
+    state['delivered'] += len(chunk)
+    complete = state['phase'] == 'done' and not state['pending']
+    cursor = None
+    if not complete:
+        cursor = encode_cursor(dict(state, pending=str(base64.b64encode(state['pending']), 'utf-8')))
+    return {"dzchunkindex": chunk_index, "dzchunkbyteoffset": offset,
+            "dzchunksize": len(chunk), "chunk_data": chunk_content, "filename": name + '.zip',
+            "complete": complete, "cursor": cursor, "statusCode": 200}
+
+
+def archive_format(archive_file):
+    """
+    Detects the format of an uploaded archive from its content rather than its name
+
+    :returns: 'zip', or the tarfile mode that reads the archive, or None if it is neither
+    """
+    if zipfile.is_zipfile(archive_file):
+        return 'zip'
+    archive_file.seek(0)
+    head = archive_file.read(6)
+    archive_file.seek(0)
+    is_tar = tarfile.is_tarfile(archive_file)
+    archive_file.seek(0)
+    if not is_tar:
+        return None
+    for magic, compression in TAR_COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return 'r:' + compression
+    return 'r:'
+
+
+def zip_members(archive_file, position):
+    """Yields (position, name, kind, size, mode, mtime, opener) for the members of a ZIP archive from position"""
+    with zipfile.ZipFile(archive_file) as zip_file:
+        members = zip_file.infolist()
+        for index in range(position, len(members)):
+            info = members[index]
+            unix_mode = info.external_attr >> 16
+            if info.is_dir():
+                kind = 'directory'
+            elif stat.S_IFMT(unix_mode) not in [0, stat.S_IFREG]:
+                # a symlink stored with its unix mode
+                kind = 'other'
+            else:
+                kind = 'file'
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            yield (index, info.filename, kind, info.file_size, stat.S_IMODE(unix_mode) & 0o777 or 0o644, mtime,
+                   functools.partial(zip_file.open, info))
+
+
+def tar_members(archive_file, mode, position):
+    """
+    Yields (position, name, kind, size, mode, mtime, opener) for the members of a tar archive
+    whose header starts at or after position. An uncompressed archive is opened at position,
+    a compressed one is decompressed from the start and the members before it are skipped.
+    """
+    if mode == 'r:':
+        archive_file.seek(position)
+    with tarfile.open(fileobj=archive_file, mode=mode) as tar:
+        while True:
+            member = tar.next()
+            if member is None:
+                return
+            # extractfile does not need the member index, so it is not kept for 50k members
+            tar.members.clear()
+            if member.offset < position:
+                continue
+            if member.isdir():
+                kind = 'directory'
+            elif member.isreg():
+                kind = 'file'
+            else:
+                kind = 'other'
+            yield (member.offset, member.name, kind, member.size, member.mode & 0o777, member.mtime,
+                   functools.partial(tar.extractfile, member))
+
+
+def member_path(root, name):
+    """
+    Resolves an archive member name inside root. Absolute names and names with a '..'
+    component are rejected rather than stripped, so nothing is written outside root.
+
+    :returns: The member's path, or None if the name is unsafe or lands in the upload session directory
+    """
+    parts = [part for part in name.split('/') if part not in ['', '.']]
+    if not parts or name.startswith('/') or '..' in parts or '\x00' in name:
+        return None
+    file_path = os.path.join(root, *parts)
+    return None if in_upload_sessions(file_path) else file_path
+
+
+def write_extracted_file(file_path, data, mode, mtime, overwrite):
+    """
+    Writes a member read whole from the archive. O_NOFOLLOW keeps a symlink in the target
+    directory from redirecting the write.
+
+    :returns: 'extracted', 'skipped' if the file exists and overwrite is off, or 'error'
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW | (os.O_TRUNC if overwrite else os.O_EXCL)
+    try:
+        fd = os.open(file_path, flags, mode)
+    except FileExistsError:
+        return 'skipped'
+    except OSError as error:
+        log(logging.WARNING, "Could not create extracted file", path=file_path, error=error)
+        return 'error'
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        os.utime(fd, (mtime, mtime))
+    except OSError as error:
+        log(logging.WARNING, "Could not write extracted file", path=file_path, error=error)
+        return 'error'
+    finally:
+        os.close(fd)
+    return 'extracted'
+
+
+def stage_large_member(stream, staging_path, written, size, deadline):
+    """
+    Streams a member too large to hold in memory to a staging file, resuming at written
+
+    :returns: The number of bytes staged, less than size if the deadline passed first
+    """
+    fd = os.open(staging_path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, written)
+        if written:
+            stream.seek(written)
+        while written < size and time.monotonic() < deadline:
+            block = stream.read(COPY_BUFFER_SIZE)
+            if not block:
+                raise ValueError('archive member is shorter than its declared size')
+            os.pwrite(fd, block, written)
+            written += len(block)
+    finally:
+        os.close(fd)
+    return written
+
+
+def extract(event):
+    path = event['path']
+    name = event['name']
+    if not valid_name(name):
+        return {"message": "invalid name", "statusCode": 400}
+    archive_path = os.path.join(path, name)
+    destination = event.get('new_path') or path
+    if not within_mount(destination):
+        return {"message": "new_path must be inside the file system", "statusCode": 400}
+    overwrite = bool(event.get('overwrite'))
+    try:
+        deadline = time.monotonic() + parse_time_budget(event)
+        workers = min(parse_positive_int(event, 'workers', DEFAULT_WORKERS), MAX_WORKERS)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    progress = {"extracted_files": 0, "extracted_directories": 0, "extracted_bytes": 0, "skipped": 0, "errors": 0}
+    state = None
+    if event.get('continuation'):
+        try:
+            state = decode_cursor(event['continuation'])
+            position = int(state['position'])
+            written = int(state['written'])
+            progress = {key: int(state[key]) for key in progress}
+        except (ValueError, KeyError, TypeError) as error:
+            log(logging.WARNING, "Invalid extract continuation token", path=archive_path, error=error)
+            return {"message": "invalid continuation token", "statusCode": 400}
+        if state.get('archive') != archive_path or state.get('destination') != destination or \
+                (written and not UPLOAD_ID_PATTERN.match(str(state.get('extract_id')))):
+            return {"message": "continuation token does not belong to this archive", "statusCode": 400}
+    else:
+        position = 0
+        written = 0
+
+    if not os.path.isdir(destination):
+        return {"message": "no such directory: {destination}".format(destination=destination), "statusCode": 404}
+    root = os.path.realpath(destination)
+    safe_directories = {root}
+    extract_id = state.get('extract_id') if state else None
+    # pending writes and the size of the member each one writes
+    in_flight = {}
+
+    def drain(limit):
+        while len(in_flight) > limit:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                size = in_flight.pop(future)
+                outcome = future.result()
+                if outcome == 'extracted':
+                    progress['extracted_files'] += 1
+                    progress['extracted_bytes'] += size
+                elif outcome == 'skipped':
+                    progress['skipped'] += 1
+                else:
+                    progress['errors'] += 1
+
+    def make_directory(dir_path):
+        # directories are created here, before any write below them is submitted. One that
+        # resolves outside root, through a symlink already on the filesystem, is refused.
+        if dir_path not in safe_directories:
+            try:
+                os.makedirs(dir_path, exist_ok=True)
+            except FileExistsError:
+                log(logging.WARNING, "A file is in the way of an extracted directory", path=dir_path)
+                return False
+            real_path = os.path.realpath(dir_path)
+            if real_path != root and not real_path.startswith(root + os.sep):
+                log(logging.WARNING, "Extracted directory resolves outside the target", path=dir_path)
+                return False
+            safe_directories.add(dir_path)
+        return True
+
+    started = time.perf_counter()
+    complete = True
+    try:
+        archive_file = open(archive_path, 'rb')
+    except FileNotFoundError:
+        return {"message": "no such file or directory", "statusCode": 404}
+    except OSError as error:
+        log(logging.ERROR, "Could not open archive", path=archive_path, error=error)
+        return {"message": "couldn't read the archive", "statusCode": 500}
+    # the archive is read by this thread, which also creates directories, while the pool
+    # overlaps the create, write and close round trips of the small files that make up
+    # most archives. At most two writes per worker are queued, so memory stays bounded.
+    executor = ThreadPoolExecutor(max_workers=workers)
+    members = None
+    try:
+        validator = file_validator(os.fstat(archive_file.fileno()))
+        if state is not None and state.get('validator') != validator:
+            return {"message": "archive changed since the extraction started", "statusCode": 412}
+        mode = archive_format(archive_file)
+        if mode is None:
+            return {"message": "unsupported archive format, expected zip or tar", "statusCode": 400}
+        members = zip_members(archive_file, position) if mode == 'zip' else \
+            tar_members(archive_file, mode, position)
+
+        for position, member_name, kind, size, member_mode, mtime, opener in members:
+            if time.monotonic() >= deadline:
+                complete = False
+                break
+            file_path = member_path(destination, member_name)
+            if file_path is None or file_path == archive_path or kind == 'other':
+                # links and devices are skipped, a link could point a later member outside root
+                log(logging.WARNING, "Skipped archive member", path=archive_path, member=member_name, kind=kind)
+                progress['skipped'] += 1
+                continue
+            if not make_directory(file_path if kind == 'directory' else os.path.dirname(file_path)):
+                progress['skipped'] += 1
+                continue
+            if kind == 'directory':
+                progress['extracted_directories'] += 1
+                continue
+            if size <= EXTRACT_INLINE_SIZE:
+                with opener() as stream:
+                    data = stream.read()
+                drain(workers * 2 - 1)
+                in_flight[executor.submit(write_extracted_file, file_path, data, member_mode, mtime,
+                                          overwrite)] = len(data)
+                continue
+
+            # larger members are staged next to upload sessions and linked into place, so a
+            # member cut off by the time budget is resumed rather than left half written
+            if not overwrite and os.path.lexists(file_path):
+                progress['skipped'] += 1
+                continue
+            if extract_id is None:
+                extract_id = 'extract-{suffix}'.format(suffix=uuid.uuid4().hex)
+            session_dir = os.path.join(UPLOAD_SESSION_DIR, extract_id)
+            if not os.path.isdir(session_dir):
+                # a new member, or a resumed one whose staging file was swept as stale
+                os.makedirs(session_dir)
+                written = 0
+            staging_path = os.path.join(session_dir, 'data')
+            with opener() as stream:
+                written = stage_large_member(stream, staging_path, written, size, deadline)
+            if written < size:
+                complete = False
+                break
+            os.chmod(staging_path, member_mode)
+            os.utime(staging_path, (mtime, mtime))
+            published = True
+            if overwrite:
+                os.rename(staging_path, file_path)
+            else:
+                # a file created while the member was staged is kept, os.rename would replace it
+                try:
+                    os.link(staging_path, file_path)
+                except FileExistsError:
+                    published = False
+                else:
+                    os.unlink(staging_path)
+            shutil.rmtree(session_dir, ignore_errors=True)
+            extract_id = None
+            written = 0
+            if published:
+                progress['extracted_files'] += 1
+                progress['extracted_bytes'] += size
+            else:
+                progress['skipped'] += 1
+        drain(0)
+    except FileNotFoundError as error:
+        log(logging.ERROR, "Archive removed during extraction", path=archive_path, error=error)
+        return {"message": "no such file or directory", "statusCode": 404}
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error, ValueError) as error:
+        log(logging.WARNING, "Could not read archive", path=archive_path, error=error)
+        return {"message": "archive is corrupt: {error}".format(error=error), "statusCode": 400}
+    except OSError as error:
+        log(logging.ERROR, "Could not extract archive", path=archive_path, error=error)
+        return {"message": "couldn't write the archive contents", "statusCode": 500}
+    finally:
+        executor.shutdown(wait=True)
+        if members is not None:
+            members.close()
+        archive_file.close()
+        METRICS.add_time('FilesystemTime', started)
+    METRICS.add('Entries', progress['extracted_files'] + progress['extracted_directories'])
+    METRICS.add('Bytes', progress['extracted_bytes'], 'Bytes')
+
+    continuation = None
+    if not complete:
+        continuation = encode_cursor({"archive": archive_path, "destination": destination, "validator": validator,
+                                      "position": position, "written": written, "extract_id": extract_id,
+                                      **progress})
+    result = {"complete": complete, "continuation": continuation, "statusCode": 200, **progress}
+    if complete and progress['errors']:
+        return dict(result, message="some files couldn't be extracted", statusCode=500)
+    return dict(result, message="extraction successful" if complete else "extraction in progress")
+
+
+def encode_cursor(state):
+    """Encodes operation state into an opaque, url safe cursor string"""
+    return base64.urlsafe_b64encode(zlib.compress(json.dumps(state).encode('utf-8'))).decode('utf-8')
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor produced by encode_cursor, raises ValueError if it is malformed"""
+    try:
+        state = json.loads(zlib.decompress(base64.urlsafe_b64decode(cursor.encode('utf-8'))))
+    except (TypeError, binascii.Error, UnicodeError, zlib.error, json.JSONDecodeError) as error:
+        raise ValueError('invalid cursor: {error}'.format(error=error))
+    if not isinstance(state, dict):
+        raise ValueError('invalid cursor')
+    return state
+
+
+def save_scan_state(state, path, scan_id=None, step=0):
+    """
+    Stores the state of an unfinished du or find in its own session directory, so the
+    continuation handed to the client stays small however wide the tree is
+
+    :returns: A continuation naming the stored state
+    """
+    if scan_id is None:
+        scan_id = 'scan-{suffix}'.format(suffix=uuid.uuid4().hex)
+    session_dir = os.path.join(UPLOAD_SESSION_DIR, scan_id)
+    os.makedirs(session_dir, exist_ok=True)
+    state_path = os.path.join(session_dir, 'state')
+    temp_path = '{state_path}.{suffix}'.format(state_path=state_path, suffix=uuid.uuid4().hex)
+    with open(temp_path, 'w') as state_file:
+        json.dump(dict(state, step=step), state_file)
+    os.replace(temp_path, state_path)
+    return encode_cursor({"path": path, "scan_id": scan_id, "step": step})
+
+
+def load_scan_state(continuation, path):
+    """
+    Loads the state a continuation from save_scan_state names
+
+    :returns: (scan_id, step, state), state is None if the scan expired or the continuation was already used
+    :raises ValueError: If the continuation is malformed or was issued for another path
+    """
+    try:
+        reference = decode_cursor(continuation)
+        scan_id = reference['scan_id']
+        step = int(reference['step'])
+    except (KeyError, TypeError) as error:
+        raise ValueError('invalid continuation: {error}'.format(error=error))
+    if reference.get('path') != path or not UPLOAD_ID_PATTERN.match(str(scan_id)):
+        raise ValueError('continuation does not belong to this path')
+    try:
+        with open(os.path.join(UPLOAD_SESSION_DIR, scan_id, 'state')) as state_file:
+            state = json.load(state_file)
+    except FileNotFoundError:
+        return scan_id, step, None
+    # every call stores a new step, an older continuation would resume from a later state
+    if state.get('step') != step:
+        return scan_id, step, None
+    return scan_id, step, state
+
+
+def discard_scan_state(scan_id):
+    if scan_id is not None:
+        shutil.rmtree(os.path.join(UPLOAD_SESSION_DIR, scan_id), ignore_errors=True)
+
+
+def entry_type(entry):
+    if entry.is_dir():
+        return 'directory'
+    if entry.is_file():
+        return 'file'
+    if entry.is_symlink():
+        return 'symlink'
+    return 'other'
+
+
+def format_entry(entry):
+    """Builds a listing entry from an os.DirEntry, using its cached stat result"""
+    item = {"name": entry.name, "type": entry_type(entry), "size": None, "mtime": None}
+    try:
+        stat_result = entry.stat()
+    except FileNotFoundError:
+        # entry was removed between readdir and stat
+        return item
+    item['size'] = stat_result.st_size
+    item['mtime'] = stat_result.st_mtime
+    return item
+
+
+def sort_key(sort, entry):
+    """Returns the sort key of an os.DirEntry, ties are broken by name"""
+    if sort == 'name':
+        return entry.name
+    try:
+        stat_result = entry.stat()
+    except FileNotFoundError:
+        return (-1, entry.name)
+    if sort == 'size':
+        return (stat_result.st_size, entry.name)
+    return (stat_result.st_mtime, entry.name)
+
+
+def parse_sort_key(sort, value):
+    """Reads back a sort key from a cursor, raises ValueError if it is not of the form sort_key returns"""
+    if sort == 'name':
+        if not isinstance(value, str):
+            raise ValueError('invalid sort key')
+        return value
+    if not isinstance(value, builtins.list) or len(value) != 2 or \
+            not isinstance(value[0], (int, float)) or not isinstance(value[1], str):
+        raise ValueError('invalid sort key')
+    return tuple(value)
+
+
+def name_filter(prefix, pattern, hidden=None):
+    """Builds a predicate matching entry names against an optional prefix and glob pattern, never matching hidden"""
+    pattern_match = re.compile(fnmatch.translate(pattern)).match if pattern else None
+
+    def matches(name):
+        if name == hidden:
+            return False
+        if prefix and not name.startswith(prefix):
+            return False
+        if pattern_match and not pattern_match(name):
+            return False
+        return True
+
+    return matches
+
+
+def parse_positive_int(event, key, default):
+    """Reads a positive integer from the event, raises ValueError if it is invalid"""
+    try:
+        value = int(event.get(key, default))
+    except (TypeError, ValueError):
+        raise ValueError('{key} must be an integer'.format(key=key))
+    if value < 1:
+        raise ValueError('{key} must be greater than 0'.format(key=key))
+    return value
 
 
 def list(event):
-    # get path to list
+    # list: {"operation": "list", "path": "$dir", "cursor": "$cursor", "page_size": 1000,
+    #        "sort": "name|size|mtime", "order": "asc|desc", "prefix": "$prefix", "pattern": "*.log", "limit": 10}
     try:
         path = event['path']
     except KeyError:
         return {"message": "missing required parameter: path", "statusCode": 400}
 
     try:
-        dir_items = []
-        file_items = []
-        for (dirpath, dirnames, filenames) in os.walk(path):
-            dir_items.extend(dirnames)
-            file_items.extend(filenames)
-            break
+        page_size = min(parse_positive_int(event, 'page_size', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+        limit = event.get('limit')
+        if limit is not None:
+            limit = min(parse_positive_int(event, 'limit', None), MAX_PAGE_SIZE)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    sort = event.get('sort')
+    order = event.get('order', 'asc')
+    if sort is None and limit is not None:
+        sort = 'name'
+    if sort is not None and sort not in SORT_KEYS:
+        return {"message": "sort must be one of: {keys}".format(keys=', '.join(SORT_KEYS)), "statusCode": 400}
+    if order not in ['asc', 'desc']:
+        return {"message": "order must be one of: asc, desc", "statusCode": 400}
+
+    listing = {"sort": sort, "order": order, "prefix": event.get('prefix'), "pattern": event.get('pattern')}
+    matches = name_filter(listing['prefix'], listing['pattern'], hidden_entry_name(path))
+
+    # unsorted pages resume at a readdir position, sorted pages after the last sort key returned
+    offset = 0
+    after = None
+    if event.get('cursor'):
+        try:
+            cursor_state = decode_cursor(event['cursor'])
+            if sort is None:
+                offset = int(cursor_state['offset'])
+            else:
+                after = parse_sort_key(sort, cursor_state['after'])
+        except (ValueError, KeyError, TypeError) as error:
+            log(logging.WARNING, "Invalid list cursor", path=path, error=error)
+            return {"message": "invalid cursor", "statusCode": 400}
+        if cursor_state.get('path') != path:
+            return {"message": "cursor does not belong to this path", "statusCode": 400}
+        if cursor_state.get('listing', listing) != listing:
+            return {"message": "cursor was issued for a different sort or filter", "statusCode": 400}
+
+    # the directory's mtime/ctime change whenever an entry is added, removed or renamed, so a
+    # single stat validates a cached page. Size or mtime changes of a file's contents do not
+    # touch the directory and are only picked up once the page is evicted.
+    cache_key = (path, sort, order, listing['prefix'], listing['pattern'], offset, after, page_size, limit)
+    try:
+        directory_stat = os.stat(path)
+        validator = (directory_stat.st_ino, directory_stat.st_mtime_ns, directory_stat.st_ctime_ns)
+    except OSError:
+        validator = None
+    if validator is not None:
+        cached = LISTING_CACHE.get(cache_key, validator)
+        if cached is not None:
+            METRICS.add('Entries', len(cached['entries']))
+            return dict(cached, cache=LISTING_CACHE.stats(hit=True))
+
+    page = []
+    next_cursor = None
+    started = time.perf_counter()
+    try:
+        with os.scandir(path) as iterator:
+            if sort is None:
+                # readdir order is stable for an unmodified directory, so entries before the
+                # cursor offset are skipped without being stat'ed
+                for position, entry in enumerate(iterator):
+                    if position < offset or not matches(entry.name):
+                        continue
+                    if len(page) == page_size:
+                        next_cursor = encode_cursor({"path": path, "offset": position, "listing": listing})
+                        break
+                    page.append(entry)
+            else:
+                # a page is the top k of the entries sorting after the cursor's key, so every
+                # page holds at most page_size + 1 entries in memory however deep it is
+                k = limit if limit is not None else page_size + 1
+                keyed = ((sort_key(sort, entry), entry) for entry in iterator if matches(entry.name))
+                if after is not None:
+                    keyed = (item for item in keyed if (item[0] < after if order == 'desc' else item[0] > after))
+                select = heapq.nlargest if order == 'desc' else heapq.nsmallest
+                selected = select(k, keyed, key=lambda item: item[0])
+                if limit is None and len(selected) > page_size:
+                    selected = selected[:page_size]
+                    next_cursor = encode_cursor({"path": path, "after": selected[-1][0], "listing": listing})
+                page = [entry for _, entry in selected]
+        entries = [format_entry(entry) for entry in page]
     except Exception as error:
-        print(error)
+        log(logging.ERROR, "Could not list directory", path=path, error=error)
         return {"message": "unable to list files", "statusCode": 500}
+    finally:
+        METRICS.add_time('FilesystemTime', started)
+    METRICS.add('Entries', len(entries))
+
+    dir_items = [item['name'] for item in entries if item['type'] == 'directory']
+    file_items = [item['name'] for item in entries if item['type'] != 'directory']
+    result = {"path": path, "directiories": dir_items, "files": file_items, "entries": entries,
+              "cursor": next_cursor, "statusCode": 200}
+    if validator is not None:
+        LISTING_CACHE.put(cache_key, validator, result, len(entries) + 1)
+    return dict(result, cache=LISTING_CACHE.stats(hit=False))
+
+
+def parse_time_budget(event):
+    """Reads the time budget of a long running operation, clamped to MAX_TIME_BUDGET"""
+    try:
+        time_budget = float(event.get('time_budget', DEFAULT_TIME_BUDGET))
+    except (TypeError, ValueError):
+        raise ValueError('time_budget must be a number')
+    if not time_budget > 0:
+        raise ValueError('time_budget must be greater than 0')
+    return min(time_budget, MAX_TIME_BUDGET)
+
+
+def scan_directory(dir_path):
+    """Scans a single directory without following symlinks
+
+    :returns: (bytes, files, dirs, subdirectory paths) for the directory's direct entries
+    """
+    total_bytes = 0
+    files = 0
+    subdirectories = []
+    hidden = hidden_entry_name(dir_path)
+    with os.scandir(dir_path) as iterator:
+        for entry in iterator:
+            if entry.name == hidden:
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                else:
+                    total_bytes += entry.stat(follow_symlinks=False).st_size
+                    files += 1
+            except FileNotFoundError:
+                continue
+    return total_bytes, files, len(subdirectories), subdirectories
+
+
+def du(event):
+    try:
+        path = event['path']
+    except KeyError:
+        return {"message": "missing required parameter: path", "statusCode": 400}
+
+    try:
+        deadline = time.monotonic() + parse_time_budget(event)
+        workers = min(parse_positive_int(event, 'workers', DEFAULT_WORKERS), MAX_WORKERS)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    started = time.perf_counter()
+    scan_id = None
+    step = 0
+    if event.get('continuation'):
+        try:
+            scan_id, step, state = load_scan_state(event['continuation'], path)
+        except ValueError as error:
+            log(logging.WARNING, "Invalid disk usage continuation token", path=path, error=error)
+            return {"message": "invalid continuation token", "statusCode": 400}
+        if state is None:
+            return {"message": "disk usage scan expired or already resumed, start it again", "statusCode": 410}
+        children = state['children']
+        pending = state['pending']
+        errors = state['errors']
     else:
-        return {"path": path, "directiories": dir_items, "files": file_items, "statusCode": 200}
+        # direct children of path each get their own totals, files directly in path share '.'
+        children = {".": {"type": "files", "bytes": 0, "files": 0, "dirs": 0}}
+        pending = []
+        errors = 0
+        hidden = hidden_entry_name(path)
+        try:
+            with os.scandir(path) as iterator:
+                for entry in iterator:
+                    if entry.name == hidden:
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            children[entry.name] = {"type": "directory", "bytes": 0, "files": 0, "dirs": 0}
+                            pending.append([entry.name, entry.path])
+                        else:
+                            children['.']['bytes'] += entry.stat(follow_symlinks=False).st_size
+                            children['.']['files'] += 1
+                    except FileNotFoundError:
+                        continue
+        except OSError as error:
+            log(logging.ERROR, "Could not scan directory", path=path, error=error)
+            return {"message": "unable to compute disk usage", "statusCode": 500}
+
+    # EFS metadata calls are latency bound, so many directories are scanned concurrently.
+    # pending is consumed from the end (depth first) to keep the stored state small.
+    executor = ThreadPoolExecutor(max_workers=workers)
+    in_flight = {}
+    try:
+        while pending or in_flight:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            while pending and len(in_flight) < workers:
+                child, dir_path = pending.pop()
+                in_flight[executor.submit(scan_directory, dir_path)] = [child, dir_path]
+            done, _ = wait(in_flight, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                child, dir_path = in_flight.pop(future)
+                try:
+                    total_bytes, files, dirs, subdirectories = future.result()
+                except OSError as error:
+                    log(logging.WARNING, "Could not scan directory", path=dir_path, error=error)
+                    errors += 1
+                    continue
+                children[child]['bytes'] += total_bytes
+                children[child]['files'] += files
+                children[child]['dirs'] += dirs
+                pending.extend([child, subdirectory] for subdirectory in subdirectories)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        METRICS.add_time('FilesystemTime', started)
+
+    # scans still running when the budget ran out are discarded and redone on continuation
+    pending.extend(in_flight.values())
+
+    # the children and pending directories grow with the width of the tree, so they are kept
+    # in a session directory and the continuation only names them
+    continuation = None
+    try:
+        if pending:
+            continuation = save_scan_state({"children": children, "pending": pending, "errors": errors},
+                                           path, scan_id, step + 1)
+        else:
+            discard_scan_state(scan_id)
+    except OSError as error:
+        log(logging.ERROR, "Could not store disk usage state", path=path, error=error)
+        return {"message": "unable to compute disk usage", "statusCode": 500}
+
+    totals = {"bytes": 0, "files": 0, "dirs": 0}
+    for child in children.values():
+        for key in totals:
+            totals[key] += child[key]
+    totals['dirs'] += len(children) - 1
+    METRICS.add('Entries', totals['files'] + totals['dirs'])
+
+    child_items = sorted(({"name": name, **child} for name, child in children.items()),
+                         key=lambda child: child['bytes'], reverse=True)
+
+    return {"path": path, "children": child_items, "totals": totals, "errors": errors,
+            "complete": continuation is None, "continuation": continuation, "statusCode": 200}
+
+
+def parse_search(event):
+    """
+    Reads the name and metadata criteria of a find into a dict that is stored with its scan state
+
+    :raises ValueError: If a criterion is invalid
+    """
+    search = {"pattern": event.get('pattern'), "regex": event.get('regex'), "type": event.get('type')}
+    for key in ['pattern', 'regex']:
+        if search[key] is not None and not isinstance(search[key], str):
+            raise ValueError('{key} must be a string'.format(key=key))
+    if search['regex'] is not None:
+        try:
+            re.compile(search['regex'])
+        except re.error as error:
+            raise ValueError('invalid regex: {error}'.format(error=error))
+    if search['type'] not in [None, 'file', 'directory', 'symlink', 'other']:
+        raise ValueError('type must be one of: file, directory, symlink, other')
+    for key, parse in [('min_size', int), ('max_size', int), ('modified_after', float), ('modified_before', float)]:
+        value = event.get(key)
+        if value is not None:
+            try:
+                value = parse(value)
+            except (TypeError, ValueError):
+                raise ValueError('{key} must be a number'.format(key=key))
+        search[key] = value
+    return search
+
+
+def compile_search(search):
+    """
+    Builds the matcher of a find. Names are checked first, an entry is only stat'ed once its
+    name matches.
+
+    :returns: A function returning the listing entry of a matching os.DirEntry, or None
+    """
+    name_matches = name_filter(None, search['pattern'])
+    regex_search = re.compile(search['regex']).search if search['regex'] is not None else None
+    size_bounds = search['min_size'] is not None or search['max_size'] is not None
+    mtime_bounds = search['modified_after'] is not None or search['modified_before'] is not None
+
+    def match(entry):
+        if not name_matches(entry.name) or (regex_search and not regex_search(entry.name)):
+            return None
+        item = format_entry(entry)
+        if search['type'] is not None and item['type'] != search['type']:
+            return None
+        if size_bounds and (item['size'] is None or
+                            (search['min_size'] is not None and item['size'] < search['min_size']) or
+                            (search['max_size'] is not None and item['size'] > search['max_size'])):
+            return None
+        if mtime_bounds and (item['mtime'] is None or
+                             (search['modified_after'] is not None and item['mtime'] < search['modified_after']) or
+                             (search['modified_before'] is not None and item['mtime'] > search['modified_before'])):
+            return None
+        return item
+
+    return match
+
+
+def scan_for_matches(dir_path, offset, match, limit, deadline):
+    """
+    Scans a directory from the readdir position offset for matches and subdirectories
+
+    :returns: ([(position, name, matching entry or None, is subdirectory)], position to resume
+              the directory at or None) stopping after limit matches or at the deadline
+    """
+    events = []
+    found = 0
+    hidden = hidden_entry_name(dir_path)
+    with os.scandir(dir_path) as iterator:
+        for position, entry in enumerate(iterator):
+            if position < offset or entry.name == hidden:
+                continue
+            if found == limit or time.monotonic() >= deadline:
+                return events, position
+            try:
+                item = match(entry)
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if item is not None:
+                found += 1
+            if item is not None or is_dir:
+                events.append((position, entry.name, item, is_dir))
+    return events, None
+
+
+def find(event):
+    # find: {"operation": "find", "path": "$dir", "pattern": "*.parquet", "regex": "$regex",
+    #        "type": "file|directory|symlink|other", "min_size": $bytes, "max_size": $bytes,
+    #        "modified_after": $epoch, "modified_before": $epoch, "page_size": 1000, "cursor": "$cursor",
+    #        "time_budget": $seconds, "workers": $workers}
+    path = event['path']
+    try:
+        search = parse_search(event)
+        page_size = min(parse_positive_int(event, 'page_size', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+        deadline = time.monotonic() + parse_time_budget(event)
+        workers = min(parse_positive_int(event, 'workers', DEFAULT_WORKERS), MAX_WORKERS)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    scan_id = None
+    step = 0
+    if event.get('cursor'):
+        try:
+            scan_id, step, state = load_scan_state(event['cursor'], path)
+        except ValueError as error:
+            log(logging.WARNING, "Invalid find cursor", path=path, error=error)
+            return {"message": "invalid cursor", "statusCode": 400}
+        if state is None:
+            return {"message": "search expired or already resumed, start it again", "statusCode": 410}
+        if state['search'] != search:
+            return {"message": "cursor was issued for a different search", "statusCode": 400}
+        frontier = deque(state['frontier'])
+        scanned = state['scanned']
+        errors = state['errors']
+    else:
+        if not os.path.isdir(path):
+            return {"message": "no such directory", "statusCode": 404}
+        # directories still to scan, relative to path, with the readdir position to resume at
+        frontier = deque([['', 0]])
+        scanned = 0
+        errors = 0
+
+    match = compile_search(search)
+    matches = []
+    # directories are scanned breadth first on a pool, EFS metadata calls are latency bound.
+    # A directory's results are taken in readdir order up to the end of the page, and the
+    # directory is queued again at the first position that did not fit, so no match is
+    # returned twice or skipped between pages.
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    in_flight = {}
+    try:
+        while (frontier or in_flight) and len(matches) < page_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            while frontier and len(in_flight) < workers:
+                directory, offset = frontier.popleft()
+                in_flight[executor.submit(scan_for_matches, os.path.join(path, directory), offset, match,
+                                          page_size, deadline)] = [directory, offset]
+            done, _ = wait(in_flight, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory, offset = in_flight.pop(future)
+                try:
+                    events, resume = future.result()
+                except OSError as error:
+                    log(logging.WARNING, "Could not scan directory", path=os.path.join(path, directory), error=error)
+                    errors += 1
+                    continue
+                for position, name, item, is_dir in events:
+                    if item is not None:
+                        if len(matches) == page_size:
+                            resume = position
+                            break
+                        matches.append(dict(item, path=os.path.join(directory, name)))
+                    if is_dir:
+                        frontier.append([os.path.join(directory, name), 0])
+                if resume is not None:
+                    frontier.appendleft([directory, resume])
+                else:
+                    scanned += 1
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        METRICS.add_time('FilesystemTime', started)
+    METRICS.add('Entries', len(matches))
+
+    # scans still running at the end of the page or budget are redone from the cursor
+    frontier.extend(in_flight.values())
+    # the frontier holds every directory seen but not scanned, it is stored with the other
+    # scan states and the cursor only names it
+    cursor = None
+    try:
+        if frontier:
+            cursor = save_scan_state({"search": search, "frontier": builtins.list(frontier), "scanned": scanned,
+                                      "errors": errors}, path, scan_id, step + 1)
+        else:
+            discard_scan_state(scan_id)
+    except OSError as error:
+        log(logging.ERROR, "Could not store search state", path=path, error=error)
+        return {"message": "unable to search the directory", "statusCode": 500}
+    return {"path": path, "matches": matches, "scanned_directories": scanned, "errors": errors,
+            "complete": cursor is None, "cursor": cursor, "statusCode": 200}
+
+
+def unlink_entry(entry_path):
+    """Unlinks a file or symlink, an entry that is already gone counts as deleted"""
+    try:
+        os.unlink(entry_path)
+    except FileNotFoundError:
+        pass
+    except OSError as error:
+        log(logging.WARNING, "Could not delete file", path=entry_path, error=error)
+        return False
+    return True
+
+
+def delete_tree(root, deadline, workers):
+    """
+    Deletes a directory tree bottom up, unlinking files on a pool of workers. Each directory is
+    removed once its subdirectories are and the unlinks of its files have finished.
+
+    :returns: (files deleted, directories deleted, errors, whether the root is gone)
+    """
+    files = 0
+    directories = 0
+    errors = 0
+    in_flight = set()
+
+    def drain(limit):
+        nonlocal files, errors
+        while len(in_flight) > limit:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.remove(future)
+                if future.result():
+                    files += 1
+                else:
+                    errors += 1
+
+    # unlinks are submitted while the directory is read, with at most two per worker queued,
+    # so directories of any size are deleted in constant memory
+    executor = ThreadPoolExecutor(max_workers=workers)
+    stack = [[root, False]]
+    try:
+        while stack and time.monotonic() < deadline:
+            dir_path, scanned = stack[-1]
+            if scanned:
+                stack.pop()
+                drain(0)
+                try:
+                    os.rmdir(dir_path)
+                    directories += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as error:
+                    # a file below could not be deleted, so every ancestor stays
+                    log(logging.WARNING, "Could not delete directory", path=dir_path, error=error)
+                    errors += 1
+                continue
+            stack[-1][1] = True
+            subdirectories = []
+            hidden = hidden_entry_name(dir_path)
+            try:
+                with os.scandir(dir_path) as iterator:
+                    for entry in iterator:
+                        if entry.name == hidden:
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append([entry.path, False])
+                        else:
+                            drain(workers * 2 - 1)
+                            in_flight.add(executor.submit(unlink_entry, entry.path))
+                        if time.monotonic() >= deadline:
+                            break
+            except FileNotFoundError:
+                continue
+            except OSError as error:
+                log(logging.WARNING, "Could not scan directory", path=dir_path, error=error)
+                errors += 1
+            stack.extend(subdirectories)
+        drain(0)
+    finally:
+        executor.shutdown(wait=True)
+
+    return files, directories, errors, not stack
+
+
+def delete_recursive(event):
+    path = event['path']
+    name = event['name']
+    try:
+        root = entry_path(event)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    try:
+        deadline = time.monotonic() + parse_time_budget(event)
+        workers = min(parse_positive_int(event, 'workers', DEFAULT_WORKERS), MAX_WORKERS)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    progress = {"deleted_files": 0, "deleted_directories": 0}
+    if event.get('continuation'):
+        try:
+            state = decode_cursor(event['continuation'])
+            progress = {key: int(state[key]) for key in progress}
+        except (ValueError, KeyError, TypeError) as error:
+            log(logging.WARNING, "Invalid delete continuation token", path=path, error=error)
+            return {"message": "invalid continuation token", "statusCode": 400}
+        if state.get('path') != path or state.get('name') != name:
+            return {"message": "continuation token does not belong to this path", "statusCode": 400}
+
+    started = time.perf_counter()
+    try:
+        if not os.path.isdir(root) or os.path.islink(root):
+            os.remove(root)
+            files, directories, errors, complete = 1, 0, 0, True
+        else:
+            # a resumed delete walks the remaining tree again, everything deleted before is gone
+            files, directories, errors, complete = delete_tree(root, deadline, workers)
+    except FileNotFoundError:
+        return {"message": "no such file or directory", "statusCode": 404}
+    except OSError as error:
+        log(logging.ERROR, "Could not delete", path=root, error=error)
+        return {"message": "couldn't delete the file", "statusCode": 500}
+    finally:
+        METRICS.add_time('FilesystemTime', started)
+    METRICS.add('Entries', files + directories)
+
+    progress['deleted_files'] += files
+    progress['deleted_directories'] += directories
+    continuation = None
+    if not complete:
+        continuation = encode_cursor({"path": path, "name": name, **progress})
+    result = {"errors": errors, "complete": complete, "continuation": continuation, "statusCode": 200, **progress}
+    if complete and errors:
+        return dict(result, message="some entries couldn't be deleted", statusCode=500)
+    return dict(result, message="deletion successful" if complete else "deletion in progress")
+
+
+def peak_memory_mb():
+    """
+    Returns the container's peak resident memory. ru_maxrss is a high water mark across warm
+    invocations, so it is a property of the container and not of the operation that reports it.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_batch_item(item):
+    """Runs a single sub-operation of a batch, errors are returned rather than raised"""
+    if not isinstance(item, dict):
+        return {"message": "batch items must be objects", "statusCode": 400}
+    operation_type = item.get('operation')
+    if operation_type not in BATCH_OPERATIONS:
+        return {"message": "batch operation must be one of: {operations}".format(
+            operations=', '.join(BATCH_OPERATIONS)), "statusCode": 400}
+    # a recursive delete runs on its own time budget, a batch of them would overrun the lambda timeout
+    excluded = [field for field in BATCH_ITEM_EXCLUDED_FIELDS if field in item]
+    if excluded:
+        return {"message": "batch items do not accept: {fields}".format(fields=', '.join(excluded)),
+                "operation": operation_type, "statusCode": 400}
+    return dict(OPERATIONS[operation_type].run(operation_type, item), operation=operation_type)
+
+
+def batch(event):
+    operations = event['operations']
+    if len(operations) > MAX_BATCH_SIZE:
+        return {"message": "a batch holds at most {max} operations".format(max=MAX_BATCH_SIZE), "statusCode": 400}
+    try:
+        workers = min(parse_positive_int(event, 'workers', DEFAULT_WORKERS), MAX_WORKERS)
+    except ValueError as error:
+        return {"message": str(error), "statusCode": 400}
+
+    # each item is a single metadata call whose latency is the EFS round trip, so a bounded
+    # pool overlaps them. Results keep the order of the request.
+    started = time.perf_counter()
+    if len(operations) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(operations))) as executor:
+            results = builtins.list(executor.map(run_batch_item, operations))
+    else:
+        results = [run_batch_item(item) for item in operations]
+    METRICS.add_time('FilesystemTime', started)
+    METRICS.add('Entries', len(operations))
+
+    failed = sum(1 for result in results if result['statusCode'] >= 400)
+    return {"results": results, "succeeded": len(results) - failed, "failed": failed, "statusCode": 200}
+
+
+def payload_size(value):
+    """Estimates the JSON size of a payload from its strings, which dominate file operation payloads"""
+    if isinstance(value, dict):
+        return sum(len(key) + payload_size(item) for key, item in value.items())
+    if isinstance(value, builtins.list):
+        return sum(payload_size(item) for item in value)
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 0
+
+
+def compile_validator(fields):
+    """
+    Builds the validator of an operation's required event fields once, at import, so each call
+    only does the lookups and isinstance checks
+
+    :param fields: Maps each required field to the type or tuple of types it accepts
+    :returns: A function returning the error message for an invalid event, or None
+    """
+    checks = tuple((field, types, 'missing required parameter: {field}'.format(field=field),
+                    'invalid parameter: {field}'.format(field=field)) for field, types in fields.items())
+
+    def validate(event):
+        for field, types, missing_message, invalid_message in checks:
+            value = event.get(field)
+            if value is None:
+                return missing_message
+            if not isinstance(value, types):
+                return invalid_message
+        return None
+
+    return validate
+
+
+class Operation:
+    """
+    A registered operation: its handler and the event fields the handler requires. Calling it
+    validates the event, times the handler and shapes its result or failure into the common
+    {"statusCode": ...} envelope.
+    """
+
+    def __init__(self, handler, required):
+        self.handler = handler
+        self.validate = compile_validator(required)
+
+    def run(self, operation_type, event):
+        """Validates the event and runs the handler, returning its result in the common envelope"""
+        error = self.validate(event)
+        if error is not None:
+            return {"message": error, "statusCode": 400}
+        if touches_upload_sessions(event):
+            return {"message": "path is reserved for upload sessions", "statusCode": 400}
+        try:
+            result = self.handler(event)
+        except Exception as error:
+            LOGGER.exception("Operation failed", extra={"fields": {"operation": operation_type}})
+            return {"message": "{operation_type} failed: {error}".format(operation_type=operation_type, error=error),
+                    "statusCode": 500}
+        result.setdefault('statusCode', 200)
+        return result
+
+    def __call__(self, operation_type, event):
+        METRICS.start(operation_type)
+        result = self.run(operation_type, event)
+        METRICS.add('RequestSize', payload_size(event), 'Bytes')
+        METRICS.add('ResponseSize', payload_size(result), 'Bytes')
+        METRICS.set_container('ContainerPeakMemory', peak_memory_mb(), 'Megabytes')
+        METRICS.emit()
+        return result
+
+
+OPERATIONS = {
+    'upload': Operation(upload, {'path': str, 'chunk_data': dict}),
+    'list': Operation(list, {'path': str}),
+    'delete': Operation(delete, {'path': str, 'name': str}),
+    'make_dir': Operation(make_dir, {'path': str, 'name': str}),
+    'download': Operation(download, {'path': str, 'filename': str}),
+    'upload_status': Operation(upload_status, {'dzuuid': str}),
+    'download_plan': Operation(download_plan, {'path': str, 'filename': str}),
+    'download_chunk': Operation(download_chunk, {'path': str, 'filename': str, 'validator': str,
+                                                 'chunk_index': (int, str)}),
+    'du': Operation(du, {'path': str}),
+    'find': Operation(find, {'path': str}),
+    'stat': Operation(stat_object, {'path': str, 'name': str}),
+    'rename': Operation(rename, {'path': str, 'name': str, 'new_name': str}),
+    'move': Operation(rename, {'path': str, 'name': str, 'new_path': str}),
+    'copy': Operation(copy, {'path': str, 'name': str}),
+    'archive': Operation(archive, {'path': str, 'name': str}),
+    'extract': Operation(extract, {'path': str, 'name': str}),
+    # the list operation shadows the builtin in this module
+    'batch': Operation(batch, {'operations': builtins.list}),
+}
 
 
 def lambda_handler(event, _context):
@@ -148,18 +2532,9 @@ def lambda_handler(event, _context):
     except KeyError:
         return {"message": "missing required parameter: operation", "statusCode": 400}
     else:
-        if operation_type == 'upload':
-            upload_result = upload(event)
-            return upload_result
-        if operation_type == 'list':
-            list_result = list(event)
-            return list_result
-        if operation_type == 'delete':
-            delete_result = delete(event)
-            return delete_result
-        if operation_type == 'make_dir':
-            make_dir_result = make_dir(event)
-            return make_dir_result
-        if operation_type == 'download':
-            download_result = download(event)
-            return download_result
+        operation = OPERATIONS.get(operation_type) if isinstance(operation_type, str) else None
+        if operation is None:
+            return {"message": "unknown operation: {operation_type}".format(operation_type=operation_type),
+                    "statusCode": 400}
+        log(logging.DEBUG, "Operation received", operation=operation_type, event=event)
+        return operation(operation_type, event)
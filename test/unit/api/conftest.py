@@ -10,6 +10,11 @@ def mock_env_variables(monkeypatch):
     monkeypatch.setenv("stackPrefix", "testStackPrefix")
     monkeypatch.setenv("botoConfig", '{"user_agent_extra": "AwsSolution/SO0145/vX.X.X"}')
 
+@pytest.fixture(autouse=True)
+def reset_control_plane_cache(mock_env_variables):
+    from app import CONTROL_PLANE_CACHE
+    CONTROL_PLANE_CACHE.invalidate()
+
 @pytest.fixture
 def test_client(mock_env_variables):
     from app import app
@@ -220,10 +220,57 @@ cfn_describe_stacks_response = {
     'NextToken': 'string'
 }
 
+cfn_list_stacks_first_page_response = {
+    'StackSummaries': [
+        {
+            'StackId': 'string',
+            'StackName': 'testStackPrefix',
+            'CreationTime': datetime(2024, 1, 1),
+            'StackStatus': 'CREATE_COMPLETE'
+        },
+        {
+            'StackId': 'string',
+            'StackName': test_stack_name,
+            'TemplateDescription': 'Simple File Manager for Amazon EFS - Deploys the EFS Access Point and Lambda to manage an EFS file system (manager version 2)',
+            'CreationTime': datetime(2024, 1, 2),
+            'StackStatus': 'CREATE_COMPLETE'
+        },
+        {
+            'StackId': 'string',
+            'StackName': 'testStackPrefix-ManagedResources-fs-00000002',
+            'CreationTime': datetime(2024, 1, 3),
+            'StackStatus': 'DELETE_IN_PROGRESS'
+        },
+    ],
+    'NextToken': 'page2'
+}
+
+cfn_list_stacks_second_page_response = {
+    'StackSummaries': [
+        {
+            'StackId': 'string',
+            'StackName': 'testStackPrefix-ManagedResources-fs-00000002',
+            'TemplateDescription': 'Simple File Manager for Amazon EFS - Deploys the EFS Access Point and Lambda to manage an EFS file system',
+            'CreationTime': datetime(2024, 1, 4),
+            'StackStatus': 'CREATE_IN_PROGRESS'
+        },
+        {
+            'StackId': 'string',
+            'StackName': 'otherPrefix-ManagedResources-fs-00000003',
+            'CreationTime': datetime(2024, 1, 5),
+            'StackStatus': 'CREATE_COMPLETE'
+        },
+    ]
+}
+
 cfn_create_stack_response = {
     'StackId': test_stack_name
 }
 
+cfn_update_stack_response = {
+    'StackId': test_stack_name
+}
+
 lambda_invoke_upload_response = {
     'StatusCode': 200,
     'FunctionError': 'string',
@@ -232,6 +279,70 @@ lambda_invoke_upload_response = {
     'ExecutedVersion': 'string'
 }
 
+lambda_invoke_delete_metrics_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({"message": "file deletion successful", "statusCode": 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_batch_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({"results": [{"message": "file deletion successful", "operation": "delete", "statusCode": 200}, {"message": "couldn't delete the file", "operation": "delete", "statusCode": 500}], "succeeded": 1, "failed": 1, "statusCode": 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_delete_recursive_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({"message": "deletion in progress", "deleted_files": 5000, "deleted_directories": 12, "errors": 0, "complete": False, "continuation": "eJyrVkrOz0lNzsjPS8xJUbJSUEorys9VqgUAVdcHow==", "statusCode": 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_move_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({"message": "rename successful", "statusCode": 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_copy_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({"message": "copy successful", "bytes_copied": 4, "size": 4, "complete": True, "continuation": None, "statusCode": 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_extract_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({"message": "extraction successful", "extracted_files": 3, "extracted_directories": 1, "extracted_bytes": 2011, "skipped": 0, "errors": 0, "complete": True, "continuation": None, "statusCode": 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_find_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({"path": "/mnt/efs", "matches": [{"name": "part-0.parquet", "type": "file", "size": 1024, "mtime": 1700000000.0, "path": "project/data/part-0.parquet"}], "scanned_directories": 3, "errors": 0, "complete": True, "cursor": None, "statusCode": 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_archive_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({"dzchunkindex": 0, "dzchunkbyteoffset": 0, "dzchunksize": 4, "chunk_data": "UEsDBA==", "filename": "logs.zip", "complete": False, "cursor": "eJyrVkrOz0lNzsjPS8xJUbJSUEorys9VqgUAVdcHow==", "statusCode": 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
 lambda_invoke_delete_response = {
     'StatusCode': 200,
     'FunctionError': 'string',
@@ -240,6 +351,15 @@ lambda_invoke_delete_response = {
     'ExecutedVersion': 'string'
 }
 
+# managers deployed by an earlier release answer operations they do not know with null
+lambda_invoke_legacy_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(b'null'),
+    'ExecutedVersion': 'string'
+}
+
 lambda_invoke_list_response = {
     'StatusCode': 200,
     'FunctionError': 'string',
@@ -248,6 +368,46 @@ lambda_invoke_list_response = {
     'ExecutedVersion': 'string'
 }
 
+lambda_invoke_list_paginated_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({'path': '/mnt/efs/', 'directiories': [], 'files': ['test.txt'], 'entries': [{'name': 'test.txt', 'type': 'file', 'size': 4, 'mtime': 1600000000.0}], 'cursor': 'eyJvZmZzZXQiOiAyfQ==', 'statusCode': 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_du_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({'path': '/mnt/efs/', 'children': [{'name': 'logs', 'type': 'directory', 'bytes': 4, 'files': 1, 'dirs': 0}], 'totals': {'bytes': 4, 'files': 1, 'dirs': 1}, 'errors': 0, 'complete': True, 'continuation': None, 'statusCode': 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_du_partial_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({'path': '/mnt/efs/', 'children': [], 'totals': {'bytes': 0, 'files': 0, 'dirs': 1}, 'errors': 0, 'complete': False, 'continuation': 'abc', 'statusCode': 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_upload_status_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({'dzuuid': 'abc', 'path': '/mnt/efs/', 'filename': 'test.txt', 'dztotalfilesize': 8, 'dztotalchunkcount': 2, 'dzchunksize': 4, 'received_chunks': 1, 'received_ranges': [[0, 0]], 'missing_ranges': [[1, 1]], 'complete': False, 'statusCode': 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
+lambda_invoke_download_plan_response = {
+    'StatusCode': 200,
+    'FunctionError': 'string',
+    'LogResult': 'string',
+    'Payload': io.BytesIO(bytes(json.dumps({"dztotalfilesize": 4, "dzchunksize": 4706304, "dztotalchunkcount": 1, "validator": "1-4-1", "statusCode": 200}), 'utf-8')),
+    'ExecutedVersion': 'string'
+}
+
 lambda_invoke_make_dir_response = {
     'StatusCode': 200,
     'FunctionError': 'string',
@@ -268,6 +428,6 @@ lambda_invoke_download_response = {
 
 
 EFS = {'describe_file_systems_no_marker': efs_describe_file_systems_no_marker_response, 'describe_file_systems_marker': efs_describe_file_systems_marker_response, 'describe_mount_targets': efs_describe_mount_targets_response, 'describe_mount_target_security_groups': efs_describe_mount_target_security_groups_response}
-CFN = {'describe_stacks': cfn_describe_stacks_response, 'create_stack': cfn_create_stack_response}
-LAMBDA = {'upload': lambda_invoke_upload_response, 'delete': lambda_invoke_delete_response, 'list': lambda_invoke_list_response, 'make_dir': lambda_invoke_make_dir_response, 'download': lambda_invoke_download_response}
+CFN = {'describe_stacks': cfn_describe_stacks_response, 'create_stack': cfn_create_stack_response, 'update_stack': cfn_update_stack_response, 'list_stacks_first_page': cfn_list_stacks_first_page_response, 'list_stacks_second_page': cfn_list_stacks_second_page_response}
+LAMBDA = {'upload': lambda_invoke_upload_response, 'upload_status': lambda_invoke_upload_status_response, 'delete': lambda_invoke_delete_response, 'delete_metrics': lambda_invoke_delete_metrics_response, 'delete_recursive': lambda_invoke_delete_recursive_response, 'batch': lambda_invoke_batch_response, 'move': lambda_invoke_move_response, 'copy': lambda_invoke_copy_response, 'archive': lambda_invoke_archive_response, 'extract': lambda_invoke_extract_response, 'find': lambda_invoke_find_response, 'legacy': lambda_invoke_legacy_response, 'list': lambda_invoke_list_response, 'list_paginated': lambda_invoke_list_paginated_response, 'make_dir': lambda_invoke_make_dir_response, 'du': lambda_invoke_du_response, 'du_partial': lambda_invoke_du_partial_response, 'download': lambda_invoke_download_response, 'download_plan': lambda_invoke_download_plan_response}
 EC2 = {'describe_sec_rules': ec2_describe_security_group_rules_response}
\ No newline at end of file
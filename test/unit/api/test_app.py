@@ -1,6 +1,8 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: Apache-2.0
 import json
+import threading
+import time
 import botocore.stub
 
 from service_responses import EFS, CFN, LAMBDA, EC2
@@ -24,9 +26,14 @@ def test_list_filesystems(test_client, efs_client_stub, cfn_client_stub):
     )
 
     cfn_client_stub.add_response(
-        'describe_stacks',
-        expected_params={'StackName': f'testStackPrefix-ManagedResources-{test_filesystem_id}'},
-        service_response=CFN['describe_stacks']
+        'list_stacks',
+        expected_params={'StackStatusFilter': botocore.stub.ANY},
+        service_response=CFN['list_stacks_first_page']
+    )
+    cfn_client_stub.add_response(
+        'list_stacks',
+        expected_params={'StackStatusFilter': botocore.stub.ANY, 'NextToken': 'page2'},
+        service_response=CFN['list_stacks_second_page']
     )
     response = test_client.http.get('/filesystems')
 
@@ -43,6 +50,7 @@ def test_list_filesystems(test_client, efs_client_stub, cfn_client_stub):
     assert isinstance(filesystems, list)
     assert filesystems[0]['name'] == 'MyFileSystem'
     assert filesystems[0]['managed'] is True
+    assert filesystems[0]['outdated'] is False
     assert filesystems[0]['file_system_id'] == f'{test_filesystem_id}'
 
     print('PASS')
@@ -57,6 +65,8 @@ def test_list_filesystems_paginated(test_client, efs_client_stub, cfn_client_stu
         service_response=EFS['describe_file_systems_marker']
     )
 
+    # without the stack index each stack is described
+    cfn_client_stub.add_client_error('list_stacks', service_error_code='Throttling')
     cfn_client_stub.add_response(
         'describe_stacks',
         expected_params={'StackName': f'testStackPrefix-ManagedResources-{test_filesystem_id}'},
@@ -82,6 +92,154 @@ def test_list_filesystems_paginated(test_client, efs_client_stub, cfn_client_stu
     print('PASS')
 
 
+def test_list_filesystems_stack_lookups(test_client, efs_client_stub, cfn_client_stub, monkeypatch):
+    print('GET /filesystems stack lookups')
+
+    cfn_client_stub.add_client_error('list_stacks', service_error_code='Throttling')
+
+    import app
+    filesystem_ids = ['fs-00000001', 'fs-00000002', 'fs-00000003']
+    filesystem = EFS['describe_file_systems_no_marker']['FileSystems'][0]
+    efs_client_stub.add_response(
+        'describe_file_systems',
+        expected_params={'MaxItems': 10},
+        service_response={'FileSystems': [dict(filesystem, FileSystemId=filesystem_id) for filesystem_id in filesystem_ids]}
+    )
+
+    release = threading.Event()
+    statuses = {'fs-00000001': 'CREATE_COMPLETE', 'fs-00000003': False}
+
+    def describe_manager_stack(filesystem_id):
+        if filesystem_id == 'fs-00000002':
+            # stuck until the page has been answered
+            release.wait(5)
+        return {'Stacks': [{'StackStatus': statuses.get(filesystem_id, 'CREATE_COMPLETE')}]}
+
+    monkeypatch.setattr(app, 'describe_manager_stack', describe_manager_stack)
+    monkeypatch.setattr(app, 'STACK_LOOKUP_TIMEOUT', 0.2)
+    started = time.monotonic()
+    response = test_client.http.get('/filesystems')
+    release.set()
+
+    filesystems = json.loads(response.body)['filesystems']
+
+    print(filesystems)
+
+    assert time.monotonic() - started < 2
+    assert [item['file_system_id'] for item in filesystems] == filesystem_ids
+    assert [item['managed'] for item in filesystems] == [True, 'Unknown', False]
+
+    print('PASS')
+
+
+def test_stack_index(test_client, cfn_client_stub):
+    print('Stack status index')
+
+    from app import STACK_INDEX
+    for _ in range(2):
+        cfn_client_stub.add_response('list_stacks', service_response=CFN['list_stacks_first_page'])
+        cfn_client_stub.add_response('list_stacks', service_response=CFN['list_stacks_second_page'])
+
+    expected_index = {test_filesystem_id: {'status': 'CREATE_COMPLETE', 'outdated': False},
+                      'fs-00000002': {'status': 'CREATE_IN_PROGRESS', 'outdated': True}}
+    assert STACK_INDEX.get() == expected_index
+    # answered from the index until it expires or is invalidated
+    assert STACK_INDEX.get() == expected_index
+    STACK_INDEX.invalidate()
+    assert STACK_INDEX.get() == expected_index
+    cfn_client_stub.assert_no_pending_responses()
+
+    print('PASS')
+
+
+def test_control_plane_cache(test_client, efs_client_stub, capsys):
+    print(f'GET /filesystems/{test_filesystem_id} cached')
+
+    from app import CONTROL_PLANE_CACHE
+    efs_client_stub.add_response(
+        'describe_file_systems',
+        expected_params={'FileSystemId': f'{test_filesystem_id}'},
+        service_response=EFS['describe_file_systems_no_marker']
+    )
+
+    first = test_client.http.get(f'/filesystems/{test_filesystem_id}')
+    # the second read is answered from the cache, the stub has no response left for it
+    second = test_client.http.get(f'/filesystems/{test_filesystem_id}')
+
+    assert json.loads(second.body) == json.loads(first.body)
+    efs_client_stub.assert_no_pending_responses()
+
+    stats = CONTROL_PLANE_CACHE.stats()['describe_file_systems']
+    assert stats['entries'] == 1
+    assert stats['hits'] >= 1 and stats['misses'] >= 1
+
+    metric_lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if '"_aws"' in line]
+    assert metric_lines[-1]['Operation'] == '/filesystems/{filesystem_id}'
+    assert metric_lines[-1]['FileSystemId'] == test_filesystem_id
+    assert metric_lines[-1]['ControlPlaneCacheHits'] == 1
+
+    print('PASS')
+
+
+def test_control_plane_cache_expiry_and_eviction(mock_env_variables, monkeypatch):
+    print('Control plane cache expiry and eviction')
+
+    import app
+    clock = [100.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: clock[0])
+    cache = app.ControlPlaneCache({'describe_stacks': 10, 'list_stacks': 30}, 2)
+    loads = []
+
+    def loader(value):
+        return lambda: loads.append(value) or value
+
+    assert cache.get('describe_stacks', 'a', loader('a1')) == 'a1'
+    assert cache.get('describe_stacks', 'a', loader('a2')) == 'a1'
+    clock[0] += 11
+    assert cache.get('describe_stacks', 'a', loader('a3')) == 'a3'
+
+    # the least recently used entry is evicted beyond max_entries
+    cache.get('list_stacks', 'b', loader('b1'))
+    cache.get('describe_stacks', 'a', loader('a4'))
+    cache.get('list_stacks', 'c', loader('c1'))
+    assert cache.get('describe_stacks', 'a', loader('a5')) == 'a3'
+    assert cache.get('list_stacks', 'b', loader('b2')) == 'b2'
+    assert loads == ['a1', 'a3', 'b1', 'c1', 'b2']
+
+    cache.invalidate('list_stacks')
+    assert cache.stats() == {
+        'describe_stacks': {'hits': 3, 'misses': 2, 'entries': 1},
+        'list_stacks': {'hits': 0, 'misses': 3, 'entries': 0},
+    }
+
+    print('PASS')
+
+
+def test_create_filesystem_lambda_invalidates_cache(test_client, cfn_client_stub):
+    print(f'POST /filesystems/{test_filesystem_id}/lambda invalidates cached stacks')
+
+    from app import CONTROL_PLANE_CACHE, STACK_INDEX, describe_manager_stacks
+    stack_name = f'testStackPrefix-ManagedResources-{test_filesystem_id}'
+    cfn_client_stub.add_response('list_stacks', service_response=CFN['list_stacks_first_page'])
+    cfn_client_stub.add_response('list_stacks', service_response=CFN['list_stacks_second_page'])
+    cfn_client_stub.add_response('describe_stacks', expected_params={'StackName': stack_name},
+                                 service_response=CFN['describe_stacks'])
+    STACK_INDEX.get()
+    describe_manager_stacks([test_filesystem_id])
+
+    cfn_client_stub.add_response('create_stack', service_response=CFN['create_stack'])
+    response = test_client.http.post(f'/filesystems/{test_filesystem_id}/lambda', body=json.dumps({'subnetIds': ['subnet-1234abcd'], 'securityGroups': ['sg-4567abcd'], 'gid': '1000', 'uid': '1000', 'path': '/efs'}),
+    headers={'Content-Type':'application/json'})
+
+    assert response.status_code == 200
+    stats = CONTROL_PLANE_CACHE.stats()
+    assert stats['list_stacks']['entries'] == 0
+    assert stats['describe_stacks']['entries'] == 0
+    cfn_client_stub.assert_no_pending_responses()
+
+    print('PASS')
+
+
 def test_get_netinfo_for_filesystem(test_client, efs_client_stub, ec2_client_stub):
     print(f'GET /filesystems/{test_filesystem_id}/netinfo')
 
@@ -113,6 +271,124 @@ def test_get_netinfo_for_filesystem(test_client, efs_client_stub, ec2_client_stu
 
     print('PASS')
 
+def test_get_netinfo_shared_security_groups(test_client, efs_client_stub, ec2_client_stub, monkeypatch):
+    print(f'GET /filesystems/{test_filesystem_id}/netinfo shared security groups')
+
+    import app
+    # one worker keeps the stubbed lookups in order
+    monkeypatch.setattr(app, 'NETINFO_LOOKUP_WORKERS', 1)
+    mount_target = EFS['describe_mount_targets']['MountTargets'][0]
+    efs_client_stub.add_response(
+        'describe_mount_targets',
+        expected_params={'FileSystemId': f'{test_filesystem_id}'},
+        service_response={'MountTargets': [
+            dict(mount_target, MountTargetId='fsmt-00000001', IpAddress='10.0.1.10', SubnetId='subnet-00000001'),
+            dict(mount_target, MountTargetId='fsmt-00000002', IpAddress='10.0.2.10', SubnetId='subnet-00000002'),
+        ]}
+    )
+    efs_client_stub.add_response(
+        'describe_mount_target_security_groups',
+        expected_params={'MountTargetId': 'fsmt-00000001'},
+        service_response={'SecurityGroups': ['sg-00000001', 'sg-00000002']}
+    )
+    efs_client_stub.add_response(
+        'describe_mount_target_security_groups',
+        expected_params={'MountTargetId': 'fsmt-00000002'},
+        service_response={'SecurityGroups': ['sg-00000002']}
+    )
+
+    def rule(group_id, cidr):
+        return {'SecurityGroupRuleId': 'sgr-0123abc', 'GroupId': group_id, 'IsEgress': False,
+                'IpProtocol': 'tcp', 'FromPort': 2049, 'ToPort': 2049, 'CidrIpv4': cidr}
+
+    # the rules of both groups are fetched once, for both mount targets
+    ec2_client_stub.add_response(
+        'describe_security_group_rules',
+        expected_params={'Filters': [{'Name': 'group-id', 'Values': ['sg-00000001', 'sg-00000002']}]},
+        service_response={'SecurityGroupRules': [rule('sg-00000001', '10.0.0.0/16'), rule('sg-00000002', '10.0.2.0/24')]}
+    )
+
+    response = test_client.http.get(f'/filesystems/{test_filesystem_id}/netinfo')
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    assert formatted_response == [
+        {'fsmt-00000001': {'security_groups': ['sg-00000001'], 'subnet_id': 'subnet-00000001'}},
+        {'fsmt-00000002': {'security_groups': ['sg-00000002'], 'subnet_id': 'subnet-00000002'}},
+    ]
+    ec2_client_stub.assert_no_pending_responses()
+
+    print('PASS')
+
+def test_nfs_rule_set(mock_env_variables):
+    print('NFS rule set')
+
+    from app import NfsRuleSet
+
+    def rule(protocol='tcp', from_port=2049, to_port=2049, cidr=None, referenced_group=None, egress=False):
+        rule = {'GroupId': 'sg-00000001', 'IsEgress': egress, 'IpProtocol': protocol, 'FromPort': from_port, 'ToPort': to_port}
+        if cidr:
+            rule['CidrIpv4'] = cidr
+        if referenced_group:
+            rule['ReferencedGroupInfo'] = {'GroupId': referenced_group}
+        return rule
+
+    # (rules, mount target address, expected)
+    cases = [
+        ([rule(cidr='10.0.0.0/16')], '10.0.4.5', True),
+        ([rule(cidr='10.0.0.0/16')], '10.1.4.5', False),
+        ([rule(cidr='10.0.4.5/32')], '10.0.4.5', True),
+        ([rule(cidr='0.0.0.0/0')], '192.0.0.2', True),
+        ([rule(protocol='-1', from_port=-1, to_port=-1, cidr='10.0.0.0/8')], '10.0.4.5', True),
+        ([rule(from_port=0, to_port=65535, cidr='10.0.0.0/8')], '10.0.4.5', True),
+        ([rule(from_port=0, to_port=2048, cidr='10.0.0.0/8')], '10.0.4.5', False),
+        ([rule(from_port=2050, to_port=65535, cidr='10.0.0.0/8')], '10.0.4.5', False),
+        ([rule(from_port=22, to_port=22, cidr='10.0.0.0/8')], '10.0.4.5', False),
+        ([rule(protocol='udp', cidr='10.0.0.0/8')], '10.0.4.5', False),
+        ([rule(cidr='10.0.0.0/8', egress=True)], '10.0.4.5', False),
+        ([rule(referenced_group='sg-00000001')], '10.0.4.5', True),
+        ([rule(referenced_group='sg-00000002')], '10.0.4.5', False),
+        ([rule(from_port=22, to_port=22, referenced_group='sg-00000001')], '10.0.4.5', False),
+        # a later rule of another type does not overwrite an earlier match
+        ([rule(cidr='10.0.0.0/8'), rule(referenced_group='sg-00000002')], '10.0.4.5', True),
+        ([rule(referenced_group='sg-00000001'), rule(cidr='172.16.0.0/12')], '10.0.4.5', True),
+        ([rule(cidr='172.16.0.0/12'), rule(cidr='10.0.4.0/24')], '10.0.4.5', True),
+        ([], '10.0.4.5', False),
+    ]
+
+    for rules, mount_target_ip, expected in cases:
+        assert NfsRuleSet('sg-00000001', rules).allows(mount_target_ip) is expected, (rules, mount_target_ip)
+
+    print('PASS')
+
+
+def test_nfs_rule_set_benchmark(mock_env_variables):
+    print('NFS rule set benchmark')
+
+    from app import NfsRuleSet
+    rules = [{'GroupId': 'sg-00000001', 'IsEgress': False, 'IpProtocol': 'tcp', 'FromPort': 2049, 'ToPort': 2049,
+              'CidrIpv4': '10.{a}.{b}.0/{prefix}'.format(a=index // 256, b=index % 256, prefix=24 + index % 9)}
+             for index in range(5000)]
+    addresses = ['172.16.{a}.{b}'.format(a=index // 256, b=index % 256) for index in range(1000)]
+
+    started = time.perf_counter()
+    rule_set = NfsRuleSet('sg-00000001', rules)
+    compiled = time.perf_counter()
+    assert not any(rule_set.allows(address) for address in addresses)
+    assert rule_set.allows('10.19.135.0')
+    checked = time.perf_counter()
+
+    print('compiled {rules} rules in {compile:.4f}s, checked {addresses} addresses in {check:.4f}s'.format(
+        rules=len(rules), compile=compiled - started, addresses=len(addresses), check=checked - compiled))
+
+    # one lookup per prefix length, not per rule
+    assert len(rule_set.networks) == 9
+    assert checked - started < 2
+
+    print('PASS')
+
 def test_create_filesystem_lambda(test_client, cfn_client_stub):
     print(f'POST /filesystems/{test_filesystem_id}/lambda')
 
@@ -136,6 +412,108 @@ def test_create_filesystem_lambda(test_client, cfn_client_stub):
 
     print('PASS')
 
+def test_create_filesystem_lambda_template(test_client, cfn_client_stub, monkeypatch):
+    print(f'POST /filesystems/{test_filesystem_id}/lambda template')
+
+    import app
+    monkeypatch.setattr(app, 'MANAGER_CODE_BUCKET', 'code-bucket-us-east-1')
+    monkeypatch.setattr(app, 'MANAGER_CODE_KEY', 'prefix/filemanagerlambda.zip')
+    template_body = app.read_template_file()
+
+    # CloudFormation rejects a TemplateBody larger than 51,200 bytes.
+    assert len(template_body.encode('utf-8')) <= 51200
+
+    cfn_client_stub.add_response(
+        'create_stack',
+        service_response=CFN['create_stack'],
+        expected_params={
+            'StackName': 'testStackPrefix-ManagedResources-fs-01234567',
+            'TemplateBody': template_body,
+            'Parameters': [
+                {'ParameterKey': 'FileSystemId', 'ParameterValue': 'fs-01234567'},
+                {'ParameterKey': 'PosixUserUid', 'ParameterValue': '1000'},
+                {'ParameterKey': 'PosixUserGid', 'ParameterValue': '1000'},
+                {'ParameterKey': 'RootDirectoryPath', 'ParameterValue': '/efs'},
+                {'ParameterKey': 'VpcConfigSgIds', 'ParameterValue': 'sg-4567abcd'},
+                {'ParameterKey': 'VpcConfigSubnetIds', 'ParameterValue': 'subnet-1234abcd'},
+                {'ParameterKey': 'CodeBucket', 'ParameterValue': 'code-bucket-us-east-1'},
+                {'ParameterKey': 'CodeKey', 'ParameterValue': 'prefix/filemanagerlambda.zip'},
+            ],
+            'TimeoutInMinutes': 15,
+            'Capabilities': ['CAPABILITY_NAMED_IAM'],
+            'OnFailure': 'DELETE',
+        }
+    )
+
+    response = test_client.http.post(f'/filesystems/{test_filesystem_id}/lambda', body=json.dumps({'subnetIds': ['subnet-1234abcd'], 'securityGroups': ['sg-4567abcd'], 'gid': '1000', 'uid': '1000', 'path': '/efs'}),
+    headers={'Content-Type':'application/json'})
+
+    assert response.status_code == 200
+
+    print('PASS')
+
+def test_update_filesystem_lambda(test_client, cfn_client_stub, monkeypatch):
+    print(f'PUT /filesystems/{test_filesystem_id}/lambda')
+
+    import app
+    monkeypatch.setattr(app, 'MANAGER_CODE_BUCKET', 'code-bucket-us-east-1')
+    monkeypatch.setattr(app, 'MANAGER_CODE_KEY', 'prefix/filemanagerlambda.zip')
+    template_body = app.read_template_file()
+
+    # the current template is recognized as current, the one of earlier releases is not
+    description = next(line for line in template_body.splitlines() if line.startswith('Description:'))
+    assert not app.manager_template_outdated(description.split(':', 1)[1].strip())
+    assert app.manager_template_outdated('Simple File Manager for Amazon EFS - Deploys the EFS Access Point and Lambda to manage an EFS file system')
+
+    cfn_client_stub.add_response(
+        'describe_stacks',
+        expected_params={'StackName': f'testStackPrefix-ManagedResources-{test_filesystem_id}'},
+        service_response=CFN['describe_stacks']
+    )
+    cfn_client_stub.add_response(
+        'update_stack',
+        service_response=CFN['update_stack'],
+        expected_params={
+            'StackName': 'testStackPrefix-ManagedResources-fs-01234567',
+            'TemplateBody': template_body,
+            'Parameters': [
+                {'ParameterKey': 'FileSystemId', 'UsePreviousValue': True},
+                {'ParameterKey': 'PosixUserUid', 'UsePreviousValue': True},
+                {'ParameterKey': 'PosixUserGid', 'UsePreviousValue': True},
+                {'ParameterKey': 'RootDirectoryPath', 'UsePreviousValue': True},
+                {'ParameterKey': 'VpcConfigSgIds', 'UsePreviousValue': True},
+                {'ParameterKey': 'VpcConfigSubnetIds', 'UsePreviousValue': True},
+                {'ParameterKey': 'CodeBucket', 'ParameterValue': 'code-bucket-us-east-1'},
+                {'ParameterKey': 'CodeKey', 'ParameterValue': 'prefix/filemanagerlambda.zip'},
+            ],
+            'Capabilities': ['CAPABILITY_NAMED_IAM'],
+        }
+    )
+
+    response = test_client.http.put(f'/filesystems/{test_filesystem_id}/lambda')
+
+    assert response.status_code == 200
+    assert json.loads(response.body)['StackId'] == 'testStackPrefix-ManagedResources-fs-01234567'
+
+    print('PASS')
+
+def test_update_current_filesystem_lambda(test_client, cfn_client_stub):
+    print(f'PUT /filesystems/{test_filesystem_id}/lambda up to date')
+
+    cfn_client_stub.add_response(
+        'describe_stacks',
+        expected_params={'StackName': f'testStackPrefix-ManagedResources-{test_filesystem_id}'},
+        service_response=CFN['describe_stacks']
+    )
+    cfn_client_stub.add_client_error('update_stack', service_error_code='ValidationError',
+                                     service_message='No updates are to be performed.')
+
+    response = test_client.http.put(f'/filesystems/{test_filesystem_id}/lambda')
+
+    assert response.status_code == 400
+
+    print('PASS')
+
 def test_delete_filesystem_lambda(test_client, cfn_client_stub):
     print(f'DELETE /filesystems/{test_filesystem_id}/lambda')
 
@@ -160,8 +538,10 @@ def test_delete_filesystem_lambda(test_client, cfn_client_stub):
 
     print('PASS')
 
-def test_upload(test_client, lambda_client_stub):
+def test_upload(test_client, lambda_client_stub, cfn_client_stub):
     
+    cfn_client_stub.add_response('list_stacks', service_response=CFN['list_stacks_first_page'])
+    cfn_client_stub.add_response('list_stacks', service_response=CFN['list_stacks_second_page'])
     test_upload_payload = json.dumps({
         'dzchunkindex': 0,
         'dztotalfilesize': 4,
@@ -196,6 +576,59 @@ def test_upload(test_client, lambda_client_stub):
 
     print('PASS')
 
+def test_upload_outdated_manager(test_client, lambda_client_stub, cfn_client_stub):
+    # fs-00000002 was deployed from a template without the manager version
+    cfn_client_stub.add_response('list_stacks', service_response=CFN['list_stacks_first_page'])
+    cfn_client_stub.add_response('list_stacks', service_response=CFN['list_stacks_second_page'])
+
+    response = test_client.http.post('/objects/fs-00000002/upload?filename=test.txt&path=/mnt/efs/', body=json.dumps({'dzchunkindex': 0, 'content': 'test'}), headers={'Content-Type':'application/json'})
+
+    assert response.status_code == 409
+    lambda_client_stub.assert_no_pending_responses()
+
+    print('PASS')
+
+def test_outdated_manager_operation(test_client, lambda_client_stub):
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': botocore.stub.ANY
+        },
+        service_response=LAMBDA['legacy']
+    )
+
+    response = test_client.http.get(f'/objects/{test_filesystem_id}/upload/status?dzuuid=abc')
+
+    assert response.status_code == 409
+    assert 'earlier release' in json.loads(response.body)['Message']
+
+    print('PASS')
+
+def test_upload_status(test_client, lambda_client_stub):
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': bytes(json.dumps({'operation': 'upload_status', 'dzuuid': 'abc'}), encoding='utf-8')
+        },
+        service_response=LAMBDA['upload_status']
+    )
+
+    response = test_client.http.get(f'/objects/{test_filesystem_id}/upload/status?dzuuid=abc')
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['received_ranges', 'missing_ranges', 'complete', 'statusCode']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    print('PASS')
+
 def test_download(test_client, lambda_client_stub):
     lambda_client_stub.add_response(
         'invoke',
@@ -219,6 +652,53 @@ def test_download(test_client, lambda_client_stub):
 
     print('PASS')
 
+def test_download_plan(test_client, lambda_client_stub):
+    expected_event = {'operation': 'download_plan', 'path': '/mnt/efs/', 'filename': 'test.txt'}
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': bytes(json.dumps(expected_event), encoding='utf-8')
+        },
+        service_response=LAMBDA['download_plan']
+    )
+
+    response = test_client.http.get(f'/objects/{test_filesystem_id}/download?filename=test.txt&path=/mnt/efs/&plan=true')
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['dztotalfilesize', 'dzchunksize', 'dztotalchunkcount', 'validator']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    print('PASS')
+
+def test_download_archive(test_client, lambda_client_stub):
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': b'{"operation": "archive", "path": "/mnt/efs", "name": "logs", "compression": "store"}'
+        },
+        service_response=LAMBDA['archive']
+    )
+
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/archive', body=json.dumps({'path': '/mnt/efs', 'name': 'logs', 'compression': 'store'}), headers={'Content-Type':'application/json'})
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['dzchunkindex', 'dzchunkbyteoffset', 'chunk_data', 'complete', 'cursor', 'statusCode']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    print('PASS')
+
 def test_make_dir(test_client, lambda_client_stub):
     lambda_client_stub.add_response(
         'invoke',
@@ -275,6 +755,127 @@ def test_delete(test_client, lambda_client_stub):
 
     print('PASS')
 
+def test_delete_recursive(test_client, lambda_client_stub):
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': b'{"operation": "delete", "path": "/mnt/efs/", "name": "logs", "recursive": true, "time_budget": "10"}'
+        },
+        service_response=LAMBDA['delete_recursive']
+    )
+
+    response = test_client.http.delete(f'/objects/{test_filesystem_id}?name=logs&path=/mnt/efs/&recursive=true&time_budget=10')
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['deleted_files', 'deleted_directories', 'complete', 'continuation', 'statusCode']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    assert formatted_response['complete'] is False
+
+    print('PASS')
+
+def test_move(test_client, lambda_client_stub):
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': b'{"operation": "move", "path": "/mnt/efs", "name": "test.txt", "new_path": "/mnt/efs/archive"}'
+        },
+        service_response=LAMBDA['move']
+    )
+
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/move', body=json.dumps({'path': '/mnt/efs', 'name': 'test.txt', 'new_path': '/mnt/efs/archive'}), headers={'Content-Type':'application/json'})
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    assert formatted_response['statusCode'] == 200
+
+    print('PASS')
+
+def test_copy(test_client, lambda_client_stub):
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': b'{"operation": "copy", "path": "/mnt/efs", "name": "test.txt", "new_name": "copy.txt"}'
+        },
+        service_response=LAMBDA['copy']
+    )
+
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/copy', body=json.dumps({'path': '/mnt/efs', 'name': 'test.txt', 'new_name': 'copy.txt'}), headers={'Content-Type':'application/json'})
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['bytes_copied', 'size', 'complete', 'continuation', 'statusCode']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    assert formatted_response['complete'] is True
+
+    print('PASS')
+
+def test_extract(test_client, lambda_client_stub):
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': b'{"operation": "extract", "path": "/mnt/efs", "name": "upload.zip", "new_path": "/mnt/efs/docs"}'
+        },
+        service_response=LAMBDA['extract']
+    )
+
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/extract', body=json.dumps({'path': '/mnt/efs', 'name': 'upload.zip', 'new_path': '/mnt/efs/docs'}), headers={'Content-Type':'application/json'})
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['extracted_files', 'extracted_bytes', 'skipped', 'errors', 'complete', 'continuation', 'statusCode']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    assert formatted_response['complete'] is True
+
+    print('PASS')
+
+def test_search(test_client, lambda_client_stub):
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': b'{"operation": "find", "path": "/mnt/efs", "pattern": "*.parquet", "page_size": 100}'
+        },
+        service_response=LAMBDA['find']
+    )
+
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/search', body=json.dumps({'path': '/mnt/efs', 'pattern': '*.parquet', 'page_size': 100}), headers={'Content-Type':'application/json'})
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['path', 'matches', 'complete', 'cursor', 'statusCode']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    assert formatted_response['matches'][0]['path'] == 'project/data/part-0.parquet'
+
+    print('PASS')
+
 def test_list(test_client, lambda_client_stub):
     lambda_client_stub.add_response(
         'invoke',
@@ -302,12 +903,199 @@ def test_list(test_client, lambda_client_stub):
 
     print('PASS')
 
+def test_list_paginated(test_client, lambda_client_stub):
+    expected_event = {'operation': 'list', 'path': '/mnt/efs/', 'cursor': 'abc', 'page_size': '1'}
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': bytes(json.dumps(expected_event), encoding='utf-8')
+        },
+        service_response=LAMBDA['list_paginated']
+    )
+
+    response = test_client.http.get(f'/objects/{test_filesystem_id}?path=/mnt/efs/&cursor=abc&page_size=1')
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['statusCode', 'files', 'entries', 'cursor', 'path']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    assert formatted_response['cursor'] is not None
+
+    print('PASS')
+
+def test_disk_usage(test_client, lambda_client_stub):
+    expected_event = {'operation': 'du', 'path': '/mnt/efs/', 'continuation': 'abc'}
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': bytes(json.dumps(expected_event), encoding='utf-8')
+        },
+        service_response=LAMBDA['du']
+    )
+
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/du', body=json.dumps({'path': '/mnt/efs/', 'continuation': 'abc'}), headers={'Content-Type':'application/json'})
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['statusCode', 'children', 'totals', 'complete', 'continuation']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    assert formatted_response['complete'] is True
+
+    print('PASS')
+
+def test_time_budget_clamp(test_client, lambda_client_stub):
+    # API Gateway would end the request before a longer budget returns its continuation
+    expected_event = {'operation': 'du', 'path': '/mnt/efs/', 'time_budget': 25}
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': bytes(json.dumps(expected_event), encoding='utf-8')
+        },
+        service_response=LAMBDA['du_partial']
+    )
+
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/du', body=json.dumps({'path': '/mnt/efs/', 'time_budget': 50}), headers={'Content-Type':'application/json'})
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    assert formatted_response['complete'] is False
+    assert formatted_response['continuation'] == 'abc'
+
+    from app import clamp_time_budget
+    assert clamp_time_budget({'operation': 'du', 'time_budget': '10'}) == {'operation': 'du', 'time_budget': '10'}
+    assert clamp_time_budget({'operation': 'du', 'time_budget': 'nan'})['time_budget'] == 25
+    assert clamp_time_budget({'operation': 'du', 'time_budget': 'soon'})['time_budget'] == 'soon'
+    assert 'time_budget' not in clamp_time_budget({'operation': 'du'})
+
+    print('PASS')
+
+def test_batch(test_client, lambda_client_stub):
+    test_batch_payload = json.dumps({
+        'operations': [
+            {'operation': 'delete', 'path': '/mnt/efs/', 'name': 'a.txt'},
+            {'operation': 'delete', 'path': '/mnt/efs/', 'name': 'b.txt'}
+        ],
+        'workers': 2
+    })
+
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': botocore.stub.ANY
+        },
+        service_response=LAMBDA['batch']
+    )
+
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/batch', body=test_batch_payload, headers={'Content-Type':'application/json'})
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    expected_response_keys = ['results', 'succeeded', 'failed', 'statusCode']
+
+    assert all(item in formatted_response.keys() for item in expected_response_keys)
+
+    assert formatted_response['statusCode'] == 200
+    assert len(formatted_response['results']) == 2
+
+    print('PASS')
+
+def test_operation_metrics(test_client, lambda_client_stub, capsys):
+    lambda_client_stub.add_response(
+        'invoke',
+        expected_params={
+            'InvocationType': 'RequestResponse',
+            'FunctionName': 'fs-01234567-manager-lambda',
+            'Payload': botocore.stub.ANY
+        },
+        service_response=LAMBDA['delete_metrics']
+    )
+
+    response = test_client.http.delete(f'/objects/{test_filesystem_id}?name=test.txt&path=/mnt/efs/')
+
+    assert json.loads(response.body)['statusCode'] == 200
+
+    metric_lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if '"_aws"' in line]
+    metrics = metric_lines[-1]
+    definition = metrics['_aws']['CloudWatchMetrics'][0]
+    metric_names = [metric['Name'] for metric in definition['Metrics']]
+
+    assert definition['Dimensions'] == [['Operation', 'FileSystemId']]
+    assert metrics['Operation'] == 'delete'
+    assert metrics['FileSystemId'] == test_filesystem_id
+    assert all(name in metric_names for name in ['RequestParseTime', 'InvokeTime', 'PayloadDecodeTime', 'ResponseEncodeTime', 'Duration'])
+    assert metrics['ResponseBytes'] == len(response.body)
+
+    print('PASS')
+
+def test_operation_metrics_encodes_like_chalice(mock_env_variables):
+    import decimal
+    from chalice import Response
+    from app import record_operation_metrics, REQUEST_METRICS
+
+    def get_response(event):
+        REQUEST_METRICS.operation = 'list'
+        return Response(body={'size': decimal.Decimal('1.5')})
+
+    response = record_operation_metrics(None, get_response)
+    assert json.loads(response.body) == {'size': 1.5}
+
+    print('PASS')
+
+def test_log_redaction(mock_env_variables):
+    from app import redact
+    operation = {'operation': 'upload', 'path': '/mnt/efs', 'chunk_data': {'dzuuid': '10f726ea', 'content': 'dGVzdA=='}}
+    redacted = redact(operation)
+    assert redacted['chunk_data'] == {'dzuuid': '10f726ea', 'content': '<redacted 8 characters>'}
+    assert redact({'chunk_data': 'dGVzdA=='}) == {'chunk_data': '<redacted 8 characters>'}
+    assert len(redact('a' * 10000)) < 300
+    assert operation['chunk_data']['content'] == 'dGVzdA=='
+
+    print('PASS')
+
 ##############################
 
 # NEGATIVE TEST CASES
 
 ##############################
 
+def test_bad_input_batch(test_client):
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/batch', body=json.dumps({'operations': 'delete'}), headers={'Content-Type':'application/json'})
+
+    assert response.status_code == 400
+
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/batch', body=json.dumps({}), headers={'Content-Type':'application/json'})
+
+    assert response.status_code == 400
+
+    print('PASS')
+
+def test_bad_input_move(test_client):
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/move', body=json.dumps({'path': '/mnt/efs', 'name': 'test.txt'}), headers={'Content-Type':'application/json'})
+
+    assert response.status_code == 400
+
+    print('PASS')
+
 def test_bad_input_create_filesystem_lambda(test_client):
     response = test_client.http.post(f'/filesystems/{test_filesystem_id}/lambda', body=json.dumps({'subnetIds': ['subnet-1234abcd'], 'gid': '1000', 'uid': '1000', 'path': '/efs'}),
     headers={'Content-Type':'application/json'})
@@ -364,6 +1152,19 @@ def test_bad_input_upload(test_client):
 
     print('PASS')
 
+def test_bad_input_upload_status(test_client):
+    response = test_client.http.get(f'/objects/{test_filesystem_id}/upload/status')
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    status_code = formatted_response['Code']
+
+    assert status_code == 'BadRequestError'
+
+    print('PASS')
+
 def test_bad_input_download(test_client):
     response = test_client.http.get(f'/objects/{test_filesystem_id}/download?filename=test.txt')
 
@@ -381,6 +1182,19 @@ def test_bad_input_download(test_client):
 
     print('PASS')
 
+def test_bad_input_download_chunk(test_client):
+    response = test_client.http.get(f'/objects/{test_filesystem_id}/download?filename=test.txt&path=/mnt/efs/&chunk_index=0')
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    status_code = formatted_response['Code']
+
+    assert status_code == 'BadRequestError'
+
+    print('PASS')
+
 def test_bad_input_make_dir(test_client):
     dir_data = {'path': '/mnt/efs'}
     
@@ -434,6 +1248,19 @@ def test_bad_input_list(test_client):
 
     print('PASS')
 
+def test_bad_input_disk_usage(test_client):
+    response = test_client.http.post(f'/objects/{test_filesystem_id}/du', body=json.dumps({}), headers={'Content-Type':'application/json'})
+
+    formatted_response = json.loads(response.body)
+
+    print(formatted_response)
+
+    status_code = formatted_response['Code']
+
+    assert status_code == 'BadRequestError'
+
+    print('PASS')
+
 def test_efs_error_get_netinfo_for_filesystem(test_client, efs_client_stub):
     efs_client_stub.add_client_error(
         'describe_mount_targets',
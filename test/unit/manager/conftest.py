@@ -8,6 +8,9 @@ def prepend_module(monkeypatch):
     monkeypatch.syspath_prepend('../../source/api/chalicelib/')
 
 @pytest.fixture
-def manager_lambda(prepend_module):
+def manager_lambda(prepend_module, monkeypatch, tmp_path_factory):
     import efs_lambda
+    monkeypatch.setattr(efs_lambda, 'UPLOAD_SESSION_DIR', str(tmp_path_factory.mktemp('sessions')))
+    # tmp_path directories stand in for the mounted filesystem
+    monkeypatch.setattr(efs_lambda, 'MOUNT_PATH', str(tmp_path_factory.getbasetemp()))
     yield efs_lambda
\ No newline at end of file
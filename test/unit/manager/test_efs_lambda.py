@@ -1,77 +1,429 @@
 ## Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 ## SPDX-License-Identifier: Apache-2.0
 import base64
+import io
+import itertools
+import json
+import os
+import tarfile
+import time
+import zipfile
 
 
-def test_delete(manager_lambda, mocker):
+def test_delete(manager_lambda, mocker, tmp_path):
     mock_delete = mocker.patch('os.remove', return_value=[])
-    test_event = {'operation': 'delete', 'path': './test', 'name': 'tmp.txt'}
+    test_event = {'operation': 'delete', 'path': str(tmp_path), 'name': 'tmp.txt'}
     delete_response = manager_lambda.lambda_handler(test_event, None)
     print(delete_response)
     mock_delete.assert_called()
 
     assert delete_response['statusCode'] == 200
 
-def test_bad_delete(manager_lambda, mocker):
+def test_bad_delete(manager_lambda, mocker, tmp_path):
     mock_delete = mocker.patch('os.remove', side_effect=OSError)
-    test_event = {'operation': 'delete', 'path': './test', 'name': 'tmp.txt'}
+    test_event = {'operation': 'delete', 'path': str(tmp_path), 'name': 'tmp.txt'}
     delete_response = manager_lambda.lambda_handler(test_event, None)
     print(delete_response)
     mock_delete.assert_called()
     assert delete_response['statusCode'] == 500
 
-def test_make_dir(manager_lambda, mocker):
+def test_make_dir(manager_lambda, mocker, tmp_path):
     mock_mkdir = mocker.patch('os.mkdir', return_value=[])
-    test_event = {'operation': 'make_dir', 'path': './test', 'name': 'tmp'}
+    test_event = {'operation': 'make_dir', 'path': str(tmp_path), 'name': 'tmp'}
     mkdir_response = manager_lambda.lambda_handler(test_event, None)
     print(mkdir_response)
     mock_mkdir.assert_called()
     assert mkdir_response['statusCode'] == 200
 
-def test_bad_make_dir(manager_lambda, mocker):
+def test_bad_make_dir(manager_lambda, mocker, tmp_path):
     mock_mkdir = mocker.patch('os.mkdir', side_effect=OSError)
-    test_event = {'operation': 'make_dir', 'path': './test', 'name': 'tmp'}
+    test_event = {'operation': 'make_dir', 'path': str(tmp_path), 'name': 'tmp'}
     mkdir_response = manager_lambda.lambda_handler(test_event, None)
     print(mkdir_response)
     mock_mkdir.assert_called()
     assert mkdir_response['statusCode'] == 500
 
+def test_single_entry_invalid_target(manager_lambda, tmp_path):
+    (tmp_path / 'dir').mkdir()
+    for operation in ['delete', 'make_dir']:
+        for name in ['', '..', 'dir/../x', 'a\x00b']:
+            test_event = {'operation': operation, 'path': str(tmp_path / 'dir'), 'name': name}
+            assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400
+        test_event = {'operation': operation, 'path': '/etc', 'name': 'passwd'}
+        assert manager_lambda.lambda_handler(test_event, None) == {"message": "path must be inside the file system", "statusCode": 400}
+    assert os.listdir(tmp_path) == ['dir']
 
-def test_upload_file_exists(manager_lambda, mocker):
-    chunk_data = base64.b64encode(b'test')
-    test_event = {'operation': 'upload', 'path': '/mnt/efs', 'chunk_data': {'dzuuid': '10f726ea-ae1d-4363-9a97-4bf6772cd4df', 'dzchunkindex': '0', 'dzchunksize': '4', 'dztotalchunkcount': '1', 'dzchunkbyteoffset': '0', 'filename': 'test.txt', 'content': chunk_data}}
-    mock_path_join = mocker.patch('os.path.join', return_value='/mnt/efs/test.txt')
-    mock_path_exists = mocker.patch('os.path.exists', return_value=True)
+
+def upload_event(path, content, chunk_index=0, chunk_size=4, total_size=4, upload_id='10f726ea-ae1d-4363-9a97-4bf6772cd4df'):
+    total_chunks = -(-total_size // chunk_size) or 1
+    return {'operation': 'upload', 'path': str(path), 'chunk_data': {'dzuuid': upload_id, 'dzchunkindex': str(chunk_index), 'dzchunksize': str(chunk_size), 'dztotalchunkcount': str(total_chunks), 'dzchunkbyteoffset': str(chunk_index * chunk_size), 'dztotalfilesize': str(total_size), 'filename': 'test.txt', 'content': base64.b64encode(content)}}
+
+def test_upload_file_exists(manager_lambda, tmp_path):
+    (tmp_path / 'test.txt').write_bytes(b'old')
+    test_event = upload_event(tmp_path, b'test')
     upload_response = manager_lambda.lambda_handler(test_event, None)
     print(upload_response)
-    mock_path_join.assert_called()
-    mock_path_exists.assert_called()
     assert upload_response['statusCode'] == 400
+    assert (tmp_path / 'test.txt').read_bytes() == b'old'
 
-def test_upload_write_error(manager_lambda, mocker):
-    chunk_data = base64.b64encode(b'test')
-    test_event = {'operation': 'upload', 'path': '/mnt/efs', 'chunk_data': {'dzuuid': '10f726ea-ae1d-4363-9a97-4bf6772cd4df', 'dzchunkindex': '0', 'dzchunksize': '4', 'dztotalchunkcount': '1', 'dzchunkbyteoffset': '0', 'filename': 'test.txt', 'content': chunk_data}}
-    mock_path_join = mocker.patch('os.path.join', return_value='/mnt/efs/test.txt')
-    mock_path_exists = mocker.patch('os.path.exists', return_value=False)
-    mock_file_open = mocker.patch('builtins.open', side_effect=OSError)
+def test_upload_write_error(manager_lambda, tmp_path):
+    test_event = upload_event(tmp_path / 'missing', b'test')
     upload_response = manager_lambda.lambda_handler(test_event, None)
     print(upload_response)
-    mock_path_join.assert_called()
-    mock_path_exists.assert_called()
-    mock_file_open.assert_called()
-
     assert upload_response['statusCode'] == 500
 
+def test_upload_single_chunk(manager_lambda, tmp_path):
+    upload_response = manager_lambda.lambda_handler(upload_event(tmp_path, b'test'), None)
+    assert upload_response['statusCode'] == 200
+    assert upload_response['complete'] is True
+    assert (tmp_path / 'test.txt').read_bytes() == b'test'
+    assert sorted(os.listdir(tmp_path)) == ['test.txt']
+
+def test_upload_out_of_order(manager_lambda, tmp_path):
+    content = b'0123456789abcdefghij'
+    chunks = [content[offset:offset + 4] for offset in range(0, len(content), 4)]
+    for chunk_index in [3, 1, 4, 0]:
+        upload_response = manager_lambda.lambda_handler(upload_event(tmp_path, chunks[chunk_index], chunk_index, 4, len(content)), None)
+        assert upload_response['statusCode'] == 200
+        assert upload_response['complete'] is False
+    upload_response = manager_lambda.lambda_handler(upload_event(tmp_path, chunks[2], 2, 4, len(content)), None)
+    assert upload_response['statusCode'] == 200
+    assert upload_response['complete'] is True
+    assert (tmp_path / 'test.txt').read_bytes() == content
+
+def test_upload_chunk_out_of_bounds(manager_lambda, tmp_path):
+    test_event = upload_event(tmp_path, b'toolong', total_size=4)
+    upload_response = manager_lambda.lambda_handler(test_event, None)
+    assert upload_response['statusCode'] == 400
+
+
+def test_upload_chunk_count_mismatch(manager_lambda, tmp_path):
+    for total_chunks, chunk_size in [('1', '4'), ('4', '4'), ('1', '0')]:
+        test_event = upload_event(tmp_path, b'abcd', 0, 4, 12)
+        test_event['chunk_data'].update(dztotalchunkcount=total_chunks, dzchunksize=chunk_size)
+        upload_response = manager_lambda.lambda_handler(test_event, None)
+        assert upload_response['statusCode'] == 400
+    assert os.listdir(tmp_path) == []
+
+def test_upload_invalid_target(manager_lambda, tmp_path):
+    (tmp_path / 'dir').mkdir()
+    for filename in ['../escaped.txt', '..', '', 'a/b.txt']:
+        test_event = upload_event(tmp_path / 'dir', b'test')
+        test_event['chunk_data']['filename'] = filename
+        assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400, filename
+    test_event = upload_event(os.path.dirname(manager_lambda.MOUNT_PATH), b'test')
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400
+    assert sorted(os.listdir(tmp_path)) == ['dir']
+    assert os.listdir(tmp_path / 'dir') == []
+
+def test_upload_retry_is_idempotent(manager_lambda, tmp_path):
+    content = b'0123456789'
+    first_response = manager_lambda.lambda_handler(upload_event(tmp_path, content[:4], 0, 4, len(content)), None)
+    retry_response = manager_lambda.lambda_handler(upload_event(tmp_path, content[:4], 0, 4, len(content)), None)
+    assert first_response['statusCode'] == 200
+    assert retry_response['statusCode'] == 200
+    assert retry_response['message'] == 'Chunk already received'
+    assert retry_response['received_chunks'] == 1
+    # partial uploads are staged outside the target directory
+    assert os.listdir(tmp_path) == []
+
+    for chunk_index in [1, 2]:
+        upload_response = manager_lambda.lambda_handler(upload_event(tmp_path, content[chunk_index * 4:chunk_index * 4 + 4], chunk_index, 4, len(content)), None)
+    assert upload_response['complete'] is True
+    assert (tmp_path / 'test.txt').read_bytes() == content
+
+    retry_response = manager_lambda.lambda_handler(upload_event(tmp_path, content[8:], 2, 4, len(content)), None)
+    assert retry_response['statusCode'] == 200
+    assert retry_response['complete'] is True
+
+def test_upload_concurrent_finalize(manager_lambda, tmp_path):
+    session_dir = tmp_path / 'session'
+    session_dir.mkdir()
+    (session_dir / 'data').write_bytes(b'test')
+    save_path = str(tmp_path / 'test.txt')
+
+    # another last chunk linked the file into place but has not written the marker yet
+    os.link(session_dir / 'data', save_path)
+    finalize_response = manager_lambda.finalize_upload(str(session_dir), save_path, 4)
+    assert finalize_response['statusCode'] == 200
+    assert finalize_response['complete'] is True
+    assert sorted(os.listdir(session_dir)) == ['complete']
+
+    # and one that finishes after the staging file is gone
+    finalize_response = manager_lambda.finalize_upload(str(session_dir), save_path, 4)
+    assert finalize_response['statusCode'] == 200
+    assert (tmp_path / 'test.txt').read_bytes() == b'test'
+
+def test_upload_finalize_never_replaces(manager_lambda, tmp_path):
+    session_dir = tmp_path / 'session'
+    session_dir.mkdir()
+    (session_dir / 'data').write_bytes(b'test')
+    # created after the chunks were checked against the target
+    (tmp_path / 'test.txt').write_bytes(b'other')
+    finalize_response = manager_lambda.finalize_upload(str(session_dir), str(tmp_path / 'test.txt'), 4)
+    assert finalize_response['statusCode'] == 400
+    assert (tmp_path / 'test.txt').read_bytes() == b'other'
+    assert not (session_dir / 'complete').exists()
+
+def test_upload_session_metadata_mismatch(manager_lambda, tmp_path):
+    manager_lambda.lambda_handler(upload_event(tmp_path, b'0123', 0, 4, 10), None)
+    upload_response = manager_lambda.lambda_handler(upload_event(tmp_path, b'0123', 0, 4, 12), None)
+    assert upload_response['statusCode'] == 400
+
+def test_upload_invalid_upload_id(manager_lambda, tmp_path):
+    upload_response = manager_lambda.lambda_handler(upload_event(tmp_path, b'test', upload_id='../escape'), None)
+    assert upload_response['statusCode'] == 400
+
+def test_upload_streamed_decode(manager_lambda, tmp_path, monkeypatch):
+    monkeypatch.setattr(manager_lambda, 'UPLOAD_DECODE_BLOCK_SIZE', 8)
+    content = bytes(range(256)) * 4 + b'xy'
+    test_event = upload_event(tmp_path, content, 0, len(content), len(content))
+    test_event['chunk_data']['content'] = test_event['chunk_data']['content'].decode('utf-8')
+    upload_response = manager_lambda.lambda_handler(test_event, None)
+    assert upload_response['statusCode'] == 200
+    assert (tmp_path / 'test.txt').read_bytes() == content
+
+def test_upload_invalid_base64(manager_lambda, tmp_path):
+    test_event = upload_event(tmp_path, b'test')
+    test_event['chunk_data']['content'] = 'dGV*dA=='
+    upload_response = manager_lambda.lambda_handler(test_event, None)
+    assert upload_response['statusCode'] == 400
+    assert not (tmp_path / 'test.txt').exists()
+
+def test_report_peak_memory(manager_lambda, tmp_path, capsys):
+    manager_lambda.lambda_handler({'operation': 'list', 'path': str(tmp_path)}, None)
+    output = capsys.readouterr().out.strip().splitlines()
+    # peak memory is a metric of the invocation's EMF line rather than a log line of its own
+    assert len(output) == 1
+    metrics = json.loads(output[0])
+    assert metrics['Operation'] == 'list'
+    assert metrics['ContainerPeakMemory'] > 0
+    # the high water mark spans warm invocations, so it is not attributed to an operation
+    operation_definition, container_definition = metrics['_aws']['CloudWatchMetrics']
+    assert 'ContainerPeakMemory' not in {metric['Name'] for metric in operation_definition['Metrics']}
+    assert container_definition['Dimensions'] == [['FileSystemId']]
+    assert container_definition['Metrics'] == [{'Name': 'ContainerPeakMemory', 'Unit': 'Megabytes'}]
+
+def test_log_redacts_upload_content(manager_lambda, tmp_path, capsys):
+    content = b'secret file content'
+    manager_lambda.LOGGER.setLevel('DEBUG')
+    try:
+        manager_lambda.lambda_handler(upload_event(tmp_path, content), None)
+    finally:
+        manager_lambda.LOGGER.setLevel(manager_lambda.LOG_LEVEL)
+    log_lines = [json.loads(line) for line in capsys.readouterr().out.strip().splitlines()]
+    received = [line for line in log_lines if line.get('message') == 'Operation received'][0]
+    assert received['event']['chunk_data']['content'] == '<redacted 28 characters>'
+    assert all(base64.b64encode(content).decode() not in json.dumps(line) for line in log_lines)
+
+def test_log_chunk_sampling(manager_lambda, capsys, monkeypatch):
+    monkeypatch.setattr(manager_lambda, 'CHUNK_LOG_SAMPLE_RATE', 10)
+    for chunk_index in range(25):
+        manager_lambda.log_chunk('Upload chunk complete', chunk_index, 25)
+    log_lines = [json.loads(line) for line in capsys.readouterr().out.strip().splitlines()]
+    assert [line['chunk_index'] for line in log_lines] == [0, 10, 20, 24]
+
+def test_upload_status(manager_lambda, tmp_path):
+    content = b'0123456789abcdefghij'
+    for chunk_index in [0, 1, 3]:
+        manager_lambda.lambda_handler(upload_event(tmp_path, content[chunk_index * 4:chunk_index * 4 + 4], chunk_index, 4, len(content)), None)
+    test_event = {'operation': 'upload_status', 'dzuuid': '10f726ea-ae1d-4363-9a97-4bf6772cd4df'}
+    status_response = manager_lambda.lambda_handler(test_event, None)
+    print(status_response)
+    assert status_response['statusCode'] == 200
+    assert status_response['received_chunks'] == 3
+    assert status_response['received_ranges'] == [[0, 1], [3, 3]]
+    assert status_response['missing_ranges'] == [[2, 2], [4, 4]]
+    assert status_response['complete'] is False
+    assert status_response['filename'] == 'test.txt'
+
+def test_upload_status_unknown(manager_lambda):
+    test_event = {'operation': 'upload_status', 'dzuuid': 'unknown'}
+    status_response = manager_lambda.lambda_handler(test_event, None)
+    assert status_response['statusCode'] == 404
+
+def test_unknown_operation(manager_lambda):
+    response = manager_lambda.lambda_handler({'operation': 'format', 'path': '/mnt/efs'}, None)
+    assert response['statusCode'] == 400
+    assert response['message'] == 'unknown operation: format'
+
+def test_operation_missing_required_field(manager_lambda):
+    response = manager_lambda.lambda_handler({'operation': 'delete', 'path': '/mnt/efs'}, None)
+    assert response['statusCode'] == 400
+    assert response['message'] == 'missing required parameter: name'
+    response = manager_lambda.lambda_handler({'operation': 'upload', 'path': '/mnt/efs', 'chunk_data': 'test'}, None)
+    assert response['statusCode'] == 400
+    assert response['message'] == 'invalid parameter: chunk_data'
+
+def test_operation_failure_envelope(manager_lambda, mocker):
+    mocker.patch.object(manager_lambda.OPERATIONS['make_dir'], 'handler', side_effect=RuntimeError('boom'))
+    response = manager_lambda.lambda_handler({'operation': 'make_dir', 'path': '/mnt/efs', 'name': 'test'}, None)
+    assert response == {'message': 'make_dir failed: boom', 'statusCode': 500}
+
+def test_stat(manager_lambda, tmp_path):
+    (tmp_path / 'test.txt').write_bytes(b'0123456789')
+    stat_response = manager_lambda.lambda_handler({'operation': 'stat', 'path': str(tmp_path), 'name': 'test.txt'}, None)
+    assert stat_response['statusCode'] == 200
+    assert stat_response['type'] == 'file'
+    assert stat_response['size'] == 10
+    stat_response = manager_lambda.lambda_handler({'operation': 'stat', 'path': str(tmp_path), 'name': 'missing'}, None)
+    assert stat_response['statusCode'] == 404
+
+def test_rename(manager_lambda, tmp_path):
+    (tmp_path / 'a.txt').write_bytes(b'a')
+    (tmp_path / 'b.txt').write_bytes(b'b')
+    test_event = {'operation': 'rename', 'path': str(tmp_path), 'name': 'a.txt', 'new_name': 'b.txt'}
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 409
+    test_event['new_name'] = 'c.txt'
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 200
+    assert (tmp_path / 'c.txt').read_bytes() == b'a'
+    assert not (tmp_path / 'a.txt').exists()
+
+def test_rename_move_copy_invalid_targets(manager_lambda, tmp_path):
+    (tmp_path / 'dir').mkdir()
+    (tmp_path / 'dir' / 'f').write_bytes(b'f')
+    for test_event in [
+        {'operation': 'rename', 'path': str(tmp_path / 'dir'), 'name': 'f', 'new_name': '../escape'},
+        {'operation': 'rename', 'path': str(tmp_path / 'dir'), 'name': '..', 'new_name': 'parent'},
+        {'operation': 'rename', 'path': str(tmp_path / 'dir'), 'name': 'f', 'new_name': 'a/b'},
+        {'operation': 'move', 'path': str(tmp_path / 'dir'), 'name': 'f', 'new_path': '/'},
+        {'operation': 'move', 'path': str(tmp_path / 'dir'), 'name': '../dir/f', 'new_path': str(tmp_path)},
+        {'operation': 'copy', 'path': str(tmp_path / 'dir'), 'name': 'f', 'new_name': '..'},
+        {'operation': 'copy', 'path': str(tmp_path / 'dir'), 'name': 'f', 'new_path': os.path.dirname(manager_lambda.MOUNT_PATH)},
+        {'operation': 'extract', 'path': str(tmp_path / 'dir'), 'name': 'f', 'new_path': '/'},
+    ]:
+        assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400, test_event
+    assert sorted(os.listdir(tmp_path)) == ['dir']
+    assert os.listdir(tmp_path / 'dir') == ['f']
+
+def test_move(manager_lambda, tmp_path):
+    (tmp_path / 'a.txt').write_bytes(b'a')
+    (tmp_path / 'archive').mkdir()
+    test_event = {'operation': 'move', 'path': str(tmp_path), 'name': 'a.txt', 'new_path': str(tmp_path / 'archive')}
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 200
+    assert (tmp_path / 'archive' / 'a.txt').read_bytes() == b'a'
+    test_event = {'operation': 'move', 'path': str(tmp_path), 'name': 'archive', 'new_path': str(tmp_path)}
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400
+
+def test_copy(manager_lambda, tmp_path):
+    content = os.urandom(100000)
+    (tmp_path / 'a.bin').write_bytes(content)
+    (tmp_path / 'a.bin').chmod(0o600)
+    test_event = {'operation': 'copy', 'path': str(tmp_path), 'name': 'a.bin', 'new_name': 'b.bin'}
+    copy_response = manager_lambda.lambda_handler(test_event, None)
+    assert copy_response['statusCode'] == 200
+    assert copy_response['complete'] is True
+    assert (tmp_path / 'b.bin').read_bytes() == content
+    assert (tmp_path / 'b.bin').stat().st_mode & 0o777 == 0o600
+    assert os.listdir(manager_lambda.UPLOAD_SESSION_DIR) == []
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 409
+
+def test_copy_resume(manager_lambda, tmp_path, monkeypatch):
+    content = os.urandom(100000)
+    (tmp_path / 'a.bin').write_bytes(content)
+    monkeypatch.setattr(manager_lambda, 'COPY_BLOCK_SIZE', 40000)
+    original_copy = manager_lambda.copy_file_data
+    # each call copies one block before its budget runs out
+    monkeypatch.setattr(manager_lambda, 'copy_file_data', lambda source_fd, target_fd, offset, size, deadline: original_copy(source_fd, target_fd, offset, min(size, offset + 40000), deadline))
+    test_event = {'operation': 'copy', 'path': str(tmp_path), 'name': 'a.bin', 'new_name': 'b.bin'}
+    offsets = []
+    copy_response = manager_lambda.lambda_handler(test_event, None)
+    while not copy_response['complete']:
+        assert copy_response['statusCode'] == 200
+        assert not (tmp_path / 'b.bin').exists()
+        offsets.append(copy_response['bytes_copied'])
+        test_event['continuation'] = copy_response['continuation']
+        copy_response = manager_lambda.lambda_handler(test_event, None)
+    assert offsets == [40000, 80000]
+    assert (tmp_path / 'b.bin').read_bytes() == content
+
+def test_copy_target_created_meanwhile(manager_lambda, tmp_path, monkeypatch):
+    (tmp_path / 'a.bin').write_bytes(b'a' * 100)
+    original_copy = manager_lambda.copy_file_data
+
+    def copy_then_create_target(source_fd, target_fd, offset, size, deadline):
+        (tmp_path / 'b.bin').write_bytes(b'other')
+        return original_copy(source_fd, target_fd, offset, size, deadline)
+
+    monkeypatch.setattr(manager_lambda, 'copy_file_data', copy_then_create_target)
+    test_event = {'operation': 'copy', 'path': str(tmp_path), 'name': 'a.bin', 'new_name': 'b.bin'}
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 409
+    assert (tmp_path / 'b.bin').read_bytes() == b'other'
+    assert os.listdir(manager_lambda.UPLOAD_SESSION_DIR) == []
+
+def test_copy_buffered_fallback(manager_lambda, tmp_path, mocker):
+    content = os.urandom(10000)
+    (tmp_path / 'a.bin').write_bytes(content)
+    mocker.patch('os.copy_file_range', side_effect=OSError(manager_lambda.errno.EXDEV, 'cross device'), create=True)
+    mocker.patch('os.sendfile', side_effect=OSError(manager_lambda.errno.EINVAL, 'invalid'))
+    test_event = {'operation': 'copy', 'path': str(tmp_path), 'name': 'a.bin', 'new_name': 'b.bin'}
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 200
+    assert (tmp_path / 'b.bin').read_bytes() == content
+
+def test_copy_source_changed(manager_lambda, tmp_path, monkeypatch):
+    (tmp_path / 'a.bin').write_bytes(b'x' * 100)
+    monkeypatch.setattr(manager_lambda, 'copy_file_data', lambda source_fd, target_fd, offset, size, deadline: offset + 10)
+    test_event = {'operation': 'copy', 'path': str(tmp_path), 'name': 'a.bin', 'new_name': 'b.bin', 'time_budget': 0.001}
+    copy_response = manager_lambda.lambda_handler(test_event, None)
+    assert copy_response['complete'] is False
+    (tmp_path / 'a.bin').write_bytes(b'y' * 200)
+    test_event['continuation'] = copy_response['continuation']
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 412
+
+def test_batch(manager_lambda, tmp_path):
+    for index in range(5):
+        (tmp_path / 'file{index}.txt'.format(index=index)).write_bytes(b'test')
+    (tmp_path / 'existing_dir').mkdir()
+    operations = [{'operation': 'delete', 'path': str(tmp_path), 'name': 'file{index}.txt'.format(index=index)} for index in range(5)]
+    operations.append({'operation': 'make_dir', 'path': str(tmp_path), 'name': 'new_dir'})
+    operations.append({'operation': 'stat', 'path': str(tmp_path), 'name': 'existing_dir'})
+    operations.append({'operation': 'delete', 'path': str(tmp_path), 'name': 'missing.txt'})
+    operations.append({'operation': 'upload', 'path': str(tmp_path)})
+    operations.append({'operation': 'rename', 'path': str(tmp_path)})
+    batch_response = manager_lambda.lambda_handler({'operation': 'batch', 'operations': operations, 'workers': 4}, None)
+    assert batch_response['statusCode'] == 200
+    assert batch_response['succeeded'] == 7
+    assert batch_response['failed'] == 3
+    results = batch_response['results']
+    assert [result['operation'] for result in results[:8]] == ['delete'] * 5 + ['make_dir', 'stat', 'delete']
+    assert results[6]['type'] == 'directory'
+    assert [result['statusCode'] for result in results[7:]] == [500, 400, 400]
+    assert results[9]['message'] == 'missing required parameter: name'
+    assert sorted(os.listdir(tmp_path)) == ['existing_dir', 'new_dir']
+
+def test_batch_rejects_long_running_items(manager_lambda, tmp_path):
+    make_tree(tmp_path)
+    operations = [{'operation': 'delete', 'path': str(tmp_path), 'name': name, 'recursive': True, 'time_budget': 50}
+                  for name in ['a', 'b']]
+    operations.append({'operation': 'delete', 'path': str(tmp_path), 'name': 'root.txt', 'continuation': 'abc'})
+    batch_response = manager_lambda.lambda_handler({'operation': 'batch', 'operations': operations}, None)
+    assert batch_response['statusCode'] == 200
+    assert batch_response['failed'] == 3
+    assert [result['statusCode'] for result in batch_response['results']] == [400, 400, 400]
+    assert batch_response['results'][0]['message'] == 'batch items do not accept: recursive, time_budget'
+    assert sorted(os.listdir(tmp_path)) == ['a', 'b', 'root.txt']
+
+def test_batch_too_large(manager_lambda, monkeypatch):
+    monkeypatch.setattr(manager_lambda, 'MAX_BATCH_SIZE', 2)
+    operations = [{'operation': 'stat', 'path': '/mnt/efs', 'name': 'test.txt'}] * 3
+    assert manager_lambda.lambda_handler({'operation': 'batch', 'operations': operations}, None)['statusCode'] == 400
+
+def test_collect_stale_upload_sessions(manager_lambda, tmp_path):
+    manager_lambda.lambda_handler(upload_event(tmp_path, b'0123', 0, 4, 10, upload_id='stale'), None)
+    manager_lambda.lambda_handler(upload_event(tmp_path, b'0123', 0, 4, 10, upload_id='fresh'), None)
+    stale_dir = os.path.join(manager_lambda.UPLOAD_SESSION_DIR, 'stale')
+    for name in os.listdir(stale_dir):
+        os.utime(os.path.join(stale_dir, name), (0, 0))
+    assert manager_lambda.collect_stale_upload_sessions(max_age=3600) == 1
+    assert os.listdir(manager_lambda.UPLOAD_SESSION_DIR) == ['fresh']
 
 def test_download_read_error_first_call(manager_lambda, mocker):
     test_event = {'operation': 'download', 'path': '/mnt/efs/', 'filename': 'test.txt'}
     mock_path_join = mocker.patch('os.path.join', return_value='/mnt/efs/test.txt')
-    mock_path_get_size = mocker.patch('os.path.getsize', return_value=4)
-    mock_file_open = mocker.patch('builtins.open', side_effect=OSError)
+    mock_file_open = mocker.patch('os.open', side_effect=OSError)
     download_response = manager_lambda.lambda_handler(test_event, None)
     print(download_response)
     mock_path_join.assert_called()
-    mock_path_get_size.assert_called()
     mock_file_open.assert_called()
 
     assert download_response['statusCode'] == 500
@@ -79,39 +431,663 @@ def test_download_read_error_first_call(manager_lambda, mocker):
 def test_download_read_error_successive_call(manager_lambda, mocker):
     test_event = {'operation': 'download', 'path': '/mnt/efs/', 'filename': 'test.txt', 'chunk_data': {'dzchunkindex': '0', 'dzchunkbyteoffset': '0'}}
     mock_path_join = mocker.patch('os.path.join', return_value='/mnt/efs/test.txt')
-    mock_path_get_size = mocker.patch('os.path.getsize', return_value=4)
-    mock_file_open = mocker.patch('builtins.open', side_effect=OSError)
+    mock_file_open = mocker.patch('os.open', side_effect=OSError)
     download_response = manager_lambda.lambda_handler(test_event, None)
     print(download_response)
     mock_path_join.assert_called()
-    mock_path_get_size.assert_called()
     mock_file_open.assert_called()
 
     assert download_response['statusCode'] == 500
 
+def test_download_reuses_file_handle(manager_lambda, tmp_path, mocker):
+    (tmp_path / 'test.txt').write_bytes(b'0123456789')
+    test_event = {'operation': 'download', 'path': str(tmp_path), 'filename': 'test.txt', 'chunk_size': 4}
+    first_response = manager_lambda.lambda_handler(test_event, None)
+    spy_open = mocker.spy(os, 'open')
+    test_event['chunk_data'] = {'dzchunkindex': first_response['dzchunkindex'], 'dzchunkbyteoffset': first_response['dzchunkbyteoffset']}
+    second_response = manager_lambda.lambda_handler(test_event, None)
+    assert base64.b64decode(second_response['chunk_data']) == b'4567'
+    spy_open.assert_not_called()
+
+    # a replaced file is reopened
+    (tmp_path / 'new.txt').write_bytes(b'abcdefghij')
+    os.replace(tmp_path / 'new.txt', tmp_path / 'test.txt')
+    second_response = manager_lambda.lambda_handler(test_event, None)
+    assert base64.b64decode(second_response['chunk_data']) == b'efgh'
+    spy_open.assert_called_once()
+
+def test_file_handle_cache_eviction(manager_lambda, tmp_path):
+    cache = manager_lambda.FileHandleCache(max_handles=1, idle_timeout=30)
+    for name in ['a', 'b']:
+        (tmp_path / name).write_bytes(b'test')
+    cache.get(str(tmp_path / 'a'))
+    cache.get(str(tmp_path / 'b'))
+    assert list(cache.handles) == [str(tmp_path / 'b')]
+    cache.close_idle(time.monotonic() + 31)
+    assert len(cache.handles) == 0
+
+def test_download_default_chunk_size(manager_lambda, tmp_path):
+    (tmp_path / 'test.txt').write_bytes(b'test')
+    test_event = {'operation': 'download', 'path': str(tmp_path), 'filename': 'test.txt'}
+    download_response = manager_lambda.lambda_handler(test_event, None)
+    assert download_response['dzchunksize'] == manager_lambda.MAX_DOWNLOAD_CHUNK_SIZE
+    assert download_response['dztotalchunkcount'] == 1
+    assert base64.b64decode(download_response['chunk_data']) == b'test'
+    # a full chunk and its envelope fit in a synchronous lambda response
+    encoded_size = len(base64.b64encode(b'x' * manager_lambda.MAX_DOWNLOAD_CHUNK_SIZE))
+    assert encoded_size + manager_lambda.RESPONSE_ENVELOPE_RESERVE <= manager_lambda.MAX_RESPONSE_BYTES
+
+def test_download_requested_chunk_size(manager_lambda, tmp_path):
+    (tmp_path / 'test.txt').write_bytes(b'0123456789')
+    test_event = {'operation': 'download', 'path': str(tmp_path), 'filename': 'test.txt', 'chunk_size': '4'}
+    download_response = manager_lambda.lambda_handler(test_event, None)
+    assert download_response['dztotalchunkcount'] == 3
+    test_event['chunk_data'] = {'dzchunkindex': download_response['dzchunkindex'], 'dzchunkbyteoffset': download_response['dzchunkbyteoffset']}
+    download_response = manager_lambda.lambda_handler(test_event, None)
+    assert download_response['dzchunkindex'] == 1
+    assert base64.b64decode(download_response['chunk_data']) == b'4567'
+
+def test_download_chunk_size_clamped(manager_lambda, tmp_path):
+    (tmp_path / 'test.txt').write_bytes(b'test')
+    test_event = {'operation': 'download', 'path': str(tmp_path), 'filename': 'test.txt', 'chunk_size': 10 ** 9}
+    download_response = manager_lambda.lambda_handler(test_event, None)
+    assert download_response['dzchunksize'] == manager_lambda.MAX_DOWNLOAD_CHUNK_SIZE
+
+def test_download_bad_chunk_size(manager_lambda, tmp_path):
+    test_event = {'operation': 'download', 'path': str(tmp_path), 'filename': 'test.txt', 'chunk_size': '0'}
+    download_response = manager_lambda.lambda_handler(test_event, None)
+    assert download_response['statusCode'] == 400
+
+def test_download_plan_and_chunks(manager_lambda, tmp_path):
+    content = b'0123456789'
+    (tmp_path / 'test.txt').write_bytes(content)
+    test_event = {'operation': 'download_plan', 'path': str(tmp_path), 'filename': 'test.txt', 'chunk_size': 4}
+    plan = manager_lambda.lambda_handler(test_event, None)
+    assert plan['statusCode'] == 200
+    assert plan['dztotalchunkcount'] == 3
+    assert plan['dztotalfilesize'] == 10
+
+    chunks = {}
+    for chunk_index in [2, 0, 1]:
+        test_event = {'operation': 'download_chunk', 'path': str(tmp_path), 'filename': 'test.txt', 'chunk_index': chunk_index, 'chunk_size': 4, 'validator': plan['validator']}
+        chunk = manager_lambda.lambda_handler(test_event, None)
+        assert chunk['statusCode'] == 200
+        chunks[chunk_index] = base64.b64decode(chunk['chunk_data'])
+    assert b''.join(chunks[chunk_index] for chunk_index in range(3)) == content
+
+def test_operation_metrics(manager_lambda, tmp_path, capsys):
+    (tmp_path / 'test.txt').write_bytes(b'0123456789')
+    plan = manager_lambda.lambda_handler({'operation': 'download_plan', 'path': str(tmp_path), 'filename': 'test.txt'}, None)
+    test_event = {'operation': 'download_chunk', 'path': str(tmp_path), 'filename': 'test.txt', 'chunk_index': 0, 'validator': plan['validator']}
+    manager_lambda.lambda_handler(test_event, None)
+    metric_lines = [json.loads(line) for line in capsys.readouterr().out.strip().splitlines() if '"_aws"' in line]
+    metrics = metric_lines[-1]
+    definition = metrics['_aws']['CloudWatchMetrics'][0]
+    assert definition['Dimensions'] == [['Operation', 'FileSystemId']]
+    assert {metric['Name'] for metric in definition['Metrics']} == {'FilesystemTime', 'EncodeTime', 'Bytes', 'RequestSize', 'ResponseSize', 'Duration'}
+    assert metrics['Operation'] == 'download_chunk'
+    assert metrics['Bytes'] == 10
+    assert metrics['Duration'] >= metrics['FilesystemTime']
+
+def test_download_chunk_stale_validator(manager_lambda, tmp_path):
+    (tmp_path / 'test.txt').write_bytes(b'0123456789')
+    plan = manager_lambda.lambda_handler({'operation': 'download_plan', 'path': str(tmp_path), 'filename': 'test.txt'}, None)
+    (tmp_path / 'test.txt').write_bytes(b'changed content')
+    test_event = {'operation': 'download_chunk', 'path': str(tmp_path), 'filename': 'test.txt', 'chunk_index': 0, 'validator': plan['validator']}
+    chunk = manager_lambda.lambda_handler(test_event, None)
+    assert chunk['statusCode'] == 412
+
+def test_download_chunk_out_of_range(manager_lambda, tmp_path):
+    (tmp_path / 'test.txt').write_bytes(b'0123456789')
+    plan = manager_lambda.lambda_handler({'operation': 'download_plan', 'path': str(tmp_path), 'filename': 'test.txt'}, None)
+    test_event = {'operation': 'download_chunk', 'path': str(tmp_path), 'filename': 'test.txt', 'chunk_index': 1, 'validator': plan['validator']}
+    chunk = manager_lambda.lambda_handler(test_event, None)
+    assert chunk['statusCode'] == 400
+
 def test_list_missing_path(manager_lambda, mocker):
     test_event = {'operation': 'list'}
     list_response = manager_lambda.lambda_handler(test_event, None)
     assert list_response['statusCode'] == 400
 
 
-def test_list_walk_error(manager_lambda, mocker):
+def test_list_scandir_error(manager_lambda, mocker):
     test_event = {'operation': 'list', 'path': '/mnt/efs/'}
-    mock_os_walk = mocker.patch('os.walk', side_effect=OSError)
+    mock_os_scandir = mocker.patch('os.scandir', side_effect=OSError)
     list_response = manager_lambda.lambda_handler(test_event, None)
     print(list_response)
-    mock_os_walk.assert_called()
+    mock_os_scandir.assert_called()
     assert list_response['statusCode'] == 500
 
-def test_list(manager_lambda, mocker):
-    test_event = {'operation': 'list', 'path': '/mnt/efs/'}
-    mock_os_walk = mocker.patch('os.walk', return_value=[])
+def test_list(manager_lambda, tmp_path):
+    (tmp_path / 'test.txt').write_bytes(b'test')
+    (tmp_path / 'subdir').mkdir()
+    test_event = {'operation': 'list', 'path': str(tmp_path)}
     list_response = manager_lambda.lambda_handler(test_event, None)
     print(list_response)
-    mock_os_walk.assert_called()
     assert list_response['statusCode'] == 200
+    assert list_response['files'] == ['test.txt']
+    assert list_response['directiories'] == ['subdir']
+    assert list_response['cursor'] is None
+    entries = {entry['name']: entry for entry in list_response['entries']}
+    assert entries['test.txt']['type'] == 'file'
+    assert entries['test.txt']['size'] == 4
+    assert entries['subdir']['type'] == 'directory'
+    assert entries['subdir']['mtime'] is not None
+
+def test_list_paginated(manager_lambda, tmp_path):
+    for index in range(5):
+        (tmp_path / 'file{index}.txt'.format(index=index)).write_bytes(b'test')
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'page_size': '2'}
+    names = []
+    pages = 0
+    while True:
+        list_response = manager_lambda.lambda_handler(test_event, None)
+        assert list_response['statusCode'] == 200
+        assert len(list_response['entries']) <= 2
+        names.extend(entry['name'] for entry in list_response['entries'])
+        pages += 1
+        if list_response['cursor'] is None:
+            break
+        test_event['cursor'] = list_response['cursor']
+    assert pages == 3
+    assert sorted(names) == ['file{index}.txt'.format(index=index) for index in range(5)]
+
+def test_list_bad_cursor(manager_lambda, tmp_path):
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'cursor': 'not-a-cursor'}
+    list_response = manager_lambda.lambda_handler(test_event, None)
+    assert list_response['statusCode'] == 400
+
+def test_list_cursor_other_path(manager_lambda, tmp_path):
+    cursor = manager_lambda.encode_cursor({'path': '/mnt/efs/other', 'offset': 1})
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'cursor': cursor}
+    list_response = manager_lambda.lambda_handler(test_event, None)
+    assert list_response['statusCode'] == 400
+
+def test_list_bad_page_size(manager_lambda, tmp_path):
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'page_size': 'ten'}
+    list_response = manager_lambda.lambda_handler(test_event, None)
+    assert list_response['statusCode'] == 400
+
+def make_sized_files(directory, count):
+    for index in range(count):
+        file_path = directory / 'file{index:02d}.log'.format(index=index)
+        file_path.write_bytes(b'x' * index)
+        os.utime(file_path, (1600000000 + index, 1600000000 + index))
+    (directory / 'notes.txt').write_bytes(b'notes')
+
+def test_list_sort_size_desc_limit(manager_lambda, tmp_path):
+    make_sized_files(tmp_path, 20)
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'sort': 'size', 'order': 'desc', 'limit': '3'}
+    list_response = manager_lambda.lambda_handler(test_event, None)
+    assert list_response['statusCode'] == 200
+    assert [entry['name'] for entry in list_response['entries']] == ['file19.log', 'file18.log', 'file17.log']
+    assert list_response['cursor'] is None
+
+def test_list_newest_with_pattern(manager_lambda, tmp_path):
+    make_sized_files(tmp_path, 20)
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'sort': 'mtime', 'order': 'desc', 'limit': 2, 'pattern': '*.log'}
+    list_response = manager_lambda.lambda_handler(test_event, None)
+    assert [entry['name'] for entry in list_response['entries']] == ['file19.log', 'file18.log']
+
+def test_list_prefix_filter(manager_lambda, tmp_path):
+    make_sized_files(tmp_path, 20)
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'prefix': 'file1'}
+    list_response = manager_lambda.lambda_handler(test_event, None)
+    assert sorted(list_response['files']) == ['file1{index}.log'.format(index=index) for index in range(10)]
+
+def test_list_sorted_pages(manager_lambda, tmp_path):
+    make_sized_files(tmp_path, 5)
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'sort': 'name', 'page_size': 4}
+    first_page = manager_lambda.lambda_handler(test_event, None)
+    assert first_page['files'] == ['file00.log', 'file01.log', 'file02.log', 'file03.log']
+    test_event['cursor'] = first_page['cursor']
+    second_page = manager_lambda.lambda_handler(test_event, None)
+    assert second_page['files'] == ['file04.log', 'notes.txt']
+    assert second_page['cursor'] is None
+
+def test_list_sorted_pages_keyset(manager_lambda, tmp_path):
+    make_sized_files(tmp_path, 10)
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'sort': 'size', 'order': 'desc', 'page_size': 3}
+    first_page = manager_lambda.lambda_handler(test_event, None)
+    assert first_page['files'] == ['file09.log', 'file08.log', 'file07.log']
+    # removing an entry already returned neither skips nor repeats one on the next page
+    (tmp_path / 'file08.log').unlink()
+    test_event['cursor'] = first_page['cursor']
+    names = []
+    while True:
+        list_response = manager_lambda.lambda_handler(test_event, None)
+        assert list_response['statusCode'] == 200
+        names += list_response['files']
+        if list_response['cursor'] is None:
+            break
+        test_event['cursor'] = list_response['cursor']
+    assert names == ['file06.log', 'notes.txt', 'file05.log', 'file04.log', 'file03.log', 'file02.log', 'file01.log', 'file00.log']
+    test_event['cursor'] = manager_lambda.encode_cursor({'path': str(tmp_path), 'after': 'file05.log', 'listing': {'sort': 'size', 'order': 'desc', 'prefix': None, 'pattern': None}})
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400
+
+def test_list_cursor_other_listing(manager_lambda, tmp_path):
+    make_sized_files(tmp_path, 5)
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'sort': 'name', 'page_size': 2}
+    first_page = manager_lambda.lambda_handler(test_event, None)
+    test_event.update({'sort': 'size', 'cursor': first_page['cursor']})
+    list_response = manager_lambda.lambda_handler(test_event, None)
+    assert list_response['statusCode'] == 400
+
+def test_list_bad_sort(manager_lambda, tmp_path):
+    test_event = {'operation': 'list', 'path': str(tmp_path), 'sort': 'owner'}
+    list_response = manager_lambda.lambda_handler(test_event, None)
+    assert list_response['statusCode'] == 400
+
+def test_list_cache(manager_lambda, tmp_path):
+    (tmp_path / 'test.txt').write_bytes(b'test')
+    test_event = {'operation': 'list', 'path': str(tmp_path)}
+    first_response = manager_lambda.lambda_handler(test_event, None)
+    assert first_response['cache']['hit'] is False
+
+    second_response = manager_lambda.lambda_handler(test_event, None)
+    assert second_response['cache']['hit'] is True
+    assert second_response['cache']['hits'] == first_response['cache']['hits'] + 1
+    assert second_response['files'] == ['test.txt']
+
+    (tmp_path / 'new.txt').write_bytes(b'test')
+    third_response = manager_lambda.lambda_handler(test_event, None)
+    assert third_response['cache']['hit'] is False
+    assert sorted(third_response['files']) == ['new.txt', 'test.txt']
+
+def test_listing_cache_eviction(manager_lambda):
+    cache = manager_lambda.ListingCache(max_entries=10)
+    cache.put('a', 1, {'files': ['a']}, 4)
+    cache.put('b', 1, {'files': ['b']}, 4)
+    assert cache.get('a', 1) == {'files': ['a']}
+    cache.put('c', 1, {'files': ['c']}, 4)
+    # b was least recently used
+    assert cache.get('b', 1) is None
+    assert cache.get('a', 1) is not None
+    assert cache.get('c', 2) is None
+    assert cache.size == 4
+    cache.put('d', 1, {}, 11)
+    assert cache.get('d', 1) is None
+
+def make_tree(directory):
+    (directory / 'root.txt').write_bytes(b'x' * 10)
+    for child in ['a', 'b']:
+        for depth in range(3):
+            nested = directory.joinpath(child, *['sub{depth}'.format(depth=level) for level in range(depth)])
+            nested.mkdir(parents=True, exist_ok=True)
+            (nested / 'data.bin').write_bytes(b'x' * 100)
+
+def test_du(manager_lambda, tmp_path):
+    make_tree(tmp_path)
+    test_event = {'operation': 'du', 'path': str(tmp_path), 'workers': 4}
+    du_response = manager_lambda.lambda_handler(test_event, None)
+    print(du_response)
+    assert du_response['statusCode'] == 200
+    assert du_response['complete'] is True
+    assert du_response['continuation'] is None
+    children = {child['name']: child for child in du_response['children']}
+    assert children['a'] == {'name': 'a', 'type': 'directory', 'bytes': 300, 'files': 3, 'dirs': 2}
+    assert children['.']['bytes'] == 10
+    assert du_response['totals'] == {'bytes': 610, 'files': 7, 'dirs': 6}
+
+def test_du_continuation(manager_lambda, tmp_path):
+    make_tree(tmp_path)
+    test_event = {'operation': 'du', 'path': str(tmp_path), 'time_budget': 0.000001}
+    partial_response = manager_lambda.lambda_handler(test_event, None)
+    assert partial_response['statusCode'] == 200
+    assert partial_response['complete'] is False
+    assert partial_response['continuation'] is not None
+
+    test_event = {'operation': 'du', 'path': str(tmp_path), 'continuation': partial_response['continuation']}
+    du_response = manager_lambda.lambda_handler(test_event, None)
+    assert du_response['complete'] is True
+    assert du_response['totals'] == {'bytes': 610, 'files': 7, 'dirs': 6}
+
+def test_du_continuation_stays_small(manager_lambda, tmp_path):
+    for index in range(500):
+        (tmp_path / 'directory-with-a-long-name-{index}'.format(index=index)).mkdir()
+    test_event = {'operation': 'du', 'path': str(tmp_path), 'time_budget': 0.000001}
+    partial_response = manager_lambda.lambda_handler(test_event, None)
+    assert partial_response['complete'] is False
+    assert len(partial_response['continuation']) < 200
+
+    test_event['continuation'] = partial_response['continuation']
+    test_event['time_budget'] = 10
+    du_response = manager_lambda.lambda_handler(test_event, None)
+    assert du_response['complete'] is True
+    assert du_response['totals']['dirs'] == 500
+    assert os.listdir(manager_lambda.UPLOAD_SESSION_DIR) == []
+    # the state was consumed, an old continuation cannot resume it
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 410
+
+def test_du_bad_continuation(manager_lambda, tmp_path):
+    test_event = {'operation': 'du', 'path': str(tmp_path), 'continuation': 'abc'}
+    du_response = manager_lambda.lambda_handler(test_event, None)
+    assert du_response['statusCode'] == 400
+
+def test_du_bad_time_budget(manager_lambda, tmp_path):
+    for time_budget in [0, -1, 'nan', 'soon']:
+        test_event = {'operation': 'du', 'path': str(tmp_path), 'time_budget': time_budget}
+        du_response = manager_lambda.lambda_handler(test_event, None)
+        assert du_response['statusCode'] == 400
+
+def test_du_missing_path(manager_lambda, tmp_path):
+    test_event = {'operation': 'du', 'path': str(tmp_path / 'missing')}
+    du_response = manager_lambda.lambda_handler(test_event, None)
+    assert du_response['statusCode'] == 500
+
+def read_find_pages(manager_lambda, test_event):
+    matches = []
+    while True:
+        find_response = manager_lambda.lambda_handler(test_event, None)
+        assert find_response['statusCode'] == 200
+        assert len(find_response['matches']) <= test_event.get('page_size', 1000)
+        matches += find_response['matches']
+        if find_response['complete']:
+            return matches
+        assert len(find_response['cursor']) < 200
+        test_event['cursor'] = find_response['cursor']
+
+def test_find(manager_lambda, tmp_path):
+    make_tree(tmp_path)
+    (tmp_path / 'a' / 'sub0' / 'big.bin').write_bytes(b'x' * 5000)
+    test_event = {'operation': 'find', 'path': str(tmp_path), 'pattern': '*.bin', 'workers': 4}
+    matches = read_find_pages(manager_lambda, test_event)
+    assert sorted(match['path'] for match in matches) == ['a/data.bin', 'a/sub0/big.bin', 'a/sub0/data.bin', 'a/sub0/sub1/data.bin',
+                                                          'b/data.bin', 'b/sub0/data.bin', 'b/sub0/sub1/data.bin']
+    test_event = {'operation': 'find', 'path': str(tmp_path), 'regex': '^(big|root)', 'min_size': 100}
+    assert [match['path'] for match in read_find_pages(manager_lambda, test_event)] == ['a/sub0/big.bin']
+    test_event = {'operation': 'find', 'path': str(tmp_path), 'type': 'directory', 'pattern': 'sub1'}
+    assert sorted(match['path'] for match in read_find_pages(manager_lambda, test_event)) == ['a/sub0/sub1', 'b/sub0/sub1']
+
+def test_find_pages(manager_lambda, tmp_path):
+    make_tree(tmp_path)
+    for index in range(5):
+        (tmp_path / 'a' / 'sub0' / 'extra{index}.bin'.format(index=index)).write_bytes(b'x')
+    test_event = {'operation': 'find', 'path': str(tmp_path), 'pattern': '*.bin', 'page_size': 2, 'workers': 3}
+    paths = [match['path'] for match in read_find_pages(manager_lambda, test_event)]
+    assert len(paths) == 11
+    assert len(set(paths)) == 11
+
+def test_find_time_budget(manager_lambda, tmp_path, mocker):
+    make_tree(tmp_path)
+    # every clock read moves 8 seconds, a page ends after a few directories
+    mocker.patch.object(manager_lambda.time, 'monotonic', side_effect=itertools.count(0, 8))
+    test_event = {'operation': 'find', 'path': str(tmp_path), 'pattern': '*.bin', 'workers': 1}
+    find_response = manager_lambda.lambda_handler(test_event, None)
+    assert find_response['complete'] is False
+    test_event['cursor'] = find_response['cursor']
+    paths = [match['path'] for match in find_response['matches'] + read_find_pages(manager_lambda, test_event)]
+    mocker.stopall()
+    assert sorted(paths) == ['a/data.bin', 'a/sub0/data.bin', 'a/sub0/sub1/data.bin',
+                             'b/data.bin', 'b/sub0/data.bin', 'b/sub0/sub1/data.bin']
+
+def test_find_cursor_stays_small(manager_lambda, tmp_path):
+    for index in range(500):
+        (tmp_path / 'directory-with-a-long-name-{index}'.format(index=index)).mkdir()
+    test_event = {'operation': 'find', 'path': str(tmp_path), 'type': 'directory', 'page_size': 1, 'workers': 1}
+    find_response = manager_lambda.lambda_handler(test_event, None)
+    assert find_response['complete'] is False
+    assert len(find_response['cursor']) < 200
+    first_cursor = find_response['cursor']
+    test_event.update({'cursor': first_cursor, 'page_size': 100})
+    matches = find_response['matches'] + read_find_pages(manager_lambda, test_event)
+    assert len(set(match['path'] for match in matches)) == 500
+    assert os.listdir(manager_lambda.UPLOAD_SESSION_DIR) == []
+    test_event['cursor'] = first_cursor
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 410
+
+def test_find_invalid(manager_lambda, tmp_path):
+    for criteria in [{'regex': '('}, {'type': 'pipe'}, {'min_size': 'big'}, {'page_size': 0}]:
+        test_event = dict({'operation': 'find', 'path': str(tmp_path)}, **criteria)
+        assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400
+    test_event = {'operation': 'find', 'path': str(tmp_path / 'missing')}
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 404
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'b').mkdir()
+    test_event = {'operation': 'find', 'path': str(tmp_path), 'page_size': 1, 'workers': 1}
+    cursor = manager_lambda.lambda_handler(test_event, None)['cursor']
+    test_event.update({'cursor': cursor, 'pattern': '*.txt'})
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400
 
 def test_missing_operation(manager_lambda):
     test_event = {}
     response = manager_lambda.lambda_handler(test_event, None)
     assert response['statusCode'] == 400
+
+def test_delete_recursive(manager_lambda, tmp_path):
+    (tmp_path / 'tree').mkdir()
+    make_tree(tmp_path / 'tree')
+    test_event = {'operation': 'delete', 'path': str(tmp_path), 'name': 'tree'}
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 500
+    test_event.update({'recursive': True, 'workers': 4})
+    delete_response = manager_lambda.lambda_handler(test_event, None)
+    print(delete_response)
+    assert delete_response['statusCode'] == 200
+    assert delete_response['complete'] is True
+    assert delete_response['deleted_files'] == 7
+    assert delete_response['deleted_directories'] == 7
+    assert os.listdir(tmp_path) == []
+
+def test_delete_recursive_continuation(manager_lambda, tmp_path, mocker):
+    (tmp_path / 'tree').mkdir()
+    make_tree(tmp_path / 'tree')
+    test_event = {'operation': 'delete', 'path': str(tmp_path), 'name': 'tree', 'recursive': True}
+    # the budget runs out while the first directory is read
+    mocker.patch.object(manager_lambda.time, 'monotonic', side_effect=[0, 0, 0] + [100] * 100)
+    delete_response = manager_lambda.lambda_handler(test_event, None)
+    mocker.stopall()
+    assert delete_response['complete'] is False
+    assert delete_response['continuation'] is not None
+    assert (tmp_path / 'tree').exists()
+
+    while delete_response['continuation']:
+        test_event['continuation'] = delete_response['continuation']
+        delete_response = manager_lambda.lambda_handler(test_event, None)
+        assert delete_response['statusCode'] == 200
+    assert delete_response['deleted_files'] == 7
+    assert delete_response['deleted_directories'] == 7
+    assert not (tmp_path / 'tree').exists()
+
+def test_delete_recursive_invalid_name(manager_lambda, tmp_path):
+    for name in ['', '.', '..', 'a/..']:
+        test_event = {'operation': 'delete', 'path': str(tmp_path), 'name': name, 'recursive': True}
+        assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400
+    assert tmp_path.exists()
+
+def read_archive(manager_lambda, test_event):
+    archive = b''
+    while True:
+        archive_response = manager_lambda.lambda_handler(test_event, None)
+        assert archive_response['statusCode'] == 200
+        assert archive_response['dzchunkbyteoffset'] == len(archive)
+        archive += base64.b64decode(archive_response['chunk_data'])
+        if archive_response['complete']:
+            return archive
+        test_event['cursor'] = archive_response['cursor']
+
+def test_archive(manager_lambda, tmp_path):
+    (tmp_path / 'tree').mkdir()
+    make_tree(tmp_path / 'tree')
+    (tmp_path / 'tree' / 'empty').mkdir()
+    (tmp_path / 'tree' / 'a' / 'random.bin').write_bytes(os.urandom(200000))
+    for compression in ['store', 'deflate']:
+        test_event = {'operation': 'archive', 'path': str(tmp_path), 'name': 'tree', 'compression': compression, 'chunk_size': 30000}
+        archive = zipfile.ZipFile(io.BytesIO(read_archive(manager_lambda, test_event)))
+        assert archive.testzip() is None
+        assert 'tree/empty/' in archive.namelist()
+        assert archive.read('tree/a/sub0/sub1/data.bin') == b'x' * 100
+        assert archive.read('tree/a/random.bin') == (tmp_path / 'tree' / 'a' / 'random.bin').read_bytes()
+    assert os.listdir(manager_lambda.UPLOAD_SESSION_DIR) == []
+
+def test_archive_zip64_entries(manager_lambda, tmp_path, monkeypatch):
+    (tmp_path / 'tree').mkdir()
+    make_tree(tmp_path / 'tree')
+    monkeypatch.setattr(manager_lambda, 'ZIP64_FILE_THRESHOLD', 0)
+    test_event = {'operation': 'archive', 'path': str(tmp_path), 'name': 'tree', 'chunk_size': 100}
+    archive = zipfile.ZipFile(io.BytesIO(read_archive(manager_lambda, test_event)))
+    assert archive.testzip() is None
+    assert archive.read('tree/root.txt') == b'x' * 10
+
+def test_archive_retried_chunk(manager_lambda, tmp_path):
+    (tmp_path / 'tree').mkdir()
+    make_tree(tmp_path / 'tree')
+    test_event = {'operation': 'archive', 'path': str(tmp_path), 'name': 'tree', 'chunk_size': 200}
+    first_chunk = manager_lambda.lambda_handler(test_event, None)
+    test_event['cursor'] = first_chunk['cursor']
+    second_chunk = manager_lambda.lambda_handler(test_event, None)
+    retried_chunk = manager_lambda.lambda_handler(test_event, None)
+    assert retried_chunk['chunk_data'] == second_chunk['chunk_data']
+    assert retried_chunk['cursor'] == second_chunk['cursor']
+
+def test_archive_source_changed(manager_lambda, tmp_path):
+    (tmp_path / 'tree').mkdir()
+    (tmp_path / 'tree' / 'data.bin').write_bytes(b'x' * 1000)
+    test_event = {'operation': 'archive', 'path': str(tmp_path), 'name': 'tree', 'compression': 'store', 'chunk_size': 500}
+    test_event['cursor'] = manager_lambda.lambda_handler(test_event, None)['cursor']
+    (tmp_path / 'tree' / 'data.bin').write_bytes(b'y' * 2000)
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 412
+
+def test_upload_sessions_hidden(manager_lambda, tmp_path, monkeypatch):
+    root = tmp_path / 'efs'
+    root.mkdir()
+    make_tree(root)
+    session_dir = root / '.sfm-uploads'
+    (session_dir / 'upload-1').mkdir(parents=True)
+    (session_dir / 'upload-1' / 'data').write_bytes(b'x' * 1000)
+    monkeypatch.setattr(manager_lambda, 'UPLOAD_SESSION_DIR', str(session_dir))
+
+    list_response = manager_lambda.lambda_handler({'operation': 'list', 'path': str(root)}, None)
+    assert sorted(entry['name'] for entry in list_response['entries']) == ['a', 'b', 'root.txt']
+
+    du_response = manager_lambda.lambda_handler({'operation': 'du', 'path': str(root)}, None)
+    assert du_response['totals'] == {'bytes': 610, 'files': 7, 'dirs': 6}
+
+    matches = read_find_pages(manager_lambda, {'operation': 'find', 'path': str(root), 'pattern': 'data*'})
+    assert len(matches) == 6
+
+    test_event = {'operation': 'archive', 'path': str(tmp_path), 'name': 'efs', 'chunk_size': 30000}
+    archive = zipfile.ZipFile(io.BytesIO(read_archive(manager_lambda, test_event)))
+    assert not any('.sfm-uploads' in name for name in archive.namelist())
+
+    for test_event in [
+        {'operation': 'delete', 'path': str(root), 'name': '.sfm-uploads', 'recursive': True},
+        {'operation': 'rename', 'path': str(root), 'name': '.sfm-uploads', 'new_name': 'uploads'},
+        {'operation': 'move', 'path': str(root), 'name': 'root.txt', 'new_path': str(session_dir)},
+        {'operation': 'copy', 'path': str(root / 'a'), 'name': '../.sfm-uploads/upload-1/data', 'new_name': 'data.copy'},
+        {'operation': 'list', 'path': str(session_dir)},
+        {'operation': 'batch', 'operations': [{'operation': 'delete', 'path': str(session_dir / 'upload-1'), 'name': 'data'}]},
+    ]:
+        response = manager_lambda.lambda_handler(test_event, None)
+        results = response['results'] if test_event['operation'] == 'batch' else [response]
+        assert [result['statusCode'] for result in results] == [400], test_event
+    assert (session_dir / 'upload-1' / 'data').read_bytes() == b'x' * 1000
+
+def make_upload_archives(directory):
+    members = {'docs/a.txt': b'a' * 10, 'docs/sub/b.txt': b'b' * 2000, 'c.txt': b'c'}
+    with zipfile.ZipFile(directory / 'upload.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('docs/', b'')
+        for name, content in members.items():
+            archive.writestr(name, content)
+        archive.writestr('../evil.txt', b'evil')
+        archive.writestr('/abs.txt', b'evil')
+    with tarfile.open(directory / 'upload.tar.gz', 'w:gz') as archive:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+        link = tarfile.TarInfo('link')
+        link.type = tarfile.SYMTYPE
+        link.linkname = '/etc'
+        archive.addfile(link)
+        info = tarfile.TarInfo('docs/../../evil.txt')
+        info.size = 4
+        archive.addfile(info, io.BytesIO(b'evil'))
+    return members
+
+def test_extract(manager_lambda, tmp_path):
+    (tmp_path / 'uploads').mkdir()
+    members = make_upload_archives(tmp_path / 'uploads')
+    for name in ['upload.zip', 'upload.tar.gz']:
+        target = tmp_path / name.replace('.', '_')
+        target.mkdir()
+        test_event = {'operation': 'extract', 'path': str(tmp_path / 'uploads'), 'name': name, 'new_path': str(target), 'workers': 4}
+        extract_response = manager_lambda.lambda_handler(test_event, None)
+        print(extract_response)
+        assert extract_response['statusCode'] == 200
+        assert extract_response['complete'] is True
+        assert extract_response['extracted_files'] == 3
+        assert extract_response['extracted_bytes'] == 2011
+        assert extract_response['skipped'] == 2
+        for member, content in members.items():
+            assert (target / member).read_bytes() == content
+        assert not (tmp_path / 'evil.txt').exists()
+        assert not (target / 'link').exists()
+
+        # extracting again never replaces files unless asked to
+        extract_response = manager_lambda.lambda_handler(test_event, None)
+        assert extract_response['extracted_files'] == 0
+        assert extract_response['skipped'] == 5
+        test_event['overwrite'] = True
+        assert manager_lambda.lambda_handler(test_event, None)['extracted_files'] == 3
+
+def test_extract_continuation(manager_lambda, tmp_path, mocker, monkeypatch):
+    content = {'f{index}.txt'.format(index=index): str(index).encode() * 50 for index in range(5)}
+    content['large.bin'] = os.urandom(1000)
+    # large.bin is staged over several calls, each call passes two budget checks
+    monkeypatch.setattr(manager_lambda, 'EXTRACT_INLINE_SIZE', 100)
+    monkeypatch.setattr(manager_lambda, 'COPY_BUFFER_SIZE', 300)
+    for name, mode in [('upload.tar', 'w'), ('upload.tgz', 'w:gz')]:
+        with tarfile.open(tmp_path / name, mode) as archive:
+            for member, data in content.items():
+                info = tarfile.TarInfo(name + '.out/' + member)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        mocker.patch.object(manager_lambda.time, 'monotonic', side_effect=itertools.count(0, 8))
+        test_event = {'operation': 'extract', 'path': str(tmp_path), 'name': name}
+        calls = 0
+        while True:
+            extract_response = manager_lambda.lambda_handler(test_event, None)
+            calls += 1
+            assert extract_response['statusCode'] == 200
+            if extract_response['complete']:
+                break
+            test_event['continuation'] = extract_response['continuation']
+        mocker.stopall()
+        assert calls > 3
+        assert extract_response['extracted_files'] == 6
+        for member, data in content.items():
+            assert (tmp_path / (name + '.out') / member).read_bytes() == data
+    assert os.listdir(manager_lambda.UPLOAD_SESSION_DIR) == []
+
+def test_extract_keeps_file_created_while_staging(manager_lambda, tmp_path, monkeypatch):
+    monkeypatch.setattr(manager_lambda, 'EXTRACT_INLINE_SIZE', 100)
+    with tarfile.open(tmp_path / 'upload.tar', 'w') as archive:
+        info = tarfile.TarInfo('large.bin')
+        info.size = 1000
+        archive.addfile(info, io.BytesIO(b'x' * 1000))
+    (tmp_path / 'out').mkdir()
+    original_stage = manager_lambda.stage_large_member
+
+    def stage_then_create_target(stream, staging_path, written, size, deadline):
+        (tmp_path / 'out' / 'large.bin').write_bytes(b'mine')
+        return original_stage(stream, staging_path, written, size, deadline)
+
+    monkeypatch.setattr(manager_lambda, 'stage_large_member', stage_then_create_target)
+    test_event = {'operation': 'extract', 'path': str(tmp_path), 'name': 'upload.tar', 'new_path': str(tmp_path / 'out')}
+    extract_response = manager_lambda.lambda_handler(test_event, None)
+    assert extract_response['extracted_files'] == 0
+    assert extract_response['skipped'] == 1
+    assert (tmp_path / 'out' / 'large.bin').read_bytes() == b'mine'
+    assert os.listdir(manager_lambda.UPLOAD_SESSION_DIR) == []
+    test_event['overwrite'] = True
+    assert manager_lambda.lambda_handler(test_event, None)['extracted_files'] == 1
+    assert (tmp_path / 'out' / 'large.bin').read_bytes() == b'x' * 1000
+
+def test_extract_invalid_archive(manager_lambda, tmp_path):
+    (tmp_path / 'notes.txt').write_text('not an archive')
+    test_event = {'operation': 'extract', 'path': str(tmp_path), 'name': 'notes.txt'}
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400
+    test_event['name'] = 'missing.zip'
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 404
+    test_event.update({'name': 'notes.txt', 'continuation': 'garbage'})
+    assert manager_lambda.lambda_handler(test_event, None)['statusCode'] == 400